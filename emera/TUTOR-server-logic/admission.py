@@ -0,0 +1,234 @@
+"""
+Admission control for chat requests.
+
+- Each client has a token bucket of ADMISSION_CLIENT_RATE_PER_MINUTE requests with bursts
+  of ADMISSION_CLIENT_BURST. The client is its IP (client_key): X-Forwarded-For counts only
+  when the peer is a trusted proxy, and X-Client-ID only when signed with the shared secret,
+  so changing a header does not get a fresh bucket.
+- At most ADMISSION_MAX_CONCURRENCY chat chain calls run upstream at once. Coalesced
+  duplicates (single_flight.py) share their leader's slot.
+- Requests beyond that wait in a bounded queue, lesson starts first, then other chat,
+  then casual conversation. A request that waits longer than ADMISSION_QUEUE_TIMEOUT_SECONDS,
+  or finds the queue full of requests at least as important, is rejected.
+
+Rejections raise AdmissionRejected, which the server answers with a 429 and a
+Retry-After header, instead of letting the burst reach Gemini and fail there.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import itertools
+import math
+import time
+from collections import Counter, OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Mapping, Optional, Sequence
+
+from config import (ADMISSION_CLIENT_BURST, ADMISSION_CLIENT_ID_SECRET, ADMISSION_CLIENT_RATE_PER_MINUTE,
+                    ADMISSION_CONTROL_ENABLED, ADMISSION_MAX_CONCURRENCY, ADMISSION_QUEUE_SIZE,
+                    ADMISSION_QUEUE_TIMEOUT_SECONDS, ADMISSION_TRUSTED_PROXIES)
+from logging_config import get_logger
+from metrics import ADMISSION_WAIT
+from rate_limit import TokenBucket
+
+logger = get_logger("admission")
+
+# Lower is served first.
+LESSON = 0
+GENERAL = 1
+CONVERSATIONAL = 2
+PRIORITY_NAMES = {LESSON: "lesson", GENERAL: "general", CONVERSATIONAL: "conversational"}
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Too many requests ({reason}), retry in {retry_after:.0f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+@dataclass(eq=False)
+class _Waiter:
+    priority: int
+    seq: int
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class AdmissionController:
+    """Per-client rate limits plus a global, prioritized limit on concurrent upstream calls (one event loop)."""
+
+    def __init__(self, max_concurrency: int = ADMISSION_MAX_CONCURRENCY, queue_size: int = ADMISSION_QUEUE_SIZE,
+                 queue_timeout: float = ADMISSION_QUEUE_TIMEOUT_SECONDS,
+                 client_rate_per_minute: float = ADMISSION_CLIENT_RATE_PER_MINUTE,
+                 client_burst: float = ADMISSION_CLIENT_BURST, max_clients: int = 10000):
+        self.max_concurrency = max(1, max_concurrency)
+        self.queue_size = max(0, queue_size)
+        self.queue_timeout = queue_timeout
+        self.client_rate = client_rate_per_minute / 60
+        self.client_burst = client_burst
+        self.max_clients = max_clients
+        self._clients: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._queue: List[_Waiter] = []
+        self._active = 0
+        self._seq = itertools.count()
+        # Moving average of how long a call holds its slot, for Retry-After estimates.
+        self._avg_hold = 1.0
+        self._stats = Counter()
+
+    # --- per-client rate limit ---
+    def check_client(self, client_id: str):
+        """Takes one request from the client's bucket, or raises AdmissionRejected."""
+        if self.client_rate <= 0:
+            return
+        bucket = self._clients.get(client_id)
+        if bucket is None:
+            bucket = self._clients[client_id] = TokenBucket(self.client_rate, self.client_burst)
+            if len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+        self._clients.move_to_end(client_id)
+        wait = bucket.try_acquire()
+        if wait:
+            self._stats["rejected_client_rate"] += 1
+            raise AdmissionRejected("client_rate_limited", wait)
+
+    # --- global concurrency with a priority queue ---
+    def _retry_after(self) -> float:
+        return max(1.0, self._avg_hold * (len(self._queue) + 1) / self.max_concurrency)
+
+    def _reject(self, waiter: _Waiter, reason: str):
+        self._queue.remove(waiter)
+        self._stats[f"rejected_{reason}"] += 1
+        if not waiter.future.done():
+            waiter.future.set_exception(AdmissionRejected(reason, self._retry_after()))
+
+    def _expire(self, waiter: _Waiter):
+        if waiter in self._queue:
+            self._reject(waiter, "timeout")
+
+    def _grant_next(self):
+        while self._queue and self._active < self.max_concurrency:
+            waiter = min(self._queue, key=lambda w: (w.priority, w.seq))
+            self._queue.remove(waiter)
+            if waiter.future.done():  # cancelled by its client
+                continue
+            self._active += 1
+            waiter.future.set_result(True)
+
+    async def _acquire(self, priority: int):
+        if self._active < self.max_concurrency and not self._queue:
+            self._active += 1
+            ADMISSION_WAIT.observe(0.0, priority=PRIORITY_NAMES[priority])
+            return
+        if len(self._queue) >= self.queue_size:
+            # A full queue still takes a more important request, by dropping its least important waiter.
+            worst = max(self._queue, key=lambda w: (w.priority, w.seq), default=None)
+            if worst is None or worst.priority <= priority:
+                self._stats["rejected_queue_full"] += 1
+                raise AdmissionRejected("queue_full", self._retry_after())
+            self._reject(worst, "preempted")
+
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(priority, next(self._seq), loop.create_future())
+        self._queue.append(waiter)
+        timer = loop.call_later(self.queue_timeout, self._expire, waiter)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter in self._queue:
+                self._queue.remove(waiter)
+            elif waiter.future.done() and not waiter.future.cancelled() and waiter.future.exception() is None:
+                self._release(0.0)  # granted just as the client went away
+            raise
+        finally:
+            timer.cancel()
+            ADMISSION_WAIT.observe(time.monotonic() - waiter.enqueued_at, priority=PRIORITY_NAMES[priority])
+
+    def _release(self, held: float):
+        self._active -= 1
+        self._avg_hold = 0.9 * self._avg_hold + 0.1 * held
+        self._grant_next()
+
+    @asynccontextmanager
+    async def slot(self, priority: int = GENERAL):
+        """Holds one of the upstream slots for the duration of the block."""
+        await self._acquire(priority)
+        self._stats["admitted"] += 1
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - start)
+
+    def get_stats(self) -> Dict[str, float]:
+        return {"active": self._active, "queued": len(self._queue), "admitted": self._stats.get("admitted", 0),
+                "rejected_client_rate": self._stats.get("rejected_client_rate", 0),
+                "rejected_queue_full": self._stats.get("rejected_queue_full", 0),
+                "rejected_timeout": self._stats.get("rejected_timeout", 0),
+                "rejected_preempted": self._stats.get("rejected_preempted", 0)}
+
+
+# --------------------------------------------------------------------------
+# --- Client identity ---
+# --------------------------------------------------------------------------
+def sign_client_id(client_id: str, secret: Optional[str] = None) -> str:
+    """The X-Client-ID value for client_id: "<id>.<HMAC-SHA256 of id>", keyed with ADMISSION_CLIENT_ID_SECRET."""
+    secret = ADMISSION_CLIENT_ID_SECRET if secret is None else secret
+    signature = hmac.new(secret.encode("utf-8"), client_id.encode("utf-8"), hashlib.sha256).hexdigest()
+    return f"{client_id}.{signature}"
+
+
+def verify_client_id(value: str, secret: Optional[str] = None) -> Optional[str]:
+    """The client ID in a signed X-Client-ID value, or None if there is no secret or the signature is wrong."""
+    secret = ADMISSION_CLIENT_ID_SECRET if secret is None else secret
+    client_id, _, _ = (value or "").rpartition(".")
+    if not secret or not client_id or len(client_id) > 64:
+        return None
+    return client_id if hmac.compare_digest(sign_client_id(client_id, secret), value) else None
+
+
+def _in_networks(address: str, networks) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in networks)
+
+
+def client_key(peer: Optional[str], headers: Mapping[str, str],
+               trusted_proxies: Optional[Sequence[str]] = None, secret: Optional[str] = None) -> str:
+    """
+    The rate limit key of a request from peer. A signed X-Client-ID wins; otherwise the IP,
+    where X-Forwarded-For is followed (from the right) only through trusted proxies.
+    """
+    client_id = verify_client_id(headers.get("x-client-id", ""), secret)
+    if client_id:
+        return f"id:{client_id}"
+    trusted_proxies = ADMISSION_TRUSTED_PROXIES if trusted_proxies is None else trusted_proxies
+    networks = [ipaddress.ip_network(p, strict=False) for p in trusted_proxies]
+    address = peer or "unknown"
+    if networks and _in_networks(address, networks):
+        hops = [hop.strip() for hop in headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+        while hops and _in_networks(address, networks):
+            address = hops.pop()
+    return f"ip:{address}"
+
+
+def retry_after_header(error: AdmissionRejected) -> str:
+    return str(max(1, math.ceil(error.retry_after)))
+
+
+_default_controller: Optional[AdmissionController] = None
+
+
+def get_admission_controller() -> Optional[AdmissionController]:
+    """Returns the shared controller, or None when ADMISSION_CONTROL_ENABLED is off."""
+    global _default_controller
+    if not ADMISSION_CONTROL_ENABLED:
+        return None
+    if _default_controller is None:
+        _default_controller = AdmissionController()
+    return _default_controller
@@ -1,130 +1,223 @@
 import os
+from operator import itemgetter
 from typing import Dict
 
 # LangChain Imports
-from langchain_core.documents import Document
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.prompts import PromptTemplate, ChatPromptTemplate
+from langchain_core.prompts import PromptTemplate
 # THIS LINE FIXES THE ERROR 👇
-from langchain_core.runnables import RunnableBranch, RunnablePassthrough, Runnable
-from langchain_chroma import Chroma
-from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_core.runnables import RunnableBranch, RunnableLambda, RunnablePassthrough, Runnable
+from langchain_google_genai import ChatGoogleGenerativeAI
 
 # Local Imports
 from config import *
 from prompts import *
+from intent_router import TRANSLATOR, GRAMMAR, CONVERSATIONAL, create_routing_chain, get_intent_classifier, resolve_route
+from speculative import SpeculativeAgent
+from response_cache import CachedChain, get_response_cache
+from lesson_cache import CachedLessonChain, get_lesson_cache
+from metrics import metrics_callback
+from kb_index import KnowledgeBaseIndexer, open_vectorstore
+from embedding_cache import get_embedding_cache
+from embedding_backends import create_embeddings, embedding_model_id
+from hybrid_retriever import create_retriever
+from retrieval_cache import with_retrieval_cache
+from llm_client import for_route
+from prompt_budget import compact_prompt
+from session_store import history_text
+from logging_config import get_logger
+
+logger = get_logger("agent")
 
 
 def create_rag_retriever(name: str, data_path: str, db_path: str):
-    """A generic factory to create a RAG retriever for a specific tool."""
+    """
+    A generic factory to create a RAG retriever for a specific tool.
+    The store at db_path is synced with data_path first, so only new or edited chunks are embedded.
+    """
     try:
-        if os.path.exists(db_path):
-            print(f"✅ Loading existing KB for '{name}'.")
-            vectorstore = Chroma(persist_directory=db_path, embedding_function=GoogleGenerativeAIEmbeddings(
-                model=EMBEDDING_MODEL, google_api_key=GOOGLE_API_KEY
-            ))
-            return vectorstore.as_retriever(search_type=RETRIEVER_SEARCH_TYPE, search_kwargs=RETRIEVER_SEARCH_KWARGS)
-
-        print(f"🛠️ Creating new KB for '{name}'.")
-        if not os.path.exists(data_path) or not os.listdir(data_path):
-            print(f"⚠️ Warning: Data directory for '{name}' is empty ('{data_path}'). Tool disabled.")
-            return None
-        
-        documents = [Document(page_content=open(os.path.join(data_path, f), 'r', encoding='utf-8').read()) 
-                     for f in os.listdir(data_path) if f.endswith(".txt")]
-        if not documents:
-            print(f"⚠️ Warning: No .txt files found for '{name}'. Tool disabled.")
+        if not os.path.isdir(data_path) or not any(f.endswith(".txt") for f in os.listdir(data_path)):
+            logger.warning(f"No .txt files found for '{name}' in '{data_path}'. Tool disabled.")
             return None
 
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=150)
-        texts = text_splitter.split_documents(documents)
-        embeddings = GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL, google_api_key=GOOGLE_API_KEY)
-        vectorstore = Chroma.from_documents(documents=texts, embedding=embeddings, persist_directory=db_path)
-        print(f"✅ '{name}' KB is ready.")
-        return vectorstore.as_retriever(search_type=RETRIEVER_SEARCH_TYPE, search_kwargs=RETRIEVER_SEARCH_KWARGS)
+        logger.info(f"Syncing KB for '{name}'.")
+        embeddings = create_embeddings(EMBEDDING_MODEL, get_embedding_cache())
+        vectorstore = open_vectorstore(db_path, embeddings, VECTOR_STORE)
+        # A full rebuild is staged in a new folder and swapped in when complete; the indexer then holds the new store.
+        indexer = KnowledgeBaseIndexer(data_path, db_path, embedding_model=embedding_model_id(EMBEDDING_MODEL),
+                                       open_store=lambda path: open_vectorstore(path, embeddings, VECTOR_STORE))
+        indexer.sync(vectorstore)
+        vectorstore = indexer.vectorstore
+        logger.info(f"'{name}' KB is ready (store: {VECTOR_STORE}, retriever mode: {RETRIEVER_MODE}).")
+        retriever = create_retriever(vectorstore, RETRIEVER_MODE)
+        settings = (embedding_model_id(EMBEDDING_MODEL), VECTOR_STORE, RETRIEVER_MODE)
+        return with_retrieval_cache(retriever, vectorstore, settings=settings)
     
     except Exception as e:
-        print(f"❌ Error creating RAG retriever for '{name}': {e}. Tool disabled.")
+        logger.error(f"Error creating RAG retriever for '{name}': {e}. Tool disabled.")
         return None
 
+def create_curriculum_chain(llm: ChatGoogleGenerativeAI) -> Runnable:
+    """The lesson-teaching chain, without the lesson opening cache (lesson_cache.py warms the cache with it)."""
+    # Nothing is trimmed: the end of a lesson (its practice exercise) matters as much as the start.
+    curriculum_prompt = compact_prompt("curriculum", CURRICULUM_TUTOR_PROMPT)
+    return (
+        curriculum_prompt | for_route(llm, "curriculum") | StrOutputParser()
+    ).with_config(run_name="curriculum")
+
 # --- AGENT ASSEMBLY ---
-def create_tutor_agent(llm: ChatGoogleGenerativeAI, grammar_retriever=None) -> Dict[str, Runnable]:
-    """Assembles the complete agent with routing and returns a dictionary of chains."""
+def create_tutor_agent(llm: ChatGoogleGenerativeAI, grammar_retriever=None, intent_classifier=None,
+                       speculation_mode: str = None, response_cache=None, lesson_cache=None,
+                       grammar_registry=None) -> Dict[str, Runnable]:
+    """
+    Assembles the complete agent with routing and returns a dictionary of chains.
+    If no intent_classifier, response_cache or lesson_cache is passed, the shared ones are used (when enabled).
+    speculation_mode defaults to ROUTER_SPECULATION_MODE from config.py.
+    grammar_registry (a KnowledgeBaseRegistry) picks the grammar retriever by the request's language
+    at call time; it is used instead of grammar_retriever when given.
+    llm may be a ResilientLLM (llm_client.create_llm); each chain then uses its route's timeout.
+    """
     try:
-        print("🔧 Creating tutor agent...")
+        logger.debug("Creating tutor agent")
         
         # --- 1. Define Tool Chains ---
         
         # Grammar chain with RAG or fallback
-        if grammar_retriever:
-            print("✅ Creating grammar chain with RAG retriever")
-            grammar_prompt = ChatPromptTemplate.from_template(GRAMMAR_VOCAB_PROMPT)
-            grammar_chain = (
+        # Prompts are compacted and kept within each chain's token budget (prompt_budget.py);
+        # the fields listed are trimmed in that order, least valuable first.
+        grammar_prompt = compact_prompt("grammar", GRAMMAR_VOCAB_PROMPT, ("history", "context", "current_question"))
+        fallback_grammar_chain = (
+            compact_prompt(
+                "grammar", "You are a {language} grammar expert. Answer this: {current_question}", ("current_question",)
+            ) | for_route(llm, "grammar") | StrOutputParser()
+        ).with_config(run_name="grammar")
+
+        def rag_grammar_chain(retriever):
+            return (
                 {
-                    "context": lambda x: grammar_retriever.invoke(x["current_question"]),
+                    # A runnable, not a lambda, so ainvoke/astream use the retriever's async path.
+                    "context": itemgetter("current_question") | retriever,
                     "language": lambda x: x["language"],
                     "current_question": lambda x: x["current_question"],
-                    "previous_query": lambda x: x["previous_query"],
-                    "previous_response": lambda x: x["previous_response"],
+                    "history": history_text,
                 }
-                | grammar_prompt | llm | StrOutputParser()
-            )
-        else:
-            print("⚠️ Grammar retriever not available, creating fallback.")
-            grammar_chain = (
-                ChatPromptTemplate.from_template(
-                    "You are a {language} grammar expert. Answer this: {current_question}"
-                ) | llm | StrOutputParser()
-            )
+                | grammar_prompt | for_route(llm, "grammar") | StrOutputParser()
+            ).with_config(run_name="grammar")
 
-        print("✅ Creating translator chain")
+        logger.debug("Creating translator chain")
         translator_chain = (
-            ChatPromptTemplate.from_template(TRANSLATOR_PROMPT) | llm | StrOutputParser()
-        )
+            compact_prompt("translator", TRANSLATOR_PROMPT, ("current_question",))
+            | for_route(llm, "translator") | StrOutputParser()
+        ).with_config(run_name="translator")
         
-        print("✅ Creating conversational chain")
+        # Translator and grammar answers are cached; conversational replies are too personal to reuse.
+        response_cache = response_cache or get_response_cache()
+        if response_cache:
+            logger.debug("Adding response cache to translator and grammar chains")
+            translator_chain = CachedChain(translator_chain, response_cache, TRANSLATOR)
+
+        def cached_grammar(chain, retriever=None):
+            # The RAG grammar prompt also depends on the conversation so far and on the knowledge base, so
+            # the history and the retriever's index version are part of the key. A retriever without a
+            # version (retrieval cache off) cannot tell a re-index apart, so its answers are not cached.
+            if not response_cache:
+                return chain
+            if retriever is None:
+                return CachedChain(chain, response_cache, GRAMMAR)
+            version = getattr(retriever, "version", None)
+            if not version:
+                return chain
+            return CachedChain(chain, response_cache, GRAMMAR, ("history", "previous_query", "previous_response"),
+                               version=version)
+
+        if grammar_registry:
+            logger.debug("Creating grammar chain with per-language knowledge bases")
+            cached_fallback = cached_grammar(fallback_grammar_chain)
+
+            def grammar_for_language(x: dict) -> Runnable:
+                # Looked up once per request; a knowledge base evicted meanwhile stays usable for it.
+                retriever, has_knowledge_base = grammar_registry.get(x.get("language"))
+                if retriever is not None:
+                    return cached_grammar(rag_grammar_chain(retriever), retriever)
+                # Fallback answers are not cached while the language's knowledge base is still loading.
+                if has_knowledge_base:
+                    return fallback_grammar_chain
+                return cached_fallback
+
+            grammar_chain = RunnableLambda(grammar_for_language).with_config(run_name="grammar_knowledge_base")
+        elif grammar_retriever:
+            logger.debug("Creating grammar chain with RAG retriever")
+            grammar_chain = cached_grammar(rag_grammar_chain(grammar_retriever), grammar_retriever)
+        else:
+            logger.warning("Grammar retriever not available, creating fallback.")
+            grammar_chain = cached_grammar(fallback_grammar_chain)
+
+        logger.debug("Creating conversational chain")
         conversational_chain = (
-            ChatPromptTemplate.from_template(CONVERSATIONAL_PROMPT) | llm | StrOutputParser()
-        )
+            compact_prompt("conversational", CONVERSATIONAL_PROMPT, ("current_question",))
+            | for_route(llm, "conversational") | StrOutputParser()
+        ).with_config(run_name="conversational")
         
-        print("✅ Creating router chain")
+        logger.debug("Creating router chain")
         # Router chain that decides which tool to use
         router_chain = (
-            PromptTemplate.from_template(ROUTER_PROMPT) | llm | StrOutputParser()
-        )
-
-        # --- 2. Main Agent Branch (for routing general chat) ---
-        print("✅ Creating main agent branch")
-        main_agent_chain = RunnableBranch(
-            (lambda x: "translator" in x.get("tool_choice", "").lower(), translator_chain),
-            (lambda x: "grammar" in x.get("tool_choice", "").lower(), grammar_chain),
-            conversational_chain  # Default branch
-        )
-
-        # The full agent chain that first routes, then executes the chosen tool.
-        print("✅ Creating full agent chain")
-        full_agent_chain = (
-            RunnablePassthrough.assign(tool_choice=router_chain)
-            | main_agent_chain
-        )
+            compact_prompt("router", ROUTER_PROMPT, ("current_question",), prompt_class=PromptTemplate)
+            | for_route(llm, "router") | StrOutputParser()
+        ).with_config(run_name="router")
+        intent_classifier = intent_classifier or get_intent_classifier()
+        speculation_mode = speculation_mode or ROUTER_SPECULATION_MODE
+
+        if speculation_mode != "off":
+            # Router and likely tool chain(s) run concurrently; losers are cancelled.
+            logger.info(f"Creating speculative agent chain (mode: {speculation_mode})")
+            tool_chains = {
+                TRANSLATOR: translator_chain,
+                GRAMMAR: grammar_chain,
+                CONVERSATIONAL: conversational_chain,
+            }
+            full_agent_chain = SpeculativeAgent(router_chain, tool_chains, mode=speculation_mode,
+                                                classifier=intent_classifier)
+        else:
+            # Local fast path: the LLM router is only called for questions the classifier is unsure about.
+            if intent_classifier:
+                logger.debug("Adding local intent classifier in front of the router")
+                router_chain = create_routing_chain(router_chain, intent_classifier)
+
+            # --- 2. Main Agent Branch (for routing general chat) ---
+            logger.debug("Creating main agent branch")
+            main_agent_chain = RunnableBranch(
+                (lambda x: resolve_route(x.get("tool_choice", "")) == TRANSLATOR, translator_chain),
+                (lambda x: resolve_route(x.get("tool_choice", "")) == GRAMMAR, grammar_chain),
+                conversational_chain  # Default branch
+            )
+
+            # The full agent chain that first routes, then executes the chosen tool.
+            logger.debug("Creating full agent chain")
+            full_agent_chain = (
+                RunnablePassthrough.assign(tool_choice=router_chain)
+                | main_agent_chain
+            )
 
         # --- 3. Curriculum Chain (for teaching specific lessons) ---
-        print("✅ Creating curriculum chain")
-        curriculum_prompt = ChatPromptTemplate.from_template(CURRICULUM_TUTOR_PROMPT)
-        curriculum_chain = curriculum_prompt | llm | StrOutputParser()
+        logger.debug("Creating curriculum chain")
+        curriculum_chain = create_curriculum_chain(llm)
 
+        # Lesson openings only depend on the lesson file and language, so they are served from disk when warm.
+        lesson_cache = lesson_cache or get_lesson_cache()
+        if lesson_cache:
+            logger.debug("Adding lesson opening cache to curriculum chain")
+            curriculum_chain = CachedLessonChain(curriculum_chain, lesson_cache)
+
+        # Per-stage latency, time to first token and token counts go to /metrics.
         result = {
-            "agent": full_agent_chain,
-            "curriculum": curriculum_chain
+            "agent": full_agent_chain.with_config(callbacks=[metrics_callback]),
+            "curriculum": curriculum_chain.with_config(callbacks=[metrics_callback])
         }
         
-        print(f"✅ Agent assembled successfully. Created chains: {list(result.keys())}")
+        logger.info(f"Agent assembled successfully. Created chains: {list(result.keys())}")
         return result
     
-    except Exception as e:
+    except Exception:
         # This will catch any errors during the agent creation process
-        print(f"❌ FATAL: Error creating tutor agent: {e}")
-        import traceback
-        print(f"❌ Full traceback: {traceback.format_exc()}")
+        logger.exception("FATAL: Error creating tutor agent")
         return {}
\ No newline at end of file
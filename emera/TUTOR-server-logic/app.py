@@ -1,22 +1,46 @@
+import hashlib
+import hmac
+import os
+import uuid
 import streamlit as st
 import requests
-import os
+from dotenv import load_dotenv
 from typing import Optional
 
+load_dotenv()
+
 # --- CONFIGURATION ---
 API_BASE_URL = "http://127.0.0.1:8000"
 CHAT_ENDPOINT_URL = f"{API_BASE_URL}/chat/stream"
-CURRICULUM_DATA_PATH = "./data/curriculum"
+LESSONS_ENDPOINT_URL = f"{API_BASE_URL}/lessons"
+LANGUAGE = "Sanskrit"
+# Same secret as the backend's (also read from .env); see admission.py.
+ADMISSION_CLIENT_ID_SECRET = os.getenv("ADMISSION_CLIENT_ID_SECRET", "")
 
 # --- HELPER FUNCTIONS ---
+def sign_client_id(client_id: str) -> str:
+    """The X-Client-ID value the backend accepts: "<id>.<HMAC-SHA256 of id>" (admission.sign_client_id)."""
+    signature = hmac.new(ADMISSION_CLIENT_ID_SECRET.encode("utf-8"), client_id.encode("utf-8"), hashlib.sha256)
+    return f"{client_id}.{signature.hexdigest()}"
+
+class TutorBusyError(Exception):
+    """The backend turned the request away (429); the message says when to retry."""
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def fetch_lessons(language: str):
+    """Asks the backend for the lesson list; cached so Streamlit reruns don't refetch it."""
+    response = requests.get(LESSONS_ENDPOINT_URL, params={"language": language}, timeout=10)
+    response.raise_for_status()
+    return response.json().get("lessons", [])
+
 def get_available_lessons():
-    """Scans the curriculum directory to find available lesson files."""
-    if not os.path.exists(CURRICULUM_DATA_PATH):
+    """Returns the available lessons as [{"number": 1, "title": "..."}, ...]."""
+    try:
+        return fetch_lessons(LANGUAGE)
+    except requests.exceptions.RequestException:
+        # Failures are not cached, so the list appears as soon as the backend is up.
         return []
-    
-    lesson_files = [f for f in os.listdir(CURRICULUM_DATA_PATH) if f.startswith("lesson_") and f.endswith(".txt")]
-    lesson_files.sort(key=lambda x: int(x.split('_')[1].split('.')[0]))
-    return lesson_files
 
 # --- REFACTORED API CALL LOGIC ---
 def handle_chat_submission(query: str, display_query: str = None, lesson_number: Optional[int] = None):
@@ -35,15 +59,25 @@ def handle_chat_submission(query: str, display_query: str = None, lesson_number:
     
     request_payload = {
         "query": query,
-        "previous_query": st.session_state.history.get("previous_query"),
-        "previous_response": st.session_state.history.get("previous_response"),
+        "language": LANGUAGE,
+        # The backend keeps the conversation for this session, so earlier turns are not sent back.
+        "session_id": st.session_state.session_id,
         "lesson_to_teach": lesson_number_int
     }
 
     with st.chat_message("assistant", avatar="🤖"):
         full_response = ""
         try:
-            response = requests.post(CHAT_ENDPOINT_URL, json=request_payload, stream=True, timeout=120)
+            # Every student's requests come from this one Streamlit server, so the backend's
+            # per-client rate limit keys on this ID instead of our IP (it is signed, so the
+            # backend can trust it; without ADMISSION_CLIENT_ID_SECRET all students share our IP's limit).
+            headers = ({"X-Client-ID": sign_client_id(st.session_state.client_id)}
+                       if ADMISSION_CLIENT_ID_SECRET else {})
+            response = requests.post(CHAT_ENDPOINT_URL, json=request_payload, stream=True, timeout=120,
+                                     headers=headers)
+            if response.status_code == 429:
+                retry_after = response.headers.get("Retry-After", "a few")
+                raise TutorBusyError(f"⏳ **The tutor is busy**: too many questions right now. Please try again in {retry_after} seconds.")
             response.raise_for_status()
             
             # FIX: Properly handle streaming response
@@ -54,6 +88,9 @@ def handle_chat_submission(query: str, display_query: str = None, lesson_number:
                     message_placeholder.markdown(full_response + "▌")
             message_placeholder.markdown(full_response)
             
+        except TutorBusyError as e:
+            st.warning(str(e))
+            full_response = str(e)
         except requests.exceptions.ConnectionError:
             error_message = f"❌ **Connection Error**: Could not reach the backend server at `{API_BASE_URL}`. Please ensure the backend server is running by executing `python main.py` in a separate terminal."
             st.error(error_message)
@@ -68,7 +105,6 @@ def handle_chat_submission(query: str, display_query: str = None, lesson_number:
             full_response = error_message
     
     st.session_state.messages.append({"role": "assistant", "content": full_response})
-    st.session_state.history = {"previous_query": query, "previous_response": full_response}
     
     if lesson_number_int is not None and lesson_number_int == st.session_state.unlocked_lesson:
         st.session_state.unlocked_lesson += 1
@@ -78,10 +114,12 @@ st.set_page_config(page_title="Sanskrit Tutor Bot", page_icon="🧘", layout="wi
 st.title("Sanskrit Tutor Bot 🧘")
 
 # --- SESSION STATE INITIALIZATION ---
+if "client_id" not in st.session_state:
+    st.session_state.client_id = uuid.uuid4().hex
 if "messages" not in st.session_state:
     st.session_state.messages = []
-if "history" not in st.session_state:
-    st.session_state.history = {"previous_query": None, "previous_response": None}
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
 if "unlocked_lesson" not in st.session_state:
     st.session_state.unlocked_lesson = 1
 if "lesson_to_start" not in st.session_state:
@@ -92,23 +130,19 @@ with st.sidebar:
     st.header("Course Index")
     available_lessons = get_available_lessons()
     
-    unlocked_options = []
-    for lesson_file in available_lessons:
-        lesson_num = int(lesson_file.split('_')[1].split('.')[0])
-        if lesson_num <= st.session_state.unlocked_lesson:
-            unlocked_options.append(lesson_file)
+    unlocked_options = [lesson for lesson in available_lessons if lesson["number"] <= st.session_state.unlocked_lesson]
 
     if not unlocked_options:
-        st.warning("No lesson files found, or files are not named 'lesson_X.txt'.")
+        st.warning("No lessons found. Is the backend running, and are the files named 'lesson_X.txt'?")
     else:
-        selected_lesson_file = st.selectbox(
+        selected_lesson = st.selectbox(
             "Choose a lesson:",
             options=unlocked_options,
-            format_func=lambda x: f"Lesson {x.split('_')[1].split('.')[0]}"
+            format_func=lambda x: x["title"]
         )
         
         if st.button("Start Selected Lesson", use_container_width=True):
-            st.session_state.lesson_to_start = int(selected_lesson_file.split('_')[1].split('.')[0])
+            st.session_state.lesson_to_start = int(selected_lesson["number"])
             st.rerun()
 
 # --- MAIN PAGE LOGIC ---
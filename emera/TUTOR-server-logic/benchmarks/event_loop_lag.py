@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Measures event-loop lag while many /lessons and lesson-start requests run concurrently.
+
+Two modes are compared:
+- blocking:  curriculum and lesson-cache disk access runs inline on the event loop
+             (how the handlers worked before disk access moved to the I/O pool).
+- offloaded: the same disk access runs on the bounded I/O pool (io_pool.run_io).
+
+The curriculum index is set to re-check the disk on every request and an artificial
+delay is added to each disk access, to mimic a slow or network-mounted disk.
+The LLM is a fake, so no API key or network is needed.
+
+Run from the server folder:
+    python benchmarks/event_loop_lag.py --requests 400 --concurrency 50 --disk-latency-ms 5
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+import curriculum_index as curriculum_index_module
+import lesson_cache as lesson_cache_module
+import server
+from agent_logic import create_tutor_agent
+from config import CURRICULUM_PATH
+from curriculum_index import CurriculumIndex
+from lesson_cache import LessonOpeningCache
+from response_cache import InMemoryCacheBackend, ResponseCache
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def _run_inline(func, *args, **kwargs):
+    return func(*args, **kwargs)
+
+
+def _with_delay(func, seconds):
+    def slow(*args, **kwargs):
+        time.sleep(seconds)
+        return func(*args, **kwargs)
+    return slow
+
+
+async def monitor_lag(stop: asyncio.Event, samples: list, interval: float = 0.001):
+    """Sleeps for `interval` repeatedly and records how late each wake-up was."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - start - interval)
+
+
+async def run_mode(mode: str, requests: int, concurrency: int, disk_latency: float) -> dict:
+    run_io = _run_inline if mode == "blocking" else curriculum_index_module.run_io
+    patches = [
+        (curriculum_index_module, "run_io", run_io),
+        (lesson_cache_module, "run_io", run_io),
+        (CurriculumIndex, "_scan", _with_delay(CurriculumIndex._scan, disk_latency)),
+        (LessonOpeningCache, "get", _with_delay(LessonOpeningCache.get, disk_latency)),
+    ]
+    originals = [(target, name, getattr(target, name)) for target, name, _ in patches]
+    for target, name, value in patches:
+        setattr(target, name, value)
+
+    server.curriculum_index = CurriculumIndex(CURRICULUM_PATH, check_interval=0)
+    server.agent_chains.clear()
+    server.agent_chains.update(create_tutor_agent(
+        FakeListChatModel(responses=["Welcome to the lesson!"]),
+        response_cache=ResponseCache(InMemoryCacheBackend(max_entries=100)),
+        lesson_cache=LessonOpeningCache(tempfile.mkdtemp()),
+    ))
+
+    latencies, lag_samples = [], []
+    semaphore = asyncio.Semaphore(concurrency)
+    stop = asyncio.Event()
+
+    async def one_request(client: httpx.AsyncClient, i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            if i % 2:
+                response = await client.get("/lessons", params={"language": "Sanskrit"})
+            else:
+                response = await client.post("/chat", json={"query": "start", "language": "Sanskrit",
+                                                             "lesson_to_teach": 1 + (i // 2) % 3})
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    try:
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            monitor = asyncio.create_task(monitor_lag(stop, lag_samples))
+            started = time.perf_counter()
+            await asyncio.gather(*(one_request(client, i) for i in range(requests)))
+            elapsed = time.perf_counter() - started
+            stop.set()
+            await monitor
+    finally:
+        for target, name, value in originals:
+            setattr(target, name, value)
+
+    to_ms = lambda seconds: round(seconds * 1000, 2)
+    return {
+        "mode": mode,
+        "requests": requests,
+        "concurrency": concurrency,
+        "disk_latency_ms": to_ms(disk_latency),
+        "throughput_rps": round(requests / elapsed, 1),
+        "latency_p50_ms": to_ms(percentile(latencies, 50)),
+        "latency_p99_ms": to_ms(percentile(latencies, 99)),
+        "loop_lag_p50_ms": to_ms(percentile(lag_samples, 50)),
+        "loop_lag_p99_ms": to_ms(percentile(lag_samples, 99)),
+        "loop_lag_max_ms": to_ms(max(lag_samples, default=0.0)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--disk-latency-ms", type=float, default=5.0)
+    parser.add_argument("--mode", choices=["blocking", "offloaded", "both"], default="both")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    modes = ["blocking", "offloaded"] if args.mode == "both" else [args.mode]
+    results = []
+    for mode in modes:
+        # The server logs every request; keep that out of the benchmark output.
+        with contextlib.redirect_stdout(io.StringIO()):
+            results.append(asyncio.run(run_mode(mode, args.requests, args.concurrency, args.disk_latency_ms / 1000)))
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
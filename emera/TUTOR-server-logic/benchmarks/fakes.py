@@ -0,0 +1,135 @@
+"""
+Deterministic stand-ins for the Gemini chat model and embeddings, for benchmarks.
+
+FakeGeminiChat behaves like ChatGoogleGenerativeAI from the chains' point of view:
+it waits `latency` seconds before the first token, then produces tokens at
+`tokens_per_second`, streaming them one by one when the chain streams. Answers to
+ROUTER_PROMPT are a route name picked from keywords, like a real router would.
+
+FakeGeminiEmbeddings returns hashed character n-gram vectors (similar texts get
+similar vectors) after an optional per-call delay.
+
+Neither needs an API key or network access.
+"""
+
+import asyncio
+import hashlib
+import re
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+import numpy as np
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from tokens import estimate_tokens
+
+_WORDS = ("namaste", "dharma", "sandhi", "vibhakti", "dhatu", "samasa", "karaka", "sutra",
+          "shloka", "akshara", "svara", "vyanjana", "linga", "vachana", "lakara", "pratyaya")
+
+
+def _route_for(question: str) -> str:
+    question = question.lower()
+    if re.search(r"\b(translate|translation|mean|meaning)\b", question):
+        return "translator"
+    if re.search(r"\b(grammar|sandhi|case|cases|verb|verbs|noun|declension|conjugat\w*|vibhakti|rule)\b", question):
+        return "grammar_vocab_expert"
+    return "conversational_response"
+
+
+class FakeGeminiChat(BaseChatModel):
+    """Fake chat model with configurable time to first token, token rate and answer length."""
+
+    latency: float = 0.3
+    tokens_per_second: float = 100.0
+    response_tokens: int = 60
+    router_latency: float = 0.15
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-gemini"
+
+    def _prompt(self, messages: List[BaseMessage]) -> str:
+        return "\n".join(str(m.content) for m in messages)
+
+    def _plan(self, messages: List[BaseMessage]):
+        """Returns (first-token delay, tokens) for a prompt; the same prompt always gets the same answer."""
+        prompt = self._prompt(messages)
+        if "ROUTE TO:" in prompt:
+            question = prompt.rsplit("--- DECIDE FOR ---", 1)[-1].split("ROUTE TO:", 1)[0]
+            return self.router_latency, [_route_for(question)]
+        seed = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest(), 16)
+        tokens = [_WORDS[(seed >> (i % 200)) % len(_WORDS)] for i in range(self.response_tokens)]
+        return self.latency, [tokens[0]] + [" " + t for t in tokens[1:]]
+
+    def _message(self, messages: List[BaseMessage], text: str) -> AIMessage:
+        input_tokens = estimate_tokens(self._prompt(messages))
+        output_tokens = estimate_tokens(text)
+        return AIMessage(content=text, usage_metadata={
+            "input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens,
+        })
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        delay, tokens = self._plan(messages)
+        time.sleep(delay + (len(tokens) - 1) / self.tokens_per_second)
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages, "".join(tokens)))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager=None, **kwargs: Any) -> ChatResult:
+        delay, tokens = self._plan(messages)
+        await asyncio.sleep(delay + (len(tokens) - 1) / self.tokens_per_second)
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages, "".join(tokens)))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        delay, tokens = self._plan(messages)
+        for i, token in enumerate(tokens):
+            time.sleep(delay if i == 0 else 1 / self.tokens_per_second)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        delay, tokens = self._plan(messages)
+        for i, token in enumerate(tokens):
+            await asyncio.sleep(delay if i == 0 else 1 / self.tokens_per_second)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+def embed_text(text: str, dim: int = 512) -> np.ndarray:
+    """Hashed character 3-gram vector (unit length)."""
+    vector = np.zeros(dim, dtype=np.float32)
+    for word in text.split(" "):
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            digest = hashlib.blake2b(padded[i:i + 3].encode("utf-8"), digest_size=8).digest()
+            vector[int.from_bytes(digest, "little") % dim] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class FakeGeminiEmbeddings(Embeddings):
+    """Deterministic embeddings with an optional delay per call (one call per batch, like the real API)."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+        self.texts_embedded = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        self.texts_embedded += len(texts)
+        time.sleep(self.latency)
+        return [embed_text(text).tolist() for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
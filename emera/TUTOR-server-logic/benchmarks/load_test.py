@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Load test for the tutor API with a fake Gemini model and fake embeddings.
+
+The API runs in-process under uvicorn on a local port (real HTTP, so streamed
+chunks arrive as they are sent), with the agent built from benchmarks/fakes.py.
+A mix of /chat, /chat/stream, /lessons and lesson-start requests is sent with
+fixed concurrency. Throughput, p50/p95/p99 latency and time to first chunk
+(TTFT, streaming requests only) are reported as JSON, per request kind and overall.
+
+No API key or network access is needed. With the same arguments, runs are
+comparable; pass --baseline to fail (exit code 1) when p95 latency or TTFT got
+worse than a previous result by more than --max-regression.
+
+Run from the server folder:
+    python benchmarks/load_test.py --requests 500 --concurrency 32 --output results.json
+    python benchmarks/load_test.py --requests 500 --concurrency 32 --baseline results.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+import uvicorn
+
+import agent_logic
+import server
+from agent_logic import create_rag_retriever, create_tutor_agent
+from config import CURRICULUM_PATH
+from embedding_backends import is_local_model
+from embedding_cache import EmbeddingStore, with_embedding_cache
+from lesson_cache import LessonOpeningCache
+from response_cache import InMemoryCacheBackend, ResponseCache
+
+from fakes import FakeGeminiChat, FakeGeminiEmbeddings
+
+KINDS = ("chat", "stream", "lessons", "lesson_start")
+DEFAULT_MIX = "chat=2,stream=4,lessons=2,lesson_start=2"
+
+QUESTION_TEMPLATES = (
+    "What does '{word}' mean in verse {n}?",
+    "Translate '{word} {n}' to English",
+    "Explain the grammar rule behind {word} in example {n}",
+    "How do the cases of {word} change in sentence {n}?",
+    "Hello! Any tips for remembering {word} (day {n})?",
+)
+WORDS = ("namaste", "dharma", "gacchati", "ramah", "phalam", "vidya", "agni", "jalam")
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        if kind.strip() not in KINDS:
+            raise argparse.ArgumentTypeError(f"unknown request kind '{kind}', expected one of {KINDS}")
+        mix[kind.strip()] = float(weight or 1)
+    return mix
+
+
+def make_workload(total: int, mix: Dict[str, float], question_pool: int, language: str, lessons: List[int],
+                  seed: int) -> List[dict]:
+    """The list of requests to send; the same arguments always give the same workload."""
+    rng = random.Random(seed)
+    questions = [
+        QUESTION_TEMPLATES[i % len(QUESTION_TEMPLATES)].format(word=WORDS[(i // len(QUESTION_TEMPLATES)) % len(WORDS)], n=i)
+        for i in range(question_pool)
+    ]
+    kinds, weights = zip(*mix.items())
+    workload = []
+    for kind in rng.choices(kinds, weights=weights, k=total):
+        if kind == "lessons":
+            workload.append({"kind": kind, "method": "GET", "url": "/lessons", "params": {"language": language}})
+        elif kind == "lesson_start":
+            workload.append({"kind": kind, "method": "POST", "url": "/chat/stream", "stream": True,
+                             "json": {"query": "start", "language": language, "lesson_to_teach": rng.choice(lessons)}})
+        else:
+            workload.append({"kind": kind, "method": "POST", "url": "/chat/stream" if kind == "stream" else "/chat",
+                             "stream": kind == "stream",
+                             "json": {"query": rng.choice(questions), "language": language}})
+    return workload
+
+
+def install_fake_agent(args, workdir: str) -> dict:
+    """Builds the agent with the fake model (and a grammar retriever on fake embeddings) into the server."""
+    llm = FakeGeminiChat(latency=args.llm_latency_ms / 1000, tokens_per_second=args.tokens_per_second,
+                         response_tokens=args.response_tokens, router_latency=args.router_latency_ms / 1000)
+    embeddings = FakeGeminiEmbeddings(latency=args.embedding_latency_ms / 1000)
+
+    grammar_retriever = None
+    if args.rag:
+        embedding_cache = EmbeddingStore(os.path.join(workdir, "embeddings")) if args.caches else None
+        original = agent_logic.create_embeddings
+        # Local backends run as they would in production; remote ones are replaced by the fake.
+        agent_logic.create_embeddings = lambda model, cache: (
+            original(model, cache) if is_local_model(model) else with_embedding_cache(embeddings, model, embedding_cache))
+        try:
+            grammar_retriever = create_rag_retriever("grammar_vocab", args.grammar_data, os.path.join(workdir, "grammar_db"))
+        finally:
+            agent_logic.create_embeddings = original
+
+    # Caches are built fresh (and empty) so runs do not depend on earlier ones.
+    originals = (agent_logic.get_response_cache, agent_logic.get_lesson_cache)
+    agent_logic.get_response_cache = lambda: None
+    agent_logic.get_lesson_cache = lambda: None
+    try:
+        chains = create_tutor_agent(
+            llm,
+            grammar_retriever=grammar_retriever,
+            response_cache=ResponseCache(InMemoryCacheBackend(max_entries=5000)) if args.caches else None,
+            lesson_cache=LessonOpeningCache(os.path.join(workdir, "lesson_openings")) if args.caches else None,
+        )
+    finally:
+        agent_logic.get_response_cache, agent_logic.get_lesson_cache = originals
+
+    server.agent_chains.clear()
+    server.agent_chains.update(chains)
+    return {"grammar_retriever": grammar_retriever is not None, "embedding_calls": embeddings.calls}
+
+
+@contextlib.contextmanager
+def serve_in_thread():
+    """Runs server.app under uvicorn on a free local port, in its own thread and event loop."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    # The fake agent is installed by hand, so the startup event (which builds the real one) is skipped.
+    uv_server = uvicorn.Server(uvicorn.Config(server.app, lifespan="off", log_level="warning", access_log=False))
+    thread = threading.Thread(target=lambda: asyncio.run(uv_server.serve(sockets=[sock])), daemon=True)
+    thread.start()
+    while not uv_server.started:
+        if not thread.is_alive():
+            raise RuntimeError("uvicorn failed to start")
+        time.sleep(0.01)
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        uv_server.should_exit = True
+        thread.join(timeout=10)
+        sock.close()
+
+
+async def send(client: httpx.AsyncClient, request: dict) -> dict:
+    start = time.perf_counter()
+    ttft = None
+    try:
+        if request.get("stream"):
+            async with client.stream(request["method"], request["url"], json=request.get("json")) as response:
+                async for chunk in response.aiter_raw():
+                    if chunk and ttft is None:
+                        ttft = time.perf_counter() - start
+                status = response.status_code
+        else:
+            response = await client.request(request["method"], request["url"], params=request.get("params"),
+                                            json=request.get("json"))
+            status = response.status_code
+    except httpx.HTTPError:
+        status = 0
+    return {"kind": request["kind"], "status": status, "latency": time.perf_counter() - start, "ttft": ttft}
+
+
+async def drive(base_url: str, workload: List[dict], concurrency: int, warmup: int) -> Tuple[List[dict], float]:
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120, trust_env=False) as client:
+        async def one(request):
+            async with semaphore:
+                return await send(client, request)
+
+        if warmup:
+            await asyncio.gather(*(one(request) for request in workload[:warmup]))
+        started = time.perf_counter()
+        samples = await asyncio.gather(*(one(request) for request in workload[warmup:]))
+        return samples, time.perf_counter() - started
+
+
+def summarize(samples: List[dict], elapsed: float) -> dict:
+    to_ms = lambda seconds: round(seconds * 1000, 2)
+    ok = [s for s in samples if 200 <= s["status"] < 400]
+    latencies = [s["latency"] for s in ok]
+    ttfts = [s["ttft"] for s in ok if s["ttft"] is not None]
+    summary = {
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        "latency_mean_ms": to_ms(sum(latencies) / len(latencies)) if latencies else 0.0,
+        "latency_p50_ms": to_ms(percentile(latencies, 50)),
+        "latency_p95_ms": to_ms(percentile(latencies, 95)),
+        "latency_p99_ms": to_ms(percentile(latencies, 99)),
+    }
+    if ttfts:
+        summary.update({
+            "ttft_p50_ms": to_ms(percentile(ttfts, 50)),
+            "ttft_p95_ms": to_ms(percentile(ttfts, 95)),
+            "ttft_p99_ms": to_ms(percentile(ttfts, 99)),
+        })
+    return summary
+
+
+def compare(result: dict, baseline: dict, max_regression: float, min_regression_ms: float) -> List[str]:
+    """
+    Lists the p95 latency / TTFT values that are more than max_regression (a fraction)
+    and more than min_regression_ms worse than the baseline.
+    """
+    if result["config"] != baseline.get("config"):
+        print("⚠️ Baseline was run with different arguments; the comparison may not be meaningful.", file=sys.stderr)
+    regressions = []
+    for kind, summary in result["results"].items():
+        before = baseline.get("results", {}).get(kind, {})
+        for metric in ("latency_p95_ms", "ttft_p95_ms"):
+            if metric in summary and before.get(metric):
+                change = summary[metric] / before[metric] - 1
+                if change > max_regression and summary[metric] - before[metric] > min_regression_ms:
+                    regressions.append(f"{kind}.{metric}: {before[metric]} -> {summary[metric]} ms (+{change:.0%})")
+    return regressions
+
+
+def run(args) -> dict:
+    lessons = [lesson.number for lesson in server.curriculum_index.lessons(args.language)] or [1]
+    workload = make_workload(args.warmup + args.requests, parse_mix(args.mix), args.question_pool,
+                             args.language, lessons, args.seed)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        setup = install_fake_agent(args, workdir)
+        # The server logs every request; keep that out of the benchmark output.
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            with serve_in_thread() as base_url:
+                samples, elapsed = asyncio.run(drive(base_url, workload, args.concurrency, args.warmup))
+
+    results = {"overall": summarize(samples, elapsed)}
+    for kind in KINDS:
+        kind_samples = [s for s in samples if s["kind"] == kind]
+        if kind_samples:
+            results[kind] = summarize(kind_samples, elapsed)
+
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "max_regression", "min_regression_ms")}
+    return {"config": config, "setup": setup, "results": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--warmup", type=int, default=20, help="requests sent first and left out of the results")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"relative weights of {', '.join(KINDS)} (default: {DEFAULT_MIX})")
+    parser.add_argument("--language", default="Sanskrit")
+    parser.add_argument("--question-pool", type=int, default=200, help="number of distinct chat questions")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--llm-latency-ms", type=float, default=300, help="fake model time to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=100)
+    parser.add_argument("--response-tokens", type=int, default=60)
+    parser.add_argument("--router-latency-ms", type=float, default=150, help="fake model latency for router prompts")
+    parser.add_argument("--embedding-latency-ms", type=float, default=50, help="fake embeddings latency per call")
+    parser.add_argument("--grammar-data", default=os.path.join(CURRICULUM_PATH, "sanskrit", "grammar_vocab"))
+    parser.add_argument("--no-rag", dest="rag", action="store_false", help="run the grammar tool without a retriever")
+    parser.add_argument("--no-caches", dest="caches", action="store_false",
+                        help="disable the response, lesson opening and embedding caches")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    parser.add_argument("--baseline", help="earlier JSON result to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="allowed p95 increase over the baseline, as a fraction (default: 0.2)")
+    parser.add_argument("--min-regression-ms", type=float, default=50,
+                        help="p95 increases smaller than this are ignored, since fast endpoints are noisy (default: 50)")
+    args = parser.parse_args()
+
+    result = run(args)
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(result, json.load(f), args.max_regression, args.min_regression_ms)
+        for line in regressions:
+            print(f"❌ Regression: {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Compares the Chroma and NumPy vector stores (VECTOR_STORE in config.py) on a synthetic
+knowledge base: time to open a built store, top-k search and MMR search latency.
+
+Vectors come from the local hashed n-gram backend and query vectors are computed up
+front, so only the stores are measured. No API key or network is needed.
+
+Run from the server folder:
+    python benchmarks/vector_store.py --chunks 2000 --queries 200
+    python benchmarks/vector_store.py --chunks 20000 --dim 768 --output vector_store.json
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding_backends import HashedNgramEmbeddings
+from kb_index import open_vectorstore, write_vectors
+
+WORDS = ("sandhi vibhakti dhātu lakāra samāsa kāraka pratyaya upasarga avyaya visarga anusvāra guṇa vṛddhi "
+         "noun verb case root tense compound suffix prefix declension conjugation sound vowel consonant "
+         "nominative accusative instrumental dative ablative genitive locative vocative singular dual plural "
+         "धर्म कर्म राम वन गच्छति पठति बालक फल जल नदी").split()
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def summarize(durations):
+    ms = [d * 1000 for d in durations]
+    return {"p50_ms": round(percentile(ms, 50), 3), "p95_ms": round(percentile(ms, 95), 3),
+            "mean_ms": round(sum(ms) / len(ms), 3) if ms else 0.0}
+
+
+def synthetic_corpus(count, rng):
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(40, 120))) for _ in range(count)]
+
+
+def timed(func, inputs):
+    durations = []
+    for item in inputs:
+        start = time.perf_counter()
+        func(item)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def bench_store(kind, db_path, embeddings, texts, vectors, query_vectors, k, fetch_k):
+    ids = [f"chunk-{i}" for i in range(len(texts))]
+    metadatas = [{"source": "synthetic.txt", "chunk_id": chunk_id} for chunk_id in ids]
+
+    start = time.perf_counter()
+    write_vectors(open_vectorstore(db_path, embeddings, kind), ids, texts, metadatas, vectors)
+    build_s = time.perf_counter() - start
+
+    # Opening a built store, as the server does at startup.
+    start = time.perf_counter()
+    store = open_vectorstore(db_path, embeddings, kind)
+    store.similarity_search_by_vector(query_vectors[0], k=k)
+    load_s = time.perf_counter() - start
+
+    top_k = timed(lambda q: store.similarity_search_by_vector(q, k=k), query_vectors)
+    mmr = timed(lambda q: store.max_marginal_relevance_search_by_vector(q, k=k, fetch_k=fetch_k), query_vectors)
+    result = {"build_ms": round(build_s * 1000, 1), "load_ms": round(load_s * 1000, 2),
+              "top_k": summarize(top_k), "mmr": summarize(mmr)}
+
+    if hasattr(store, "similarity_search_by_vectors"):
+        start = time.perf_counter()
+        store.similarity_search_by_vectors(query_vectors, k=k)
+        result["batched_top_k_per_query_ms"] = round((time.perf_counter() - start) * 1000 / len(query_vectors), 3)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--fetch-k", type=int, default=20)
+    parser.add_argument("--stores", default="chroma,numpy", help="comma-separated: chroma, numpy")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    embeddings = HashedNgramEmbeddings(dim=args.dim)
+    texts = synthetic_corpus(args.chunks, rng)
+    vectors = embeddings.embed_documents(texts)
+    query_vectors = embeddings.embed_documents([" ".join(rng.sample(WORDS, 4)) for _ in range(args.queries)])
+
+    report = {"chunks": args.chunks, "queries": args.queries, "dim": args.dim, "k": args.k,
+              "fetch_k": args.fetch_k, "stores": {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        for kind in args.stores.split(","):
+            report["stores"][kind] = bench_store(kind, os.path.join(tmp, kind), embeddings, texts, vectors,
+                                                 query_vectors, args.k, args.fetch_k)
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
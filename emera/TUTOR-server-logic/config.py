@@ -14,11 +14,113 @@ LLM_MODEL = os.getenv("LLM_MODEL", "gemini-1.5-flash")
 LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0.1"))
 
 # This is the model used to create numerical representations (embeddings) of text for the RAG system.
+# "models/..." uses the Gemini API; "local:hashed-ngram" embeds on the CPU, with no network calls.
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "models/embedding-001")
 
+# Vector size of local embedding backends.
+LOCAL_EMBEDDING_DIM = int(os.getenv("LOCAL_EMBEDDING_DIM", "768"))
+
 # Google API Key - Set this as an environment variable
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
+# --------------------------------------------------------------------------
+# --- LLM Client Resilience ---
+# --------------------------------------------------------------------------
+# Models tried, in order, when LLM_MODEL keeps failing or its circuit is open (comma-separated).
+LLM_FALLBACK_MODELS = [m.strip() for m in os.getenv("LLM_FALLBACK_MODELS", "").split(",") if m.strip()]
+
+# Seconds to wait for an answer (for streams: for each chunk) before the call counts as failed.
+# LLM_ROUTE_TIMEOUTS overrides it per chain: "router=8,translator=20,...".
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+LLM_ROUTE_TIMEOUTS = {
+    route.strip(): float(seconds)
+    for route, _, seconds in (item.partition("=") for item in os.getenv(
+        "LLM_ROUTE_TIMEOUTS", "router=8,translator=20,grammar=30,conversational=20,curriculum=45").split(","))
+    if route.strip() and seconds.strip()
+}
+
+# Timeouts and transient errors are retried on the same model with exponential backoff (seconds) and jitter.
+# Quota errors (429) go straight to the next model.
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+
+# Hedging: if a call has not answered (or streamed its first chunk) after the route's p95 latency, a second,
+# identical call is started and whichever answers first is used. Costs extra tokens on slow calls.
+# LLM_HEDGE_DELAY_SECONDS is used until LLM_HEDGE_MIN_SAMPLES latencies have been seen.
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+LLM_HEDGE_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_DELAY_SECONDS", "3"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+
+# A model that fails this many times in a row is skipped (circuit open) for LLM_CIRCUIT_RESET_SECONDS,
+# then given one trial call.
+LLM_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD", "5"))
+LLM_CIRCUIT_RESET_SECONDS = float(os.getenv("LLM_CIRCUIT_RESET_SECONDS", "30"))
+
+# --------------------------------------------------------------------------
+# --- Prompt Budgets ---
+# --------------------------------------------------------------------------
+# Prompts are compacted before they are sent: fields repeated in a template are sent once, retrieved
+# chunks are listed as short numbered passages, and each chain's prompt is kept within its token budget
+# (PROMPT_TOKEN_BUDGETS: "chain=tokens,..."; 0 = no limit) by trimming its least valuable parts first.
+# Lessons are never trimmed; a curriculum budget only logs a warning for lessons that exceed it.
+PROMPT_COMPACTION_ENABLED = os.getenv("PROMPT_COMPACTION_ENABLED", "true").lower() == "true"
+PROMPT_TOKEN_BUDGETS = {
+    chain.strip(): int(tokens)
+    for chain, _, tokens in (item.partition("=") for item in os.getenv(
+        "PROMPT_TOKEN_BUDGETS", "router=800,translator=1000,grammar=2500,conversational=1000"
+    ).split(","))
+    if chain.strip() and tokens.strip()
+}
+
+# --------------------------------------------------------------------------
+# --- Routing Configuration ---
+# --------------------------------------------------------------------------
+# When enabled, a local keyword + n-gram classifier picks the tool for general chat
+# and the LLM router is only called when the classifier is unsure.
+INTENT_CLASSIFIER_ENABLED = os.getenv("INTENT_CLASSIFIER_ENABLED", "true").lower() == "true"
+
+# Below this confidence (0-1) the question is sent to the LLM router instead.
+INTENT_CONFIDENCE_THRESHOLD = float(os.getenv("INTENT_CONFIDENCE_THRESHOLD", "0.75"))
+
+# Speculative execution for turns that still need the LLM router:
+# "off"  - call the router, then the chosen tool (sequential).
+# "top1" - start the classifier's best-guess tool while the router is running.
+# "all"  - start every tool while the router is running; losers are cancelled.
+ROUTER_SPECULATION_MODE = os.getenv("ROUTER_SPECULATION_MODE", "off").lower()
+
+# --------------------------------------------------------------------------
+# --- Response Cache Configuration ---
+# --------------------------------------------------------------------------
+# Caches translator and grammar answers. "memory", "sqlite" or "off".
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory").lower()
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "./cache/responses.sqlite3")
+
+# Cached answers expire after this many seconds (0 = never); the least recently used go first when full.
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+
+# --------------------------------------------------------------------------
+# --- Conversation Sessions ---
+# --------------------------------------------------------------------------
+# Chat history kept by the server per session_id, instead of the client sending the previous turn back.
+# "memory", "sqlite", "redis" (any Redis-compatible server at SESSION_STORE_URL) or "off".
+SESSION_STORE_BACKEND = os.getenv("SESSION_STORE_BACKEND", "memory").lower()
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", "./cache/sessions.sqlite3")
+SESSION_STORE_URL = os.getenv("SESSION_STORE_URL", "redis://localhost:6379/0")
+
+# Sessions expire this many seconds after their last turn; each keeps its last SESSION_MAX_TURNS turns.
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", str(6 * 3600)))
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "20"))
+
+# Memory cap of the in-memory backend: the least recently active sessions are dropped first.
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+SESSION_STORE_MAX_MB = float(os.getenv("SESSION_STORE_MAX_MB", "64"))
+
+# Tokens of history put into the grammar prompt: the newest turns in full, older answers
+# shortened and the oldest turns reduced to their questions.
+SESSION_HISTORY_TOKEN_BUDGET = int(os.getenv("SESSION_HISTORY_TOKEN_BUDGET", "600"))
+
 # --------------------------------------------------------------------------
 # --- Server Configuration ---
 # --------------------------------------------------------------------------
@@ -26,6 +128,33 @@ GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
 SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
 
+# Threads for blocking disk access (lesson files, caches), so it never runs on the event loop.
+FILE_IO_MAX_WORKERS = int(os.getenv("FILE_IO_MAX_WORKERS", "8"))
+
+# Threads for vector store searches made by async requests (the query embedding itself is awaited).
+# Bounded so a burst of grammar questions queues here instead of taking over the default executor.
+RETRIEVAL_MAX_WORKERS = int(os.getenv("RETRIEVAL_MAX_WORKERS", "4"))
+
+# Identical chat requests (same chain and input) that arrive while one is still being answered share its
+# model call and its answer or stream, e.g. a whole class starting the same lesson at once.
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+
+# Admission control for /chat and /chat/stream. At most ADMISSION_MAX_CONCURRENCY chain calls go upstream at once;
+# the rest wait (lesson starts first, casual chat last) in a queue of ADMISSION_QUEUE_SIZE for up to
+# ADMISSION_QUEUE_TIMEOUT_SECONDS. Each client may also send ADMISSION_CLIENT_RATE_PER_MINUTE requests, with
+# bursts of ADMISSION_CLIENT_BURST. Rejected requests get a 429.
+ADMISSION_CONTROL_ENABLED = os.getenv("ADMISSION_CONTROL_ENABLED", "true").lower() == "true"
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "16"))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "100"))
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "15"))
+ADMISSION_CLIENT_RATE_PER_MINUTE = float(os.getenv("ADMISSION_CLIENT_RATE_PER_MINUTE", "60"))
+ADMISSION_CLIENT_BURST = float(os.getenv("ADMISSION_CLIENT_BURST", "20"))
+# A client is its IP address. X-Forwarded-For is only believed from ADMISSION_TRUSTED_PROXIES (comma-separated
+# IPs or CIDRs, e.g. "10.0.0.0/8"), and X-Client-ID only when signed with ADMISSION_CLIENT_ID_SECRET, which the
+# Streamlit app shares so its students are limited one by one instead of all behind its IP.
+ADMISSION_TRUSTED_PROXIES = [p.strip() for p in os.getenv("ADMISSION_TRUSTED_PROXIES", "").split(",") if p.strip()]
+ADMISSION_CLIENT_ID_SECRET = os.getenv("ADMISSION_CLIENT_ID_SECRET", "")
+
 # Frontend server configuration
 STREAMLIT_PORT = int(os.getenv("STREAMLIT_PORT", "8501"))
 
@@ -38,6 +167,12 @@ DEBUG = os.getenv("DEBUG", "false").lower() == "true"
 # Verbose logging
 VERBOSE_LOGGING = os.getenv("VERBOSE_LOGGING", "false").lower() == "true"
 
+# Log output: "json" (one object per line) or "text".
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+
+# With VERBOSE_LOGGING (but not DEBUG), only this fraction of debug lines is written.
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.1"))
+
 # --------------------------------------------------------------------------
 # --- RAG (Retrieval-Augmented Generation) Configuration ---
 # --------------------------------------------------------------------------
@@ -49,9 +184,60 @@ CURRICULUM_DATA_PATH = os.getenv("CURRICULUM_DATA_PATH", "./data/curriculum")
 CURRICULUM_DB_PATH = os.getenv("CURRICULUM_DB_PATH", "./chroma_db_curriculum")
 
 # For the tool that answers general questions about grammar and vocabulary.
+# The server builds one knowledge base per language, from <CURRICULUM_PATH>/<language>/grammar_vocab
+# into GRAMMAR_DB_PATH/<language>; GRAMMAR_DATA_PATH is the default folder of `python kb_index.py sync`.
 GRAMMAR_DATA_PATH = os.getenv("GRAMMAR_DATA_PATH", "./data/grammar_vocab")
 GRAMMAR_DB_PATH = os.getenv("GRAMMAR_DB_PATH", "./chroma_db_grammar")
 
+# Use the grammar knowledge bases. Each one is loaded in the background on the first grammar question
+# in its language; until it is ready, and when this is off, the grammar tool answers without retrieval.
+GRAMMAR_RAG_ENABLED = os.getenv("GRAMMAR_RAG_ENABLED", "true").lower() == "true"
+
+# Languages whose knowledge base is loaded right after startup instead of on first use (comma-separated).
+KB_PRELOAD_LANGUAGES = [l.strip() for l in os.getenv("KB_PRELOAD_LANGUAGES", "").split(",") if l.strip()]
+
+# At most this many knowledge bases (and this much store data, in MB; 0 = no limit) stay in memory.
+# The least recently used one is dropped first and reloaded from its synced store when needed again.
+KB_MAX_RESIDENT = int(os.getenv("KB_MAX_RESIDENT", "4"))
+KB_MAX_RESIDENT_MB = float(os.getenv("KB_MAX_RESIDENT_MB", "0"))
+
+# Knowledge bases built or loaded at the same time.
+KB_BUILD_WORKERS = int(os.getenv("KB_BUILD_WORKERS", "1"))
+
+# How knowledge base files are split into chunks before embedding.
+# Changing either value re-embeds the whole knowledge base on the next sync.
+RAG_CHUNK_SIZE = int(os.getenv("RAG_CHUNK_SIZE", "1000"))
+RAG_CHUNK_OVERLAP = int(os.getenv("RAG_CHUNK_OVERLAP", "150"))
+
+# Where chunk vectors are kept. "chroma": a Chroma collection. "numpy": one float32 matrix in memory
+# (memory-mapped from the store folder), searched with matrix products; loads in milliseconds and is
+# faster than Chroma for small knowledge bases (up to tens of thousands of chunks).
+VECTOR_STORE = os.getenv("VECTOR_STORE", "chroma").lower()
+
+# --------------------------------------------------------------------------
+# --- Knowledge Base Embedding Pipeline ---
+# --------------------------------------------------------------------------
+# Chunks are embedded in batches of this size (the Gemini API accepts up to 100 texts per call).
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "100"))
+
+# How many batches may be in flight at once.
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))
+
+# Client-side limit on embedding calls, so large builds stay under the API quota.
+EMBEDDING_REQUESTS_PER_MINUTE = float(os.getenv("EMBEDDING_REQUESTS_PER_MINUTE", "300"))
+
+# Rate-limit (429) and transient errors are retried with exponential backoff (seconds) and jitter.
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "6"))
+EMBEDDING_BACKOFF_BASE = float(os.getenv("EMBEDDING_BACKOFF_BASE", "2"))
+EMBEDDING_BACKOFF_MAX = float(os.getenv("EMBEDDING_BACKOFF_MAX", "60"))
+
+# Embeddings of knowledge base chunks are kept on disk (keyed by model and text), so rebuilds do not call
+# the embedding API again. Grammar question embeddings are only kept in memory, for the last
+# EMBEDDING_QUERY_CACHE_SIZE distinct questions, since every student question would otherwise stay on disk forever.
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "./cache/embeddings")
+EMBEDDING_QUERY_CACHE_SIZE = int(os.getenv("EMBEDDING_QUERY_CACHE_SIZE", "5000"))
+
 # --------------------------------------------------------------------------
 # --- Retriever Search Configuration ---
 # --------------------------------------------------------------------------
@@ -63,6 +249,35 @@ RETRIEVER_SEARCH_TYPE = "mmr"
 # 'fetch_k' is the number of documents to initially fetch before re-ranking for diversity.
 RETRIEVER_SEARCH_KWARGS = {'k': 4, 'fetch_k': 20}
 
+# "hybrid": BM25 keyword search fused with vector search (reciprocal rank fusion); a short query that
+# clearly matches one chunk is answered by BM25 alone, without embedding the query.
+# "vector": vector search only (RETRIEVER_SEARCH_TYPE). "lexical": BM25 only, no embedding calls at query time.
+RETRIEVER_MODE = os.getenv("RETRIEVER_MODE", "hybrid").lower()
+
+# Rank constant of reciprocal rank fusion (higher = ranks matter less).
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+
+# The top BM25 chunk must score this many times the runner-up to skip vector search.
+HYBRID_LEXICAL_MARGIN = float(os.getenv("HYBRID_LEXICAL_MARGIN", "1.5"))
+
+# Chunks found for a (normalized) grammar question are remembered, so the same question asked again,
+# or asked by many students at once, runs the embedding and search only once per knowledge base version.
+RETRIEVAL_CACHE_ENABLED = os.getenv("RETRIEVAL_CACHE_ENABLED", "true").lower() == "true"
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.getenv("RETRIEVAL_CACHE_MAX_ENTRIES", "2048"))
+
+# --------------------------------------------------------------------------
+# --- Lesson Opening Cache ---
+# --------------------------------------------------------------------------
+# Lesson files served by the API, one folder per language (e.g. curriculum/sanskrit/lesson_1.txt).
+CURRICULUM_PATH = os.getenv("CURRICULUM_PATH", "curriculum")
+
+# Lessons are kept in memory; lesson files are re-checked for changes at most this often (seconds).
+CURRICULUM_INDEX_CHECK_INTERVAL = float(os.getenv("CURRICULUM_INDEX_CHECK_INTERVAL", "2"))
+
+# Pre-rendered lesson openings. Fill with `python lesson_cache.py warm`.
+LESSON_CACHE_ENABLED = os.getenv("LESSON_CACHE_ENABLED", "true").lower() == "true"
+LESSON_CACHE_DIR = os.getenv("LESSON_CACHE_DIR", "./cache/lesson_openings")
+
 # --------------------------------------------------------------------------
 # --- Controlled Lesson Flow Configuration ---
 # --------------------------------------------------------------------------
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from config import CURRICULUM_INDEX_CHECK_INTERVAL, CURRICULUM_PATH, LESSON_FILENAME_PREFIX
+from io_pool import run_io
+from logging_config import get_logger
+
+logger = get_logger("curriculum")
+
+LESSON_FILE_PATTERN = re.compile(rf"^{re.escape(LESSON_FILENAME_PREFIX)}(\d+)\.txt$")
+
+
+@dataclass(frozen=True)
+class LessonEntry:
+    number: int
+    title: str
+    content: str
+    size: int
+    content_hash: str
+    mtime_ns: int
+    path: str
+
+
+def _read_lesson(number: int, path: str, stat: os.stat_result) -> LessonEntry:
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read()
+    lines = content.splitlines()
+    title = (lines[0].strip() if lines else "") or f"Lesson {number}"
+    return LessonEntry(
+        number=number,
+        title=title,
+        content=content,
+        size=stat.st_size,
+        content_hash=hashlib.sha256(content.encode("utf-8")).hexdigest(),
+        mtime_ns=stat.st_mtime_ns,
+        path=path,
+    )
+
+
+class CurriculumIndex:
+    """
+    All lessons under curriculum/<language>/lesson_N.txt, held in memory.
+
+    Reads go to memory. At most once every check_interval seconds a read also stats
+    the lesson files and reloads the ones whose mtime or size changed, so edits,
+    new lessons and deletions show up without a restart.
+
+    Async code should use the a* methods, which do that disk check on the I/O pool.
+    """
+
+    def __init__(self, root: str = CURRICULUM_PATH, check_interval: float = CURRICULUM_INDEX_CHECK_INTERVAL):
+        self.root = root
+        self.check_interval = check_interval
+        self._languages: Dict[str, Dict[int, LessonEntry]] = {}
+        self._etags: Dict[str, str] = {}
+        self._last_check: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _check_due(self) -> bool:
+        return self._last_check is None or time.monotonic() - self._last_check >= self.check_interval
+
+    def refresh(self, force: bool = False) -> bool:
+        """Rescans the curriculum folder if the check interval has passed. Returns True if it scanned."""
+        if not force and not self._check_due():
+            return False
+        with self._lock:
+            if not force and not self._check_due():
+                return False
+            self._scan()
+            self._last_check = time.monotonic()
+        return True
+
+    def _scan(self):
+        languages: Dict[str, Dict[int, LessonEntry]] = {}
+        if os.path.isdir(self.root):
+            for language_dir in os.scandir(self.root):
+                if not language_dir.is_dir():
+                    continue
+                known = self._languages.get(language_dir.name, {})
+                lessons = {}
+                for file_entry in os.scandir(language_dir.path):
+                    match = LESSON_FILE_PATTERN.match(file_entry.name)
+                    if not match or not file_entry.is_file():
+                        continue
+                    number = int(match.group(1))
+                    stat = file_entry.stat()
+                    previous = known.get(number)
+                    if previous and previous.mtime_ns == stat.st_mtime_ns and previous.size == stat.st_size:
+                        lessons[number] = previous
+                        continue
+                    try:
+                        lessons[number] = _read_lesson(number, file_entry.path, stat)
+                    except (OSError, UnicodeDecodeError) as e:
+                        logger.warning(f"Error reading {file_entry.path}: {e}")
+                languages[language_dir.name] = dict(sorted(lessons.items()))
+
+        etags = {}
+        for language, lessons in languages.items():
+            listing = json.dumps([[entry.number, entry.title] for entry in lessons.values()], ensure_ascii=False)
+            etags[language] = '"' + hashlib.sha256(listing.encode("utf-8")).hexdigest()[:20] + '"'
+        self._languages, self._etags = languages, etags
+
+    def _language(self, language: str) -> Dict[int, LessonEntry]:
+        return self._languages.get((language or "").lower(), {})
+
+    def languages(self) -> List[str]:
+        self.refresh()
+        return sorted(self._languages)
+
+    def lessons(self, language: str) -> List[LessonEntry]:
+        self.refresh()
+        return list(self._language(language).values())
+
+    def get_lesson(self, language: str, number: int) -> Optional[LessonEntry]:
+        self.refresh()
+        return self._language(language).get(number)
+
+    def etag(self, language: str) -> Optional[str]:
+        """ETag of the lesson list (numbers and titles) for a language."""
+        self.refresh()
+        return self._etags.get((language or "").lower())
+
+    async def arefresh(self, force: bool = False) -> bool:
+        # The common case (no check due) stays on the loop and costs nothing.
+        if not force and not self._check_due():
+            return False
+        return await run_io(self.refresh, force)
+
+    async def alanguages(self) -> List[str]:
+        await self.arefresh()
+        return sorted(self._languages)
+
+    async def alessons(self, language: str) -> List[LessonEntry]:
+        await self.arefresh()
+        return list(self._language(language).values())
+
+    async def aget_lesson(self, language: str, number: int) -> Optional[LessonEntry]:
+        await self.arefresh()
+        return self._language(language).get(number)
+
+    async def aetag(self, language: str) -> Optional[str]:
+        await self.arefresh()
+        return self._etags.get((language or "").lower())
+
+
+_default_index: Optional[CurriculumIndex] = None
+
+
+def get_curriculum_index() -> CurriculumIndex:
+    global _default_index
+    if _default_index is None:
+        _default_index = CurriculumIndex()
+    return _default_index
@@ -0,0 +1,117 @@
+"""
+Embedding backends, selected by EMBEDDING_MODEL.
+
+- "models/..." (e.g. "models/embedding-001"): Gemini embeddings over the network,
+  wrapped with the on-disk embedding cache.
+- "local:hashed-ngram": a CPU vectorizer of hashed character n-grams and words.
+  No model download and no network; a batch of texts is embedded with a few NumPy
+  operations, so query embedding takes well under a millisecond.
+
+Other local backends can be added with register_backend("name", factory), where
+factory(dim) returns a LangChain Embeddings object; they are then selected with
+EMBEDDING_MODEL="local:name".
+"""
+
+import math
+import zlib
+from collections import Counter
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from config import EMBEDDING_MODEL, GOOGLE_API_KEY, LOCAL_EMBEDDING_DIM
+from embedding_cache import EmbeddingStore, with_embedding_cache
+from hybrid_retriever import tokenize
+
+LOCAL_PREFIX = "local:"
+
+
+class HashedNgramEmbeddings(Embeddings):
+    """
+    Signed feature hashing of character 2-4-grams and whole words (Devanagari- and
+    IAST-aware via hybrid_retriever.tokenize), sublinear term frequency, unit length.
+    Texts sharing spellings, stems or words get similar vectors.
+    """
+
+    def __init__(self, dim: int = LOCAL_EMBEDDING_DIM, ngram_range=(2, 4), word_weight: float = 2.0):
+        self.dim = dim
+        self.ngram_range = ngram_range
+        self.word_weight = word_weight
+
+    def _features(self, text: str) -> Counter:
+        features = Counter()
+        low, high = self.ngram_range
+        for word in tokenize(text):
+            features["w " + word] += self.word_weight
+            padded = f" {word} "
+            for n in range(low, high + 1):
+                for i in range(len(padded) - n + 1):
+                    features[padded[i:i + n]] += 1
+        return features
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        rows, columns, values = [], [], []
+        for row, text in enumerate(texts):
+            for feature, count in self._features(text).items():
+                h = zlib.crc32(feature.encode("utf-8"))
+                rows.append(row)
+                columns.append(h % self.dim)
+                # The sign bit keeps hash collisions from always adding up.
+                values.append((1.0 + math.log(count)) * (1.0 if (h // self.dim) & 1 else -1.0))
+        flat = np.asarray(rows, dtype=np.int64) * self.dim + np.asarray(columns, dtype=np.int64)
+        matrix = np.bincount(flat, weights=values, minlength=len(texts) * self.dim).reshape(len(texts), self.dim)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = (matrix / np.where(norms == 0, 1.0, norms)).astype(np.float32)
+        return matrix.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    # Pure CPU and well under a millisecond, so async callers compute inline instead of on a thread.
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return self.embed_query(text)
+
+
+_LOCAL_BACKENDS: Dict[str, Callable[[int], Embeddings]] = {
+    "hashed-ngram": lambda dim: HashedNgramEmbeddings(dim=dim),
+}
+
+
+def register_backend(name: str, factory: Callable[[int], Embeddings]):
+    """Makes EMBEDDING_MODEL="local:<name>" use factory(LOCAL_EMBEDDING_DIM)."""
+    _LOCAL_BACKENDS[name] = factory
+
+
+def is_local_model(model: str) -> bool:
+    return (model or "").startswith(LOCAL_PREFIX)
+
+
+def embedding_model_id(model: str = EMBEDDING_MODEL, dim: Optional[int] = None) -> str:
+    """
+    The model's identity for manifests, checkpoints and cache keys. Local backends include their
+    dimension ("local:hashed-ngram-768"), so changing LOCAL_EMBEDDING_DIM re-embeds instead of
+    mixing vector sizes.
+    """
+    return f"{model}-{dim or LOCAL_EMBEDDING_DIM}" if is_local_model(model) else model
+
+
+def create_embeddings(model: str = EMBEDDING_MODEL, cache: Optional[EmbeddingStore] = None) -> Embeddings:
+    """
+    The Embeddings object for a model name. Remote models are wrapped with cache
+    (if given); local ones are cheaper to recompute than to look up, so they are not.
+    """
+    if is_local_model(model):
+        name = model[len(LOCAL_PREFIX):]
+        if name not in _LOCAL_BACKENDS:
+            raise ValueError(f"Unknown local embedding backend '{name}'. Available: {sorted(_LOCAL_BACKENDS)}")
+        return _LOCAL_BACKENDS[name](LOCAL_EMBEDDING_DIM)
+
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+    return with_embedding_cache(GoogleGenerativeAIEmbeddings(model=model, google_api_key=GOOGLE_API_KEY),
+                                embedding_model_id(model), cache)
@@ -0,0 +1,234 @@
+"""
+Persistent embedding cache shared by every knowledge base and by grammar queries.
+
+Document vectors are stored as raw float32 rows in one append-only file per
+model, read through a memory map. A SQLite index maps (model, kind, text hash)
+to a row. Rebuilding a knowledge base gets the vector from disk instead of
+calling the embedding API. Query vectors depend on what students type, so they
+are kept in a bounded in-memory LRU instead and never written to disk.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from config import EMBEDDING_CACHE_DIR, EMBEDDING_CACHE_ENABLED, EMBEDDING_QUERY_CACHE_SIZE
+from io_pool import run_io
+
+DOCUMENT = "document"
+QUERY = "query"
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    float32 vector files plus a SQLite index, in cache_dir, for document spaces;
+    query spaces ("<model>|query") live in an LRU of max_queries vectors in memory.
+    Rows are appended and never rewritten, so readers can keep their memory map
+    while other threads or processes add vectors.
+    """
+
+    def __init__(self, cache_dir: str = EMBEDDING_CACHE_DIR, max_queries: int = EMBEDDING_QUERY_CACHE_SIZE):
+        self.cache_dir = cache_dir
+        self.max_queries = max_queries
+        os.makedirs(cache_dir, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(cache_dir, "index.sqlite3"), check_same_thread=False,
+                                     isolation_level=None)
+        self._lock = threading.Lock()
+        self._maps: Dict[str, np.memmap] = {}
+        self._queries: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+        self._stats = Counter()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS spaces (space TEXT PRIMARY KEY, dim INTEGER NOT NULL)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS vectors ("
+                " space TEXT NOT NULL, text_hash TEXT NOT NULL, row INTEGER NOT NULL,"
+                " PRIMARY KEY (space, text_hash))"
+            )
+        self._drop_persisted_queries()
+
+    @staticmethod
+    def _is_query_space(space: str) -> bool:
+        return space.endswith(f"|{QUERY}")
+
+    def _drop_persisted_queries(self):
+        """Removes query vectors that older versions wrote to disk."""
+        with self._lock:
+            spaces = [s for (s,) in self._conn.execute("SELECT space FROM spaces").fetchall() if self._is_query_space(s)]
+            for space in spaces:
+                self._conn.execute("DELETE FROM vectors WHERE space = ?", (space,))
+                self._conn.execute("DELETE FROM spaces WHERE space = ?", (space,))
+                if os.path.exists(self._file(space)):
+                    os.remove(self._file(space))
+
+    def _file(self, space: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha256(space.encode("utf-8")).hexdigest()[:16] + ".f32")
+
+    def _rows(self, space: str, dim: int, needed_rows: int) -> np.ndarray:
+        """Memory map of the space's file, re-opened when rows were appended since it was mapped."""
+        current = self._maps.get(space)
+        if current is None or current.shape[0] < needed_rows:
+            rows = os.path.getsize(self._file(space)) // (dim * 4)
+            current = np.memmap(self._file(space), dtype=np.float32, mode="r", shape=(rows, dim))
+            self._maps[space] = current
+        return current
+
+    def get_many(self, space: str, hashes: List[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        with self._lock:
+            if self._is_query_space(space):
+                for h in hashes:
+                    vector = self._queries.get((space, h))
+                    if vector is not None:
+                        self._queries.move_to_end((space, h))
+                        found[h] = vector
+                self._stats["hits"] += len(found)
+                self._stats["misses"] += len(hashes) - len(found)
+                return found
+            dim_row = self._conn.execute("SELECT dim FROM spaces WHERE space = ?", (space,)).fetchone()
+            if dim_row and hashes:
+                row_of = {}
+                for start in range(0, len(hashes), 500):
+                    part = hashes[start:start + 500]
+                    row_of.update(self._conn.execute(
+                        f"SELECT text_hash, row FROM vectors WHERE space = ? AND text_hash IN ({','.join('?' * len(part))})",
+                        [space, *part],
+                    ).fetchall())
+                if row_of:
+                    matrix = self._rows(space, dim_row[0], max(row_of.values()) + 1)
+                    found = {h: np.array(matrix[row]) for h, row in row_of.items()}
+            self._stats["hits"] += len(found)
+            self._stats["misses"] += len(hashes) - len(found)
+        return found
+
+    def put_many(self, space: str, vectors: Dict[str, List[float]]):
+        if not vectors:
+            return
+        if self._is_query_space(space):
+            with self._lock:
+                for h, vector in vectors.items():
+                    self._queries[(space, h)] = np.asarray(vector, dtype=np.float32)
+                    self._queries.move_to_end((space, h))
+                while len(self._queries) > max(0, self.max_queries):
+                    self._queries.popitem(last=False)
+            return
+        hashes = list(vectors)
+        matrix = np.asarray([vectors[h] for h in hashes], dtype=np.float32)
+        dim = matrix.shape[1]
+        with self._lock:
+            # BEGIN IMMEDIATE takes SQLite's write lock, so no other process appends to the file meanwhile.
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                dim_row = self._conn.execute("SELECT dim FROM spaces WHERE space = ?", (space,)).fetchone()
+                if dim_row is None:
+                    self._conn.execute("INSERT INTO spaces VALUES (?, ?)", (space, dim))
+                elif dim_row[0] != dim:
+                    raise ValueError(f"Embedding size changed for {space}: {dim_row[0]} -> {dim}")
+                path = self._file(space)
+                first_row = os.path.getsize(path) // (dim * 4) if os.path.exists(path) else 0
+                with open(path, "ab") as f:
+                    # Drop a row cut short by a crash, so rows stay aligned.
+                    f.truncate(first_row * dim * 4)
+                    f.write(matrix.tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO vectors VALUES (?, ?, ?)",
+                    [(space, h, first_row + i) for i, h in enumerate(hashes)],
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+            hits, misses = self._stats.get("hits", 0), self._stats.get("misses", 0)
+            queries = len(self._queries)
+        return {"hits": hits, "misses": misses, "entries": entries, "query_entries": queries}
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an Embeddings object (e.g. GoogleGenerativeAIEmbeddings): vectors already in
+    the store are read from disk and only the rest are sent to the wrapped model.
+    Documents and queries are cached separately, since Gemini embeds them differently.
+    """
+
+    def __init__(self, embeddings: Embeddings, store: EmbeddingStore, model: str):
+        self.embeddings = embeddings
+        self.store = store
+        self.model = model
+
+    def _lookup(self, kind: str, texts: List[str]):
+        space = f"{self.model}|{kind}"
+        hashes = [text_hash(t) for t in texts]
+        found = self.store.get_many(space, list(dict.fromkeys(hashes)))
+        missing = {h: t for h, t in zip(hashes, texts) if h not in found}
+        return space, hashes, found, missing
+
+    def _store(self, space: str, missing: Dict[str, str], vectors: List[List[float]], found: Dict[str, np.ndarray]):
+        # Stored as float32, so a cached vector is returned exactly as a fresh one was.
+        new = {h: np.asarray(v, dtype=np.float32) for h, v in zip(missing, vectors)}
+        self.store.put_many(space, new)
+        found.update(new)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        space, hashes, found, missing = self._lookup(DOCUMENT, texts)
+        if missing:
+            self._store(space, missing, self.embeddings.embed_documents(list(missing.values())), found)
+        return [list(map(float, found[h])) for h in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        space, hashes, found, missing = self._lookup(QUERY, [text])
+        if missing:
+            self._store(space, missing, [self.embeddings.embed_query(text)], found)
+        return list(map(float, found[hashes[0]]))
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        space, hashes, found, missing = await run_io(self._lookup, DOCUMENT, texts)
+        if missing:
+            vectors = await self.embeddings.aembed_documents(list(missing.values()))
+            await run_io(self._store, space, missing, vectors, found)
+        return [list(map(float, found[h])) for h in hashes]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        space, hashes, found, missing = await run_io(self._lookup, QUERY, [text])
+        if missing:
+            vectors = [await self.embeddings.aembed_query(text)]
+            await run_io(self._store, space, missing, vectors, found)
+        return list(map(float, found[hashes[0]]))
+
+
+_default_store: Optional[EmbeddingStore] = None
+_default_store_lock = threading.Lock()
+
+
+def get_embedding_cache(create: bool = True) -> Optional[EmbeddingStore]:
+    """
+    Returns the shared store, or None when EMBEDDING_CACHE_ENABLED is off.
+    With create=False (stats), None is also returned if nothing has opened it yet.
+    """
+    global _default_store
+    if not EMBEDDING_CACHE_ENABLED:
+        return None
+    with _default_store_lock:
+        if _default_store is None and create:
+            _default_store = EmbeddingStore()
+    return _default_store
+
+
+def with_embedding_cache(embeddings: Embeddings, model: str, store: Optional[EmbeddingStore]) -> Embeddings:
+    """Wraps embeddings with the store, or returns them unchanged when there is none (cache disabled)."""
+    return CachedEmbeddings(embeddings, store, model) if store else embeddings
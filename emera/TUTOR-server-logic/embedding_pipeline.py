@@ -0,0 +1,161 @@
+"""
+Batched, concurrent and rate-limited embedding of many texts, for knowledge base builds.
+
+Texts are sent in batches of EMBEDDING_BATCH_SIZE, with at most EMBEDDING_MAX_CONCURRENCY
+batches in flight and at most EMBEDDING_REQUESTS_PER_MINUTE calls. Rate-limit (429) and
+transient errors are retried with exponential backoff and jitter; a 429 also holds back
+the other batches for the backoff time.
+
+Each finished batch is appended to a checkpoint file, so a build that stops half-way
+(quota exhausted, crash, Ctrl-C) resumes where it left off instead of starting over.
+"""
+
+import asyncio
+import json
+import os
+import random
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from config import (EMBEDDING_BACKOFF_BASE, EMBEDDING_BACKOFF_MAX, EMBEDDING_BATCH_SIZE, EMBEDDING_MAX_CONCURRENCY,
+                    EMBEDDING_MAX_RETRIES, EMBEDDING_MODEL, EMBEDDING_REQUESTS_PER_MINUTE)
+from logging_config import get_logger
+from rate_limit import TokenBucket, is_rate_limited, is_retryable
+
+logger = get_logger("embedding_pipeline")
+
+class EmbeddingCheckpoint:
+    """
+    Append-only JSON-lines file of finished embeddings (text ID -> vector).
+    A line cut short by a crash is ignored when loading; a checkpoint written
+    for a different embedding model is discarded.
+    """
+
+    def __init__(self, path: str, model: str = EMBEDDING_MODEL):
+        self.path = path
+        self.model = model
+
+    def load(self) -> Dict[str, List[float]]:
+        vectors = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                header = json.loads(f.readline() or "{}")
+                if header.get("model") != self.model:
+                    return {}
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        vectors[entry["id"]] = entry["vector"]
+                    except (ValueError, KeyError):
+                        continue
+        except (OSError, ValueError):
+            return {}
+        return vectors
+
+    def append(self, vectors: Dict[str, List[float]]):
+        new_file = not os.path.exists(self.path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            if new_file:
+                f.write(json.dumps({"model": self.model}) + "\n")
+            for text_id, vector in vectors.items():
+                f.write(json.dumps({"id": text_id, "vector": list(vector)}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class EmbeddingPipeline:
+    """Embeds {text ID: text} with batching, bounded concurrency, rate limiting, retries and a checkpoint."""
+
+    def __init__(self, embeddings, batch_size: int = EMBEDDING_BATCH_SIZE,
+                 max_concurrency: int = EMBEDDING_MAX_CONCURRENCY,
+                 requests_per_minute: float = EMBEDDING_REQUESTS_PER_MINUTE,
+                 max_retries: int = EMBEDDING_MAX_RETRIES, backoff_base: float = EMBEDDING_BACKOFF_BASE,
+                 backoff_max: float = EMBEDDING_BACKOFF_MAX, checkpoint_path: Optional[str] = None,
+                 model: str = EMBEDDING_MODEL):
+        self.embeddings = embeddings
+        self.batch_size = max(1, batch_size)
+        self.max_concurrency = max(1, max_concurrency)
+        self.requests_per_minute = requests_per_minute
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.checkpoint = EmbeddingCheckpoint(checkpoint_path, model) if checkpoint_path else None
+        self.stats = Counter()
+        self._pause_until = 0.0
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def _embed_batch(self, texts: List[str], bucket: TokenBucket) -> List[List[float]]:
+        for attempt in range(self.max_retries + 1):
+            pause = self._pause_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            await bucket.acquire()
+            try:
+                vectors = await self.embeddings.aembed_documents(texts)
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                delay = self._backoff(attempt)
+                if is_rate_limited(e):
+                    # Everyone waits, not just this batch: the quota is shared.
+                    self._pause_until = max(self._pause_until, time.monotonic() + delay)
+                    bucket.drain()
+                self.stats["retries"] += 1
+                logger.warning(f"Embedding batch failed, retrying in {delay:.1f}s: {e}",
+                               extra={"attempt": attempt + 1, "batch_size": len(texts)})
+                await asyncio.sleep(delay)
+                continue
+            if len(vectors) != len(texts):
+                raise ValueError(f"Embedding service returned {len(vectors)} vectors for {len(texts)} texts")
+            return vectors
+
+    async def aembed(self, texts: Dict[str, str]) -> Dict[str, List[float]]:
+        """Returns a vector for every text ID. Texts found in the checkpoint are not embedded again."""
+        done = {}
+        if self.checkpoint:
+            done = {text_id: v for text_id, v in self.checkpoint.load().items() if text_id in texts}
+        pending = [text_id for text_id in texts if text_id not in done]
+        batches = [pending[i:i + self.batch_size] for i in range(0, len(pending), self.batch_size)]
+        self.stats.update(texts=len(texts), resumed=len(done), batches=len(batches))
+        if done:
+            logger.info(f"Resuming embedding from checkpoint: {len(done)} of {len(texts)} texts already done")
+
+        bucket = TokenBucket(self.requests_per_minute / 60, capacity=self.max_concurrency)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def run(batch: List[str]):
+            async with semaphore:
+                vectors = await self._embed_batch([texts[text_id] for text_id in batch], bucket)
+            finished = dict(zip(batch, vectors))
+            if self.checkpoint:
+                self.checkpoint.append(finished)
+            done.update(finished)
+            self.stats["embedded"] += len(batch)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(run(batch) for batch in batches))
+        if batches:
+            logger.info("Embedding finished", extra={**self.stats,
+                                                     "duration_ms": round((time.perf_counter() - start) * 1000, 1)})
+        return done
+
+    def embed(self, texts: Dict[str, str]) -> Dict[str, List[float]]:
+        """Blocking version of aembed(); safe to call from inside a running event loop too."""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.aembed(texts))
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, self.aembed(texts)).result()
@@ -0,0 +1,199 @@
+"""
+Hybrid lexical + vector retrieval for the grammar tool.
+
+A BM25 index is built in memory from the same chunks as the vector store. Results of
+both are merged with reciprocal rank fusion (RRF). When the query is a strong exact
+match (a few terms, all found in one chunk that clearly outscores the rest), the
+lexical results are returned on their own and no query embedding is needed.
+
+Both retrievers have a native async path: the query embedding is awaited (Gemini's async
+client) and only the store search runs on a thread, from the bounded retrieval pool.
+
+Tokens are NFC-normalized and lower-cased. Devanagari words keep their vowel signs,
+virama and anusvara (which \\w would split on); IAST diacritics are folded
+(saṃdhi -> samdhi, mokṣa -> moksa) so transliteration with or without them matches.
+"""
+
+import math
+import re
+import unicodedata
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+
+from config import HYBRID_LEXICAL_MARGIN, HYBRID_RRF_K, RETRIEVER_MODE, RETRIEVER_SEARCH_KWARGS, RETRIEVER_SEARCH_TYPE
+from io_pool import run_search
+
+# Latin (with IAST letters and combining marks) or Devanagari (without the dandas ।॥).
+_TOKEN = re.compile(
+    r"[0-9A-Za-z\u00C0-\u00D6\u00D8-\u00F6\u00F8-\u024F\u1E00-\u1EFF\u0300-\u036F]+"
+    r"|[\u0900-\u0963\u0966-\u097F\u1CD0-\u1CFF\uA8E0-\uA8FF\u200C\u200D]+"
+)
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does explain for from how i in is it me mean meaning of on or please sanskrit "
+    "tell the this to what when where which who why with word you".split()
+)
+
+
+def _fold_latin(token: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFKD", token) if not unicodedata.combining(c))
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in _TOKEN.findall(unicodedata.normalize("NFC", text or "")):
+        if token[0] < "\u0900":
+            token = _fold_latin(token).lower()
+        else:
+            # Zero-width (non-)joiners only change how a word is drawn.
+            token = token.replace("\u200c", "").replace("\u200d", "")
+        if token:
+            tokens.append(token)
+    return tokens
+
+
+def content_terms(text: str) -> List[str]:
+    return [t for t in dict.fromkeys(tokenize(text)) if t not in STOPWORDS]
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed list of documents."""
+
+    def __init__(self, documents: Sequence[Document], k1: float = 1.5, b: float = 0.75):
+        self.documents = list(documents)
+        self.k1, self.b = k1, b
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.lengths = []
+        for i, doc in enumerate(self.documents):
+            counts = Counter(tokenize(doc.page_content))
+            self.lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self.postings.setdefault(term, {})[i] = tf
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+
+    def idf(self, term: str) -> float:
+        df = len(self.postings.get(term, ()))
+        return math.log(1 + (len(self.documents) - df + 0.5) / (df + 0.5))
+
+    def scores(self, terms: Sequence[str]) -> Dict[int, float]:
+        scores: Dict[int, float] = {}
+        for term in terms:
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf(term)
+            for i, tf in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[i] / (self.avg_length or 1))
+                scores[i] = scores.get(i, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        scores = self.scores(content_terms(query))
+        return sorted(scores.items(), key=lambda item: -item[1])[:k]
+
+    def is_strong_match(self, query: str, ranked: List[Tuple[int, float]], margin: float, max_terms: int = 3) -> bool:
+        """A short query whose terms all occur in the top chunk, which clearly beats the runner-up."""
+        terms = content_terms(query)
+        if not ranked or not terms or len(terms) > max_terms:
+            return False
+        top, top_score = ranked[0]
+        if not all(top in self.postings.get(term, ()) for term in terms):
+            return False
+        return len(ranked) == 1 or top_score >= margin * ranked[1][1]
+
+
+def _doc_key(doc: Document) -> str:
+    return doc.metadata.get("chunk_id") or doc.id or doc.page_content
+
+
+def reciprocal_rank_fusion(result_lists: Sequence[Sequence[Document]], k: int, rrf_k: int = HYBRID_RRF_K) -> List[Document]:
+    scores: Dict[str, float] = {}
+    docs: Dict[str, Document] = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results):
+            key = _doc_key(doc)
+            docs.setdefault(key, doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+    return [docs[key] for key in sorted(scores, key=lambda key: -scores[key])[:k]]
+
+
+class VectorSearchRetriever(BaseRetriever):
+    """
+    Similarity or MMR search over a vector store (Chroma or NumpyVectorStore), like
+    vectorstore.as_retriever(), but async requests await the query embedding and run
+    the search on the retrieval pool instead of running both on the default executor.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    vectorstore: Any
+    search_type: str = "similarity"
+    search_kwargs: Dict[str, Any] = {}
+
+    def _search(self, embedding: List[float]) -> List[Document]:
+        if self.search_type == "mmr":
+            return self.vectorstore.max_marginal_relevance_search_by_vector(embedding, **self.search_kwargs)
+        return self.vectorstore.similarity_search_by_vector(embedding, **self.search_kwargs)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self._search(self.vectorstore.embeddings.embed_query(query))
+
+    async def _aget_relevant_documents(self, query: str, *,
+                                       run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        embedding = await self.vectorstore.embeddings.aembed_query(query)
+        return await run_search(self._search, embedding)
+
+
+class HybridRetriever(BaseRetriever):
+    """BM25 + vector retriever. vector_retriever may be None for lexical-only retrieval."""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    index: BM25Index
+    vector_retriever: Optional[BaseRetriever] = None
+    k: int = 4
+    fetch_k: int = 20
+    rrf_k: int = HYBRID_RRF_K
+    lexical_margin: float = HYBRID_LEXICAL_MARGIN
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        ranked = self.index.search(query, self.fetch_k)
+        lexical = [self.index.documents[i] for i, _ in ranked]
+        if self.vector_retriever is None or self.index.is_strong_match(query, ranked, self.lexical_margin):
+            return lexical[:self.k]
+        vector = self.vector_retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        return reciprocal_rank_fusion([lexical, vector], self.k, self.rrf_k)
+
+    async def _aget_relevant_documents(self, query: str, *,
+                                       run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        # BM25 is an in-memory dictionary walk, cheap enough to run on the loop.
+        ranked = self.index.search(query, self.fetch_k)
+        lexical = [self.index.documents[i] for i, _ in ranked]
+        if self.vector_retriever is None or self.index.is_strong_match(query, ranked, self.lexical_margin):
+            return lexical[:self.k]
+        vector = await self.vector_retriever.ainvoke(query, config={"callbacks": run_manager.get_child()})
+        return reciprocal_rank_fusion([lexical, vector], self.k, self.rrf_k)
+
+
+def create_retriever(vectorstore, mode: str = RETRIEVER_MODE) -> BaseRetriever:
+    """
+    The grammar retriever for a synced vector store:
+    "vector" (RETRIEVER_SEARCH_TYPE search only), "hybrid" (BM25 + vector) or "lexical" (BM25 only).
+    """
+    vector_retriever = VectorSearchRetriever(vectorstore=vectorstore, search_type=RETRIEVER_SEARCH_TYPE,
+                                             search_kwargs=RETRIEVER_SEARCH_KWARGS)
+    if mode == "vector":
+        return vector_retriever
+    stored = vectorstore.get(include=["documents", "metadatas"])
+    documents = [Document(page_content=text, metadata=metadata or {}, id=doc_id)
+                 for doc_id, text, metadata in zip(stored["ids"], stored["documents"], stored["metadatas"])]
+    return HybridRetriever(
+        index=BM25Index(documents),
+        vector_retriever=vector_retriever if mode == "hybrid" else None,
+        k=RETRIEVER_SEARCH_KWARGS.get("k", 4),
+        fetch_k=RETRIEVER_SEARCH_KWARGS.get("fetch_k", 20),
+    )
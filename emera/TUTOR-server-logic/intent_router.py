@@ -0,0 +1,244 @@
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.runnables import Runnable, RunnableLambda
+
+from config import INTENT_CLASSIFIER_ENABLED, INTENT_CONFIDENCE_THRESHOLD
+
+# The three tools the router can pick for a general chat turn.
+TRANSLATOR = "translator"
+GRAMMAR = "grammar_vocab_expert"
+CONVERSATIONAL = "conversational_response"
+
+# --------------------------------------------------------------------------
+# --- Keyword rules (checked first) ---
+# --------------------------------------------------------------------------
+# A whole message that is just a greeting or a thank-you.
+GREETING_PATTERN = re.compile(
+    r"^\s*(hi|hii+|hello|hey|namaste|namaskar|pranam|thanks|thank you|thank u|ok|okay|"
+    r"good (morning|afternoon|evening|night)|bye|goodbye|see you)\b[\s!.,?]*(guru|sir|ma'?am|teacher)?[\s!.,?]*$",
+    re.IGNORECASE,
+)
+TRANSLATOR_PATTERN = re.compile(
+    r"\b(translate|translation|translit\w*|meaning of|what does .+ mean|what is the meaning|"
+    r"how (do (you|i|we) |would (you|i|we) |can (you|i|we) |to )say|in english|into english|into sanskrit|in sanskrit\?*$|word for)\b",
+    re.IGNORECASE,
+)
+GRAMMAR_PATTERN = re.compile(
+    r"\b(grammar|sandhi|vibhakti|declension|declin\w*|conjugat\w*|tense|lakara|lakāra|dhatu|dhātu|"
+    r"pratyaya|samasa|samāsa|compound|suffix|prefix|upasarga|gender|linga|liṅga|plural|dual|singular|"
+    r"noun|verb|pronoun|adjective|case ending|nominative|accusative|genitive|locative|sentence structure|"
+    r"word order|rule)s?\b",
+    re.IGNORECASE,
+)
+# Text written entirely in Devanagari (plus punctuation) is almost always something to translate.
+DEVANAGARI_ONLY_PATTERN = re.compile(r"^[ऀ-ॿ\s\d.,!?'\"।॥-]+$")
+
+# --------------------------------------------------------------------------
+# --- Labeled examples for the lexical model ---
+# --------------------------------------------------------------------------
+INTENT_EXAMPLES: Dict[str, List[str]] = {
+    TRANSLATOR: [
+        "what does namaste mean",
+        "translate this sentence to english",
+        "meaning of dhanyavad",
+        "how do you say thank you in sanskrit",
+        "what is the english for aham",
+        "can you translate रामः वनं गच्छति",
+        "what is the meaning of this shloka",
+        "tell me what this word means",
+        "english translation of om shanti",
+        "what is water in sanskrit",
+        "say good morning in sanskrit",
+        "what does gacchati mean in english",
+        "convert this into english please",
+        "meaning of the word vidya",
+    ],
+    GRAMMAR: [
+        "what is sandhi",
+        "explain vibhakti",
+        "how many cases are there in sanskrit",
+        "how do verbs conjugate in present tense",
+        "what is a dhatu",
+        "difference between singular dual and plural",
+        "how does visarga sandhi work",
+        "what are the rules for word order",
+        "explain the nominative case",
+        "what is a samasa compound",
+        "how are nouns declined",
+        "what is the gender of this noun",
+        "why does the ending change here",
+        "explain lakaras",
+    ],
+    CONVERSATIONAL: [
+        "hello",
+        "hi guru",
+        "good morning",
+        "thank you so much",
+        "how are you",
+        "who are you",
+        "what can you do",
+        "i am feeling stuck, any advice",
+        "how should i practice every day",
+        "i want to learn sanskrit",
+        "this is fun",
+        "what should i learn next",
+        "bye see you tomorrow",
+        "can you help me",
+    ],
+}
+
+
+def normalize_text(text: str) -> str:
+    """Lowercases, applies NFC normalization and collapses whitespace."""
+    text = unicodedata.normalize("NFC", text or "").lower()
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _char_ngrams(text: str, sizes=(2, 3, 4)) -> Counter:
+    """Character n-grams over word-padded text; works for Latin, IAST and Devanagari alike."""
+    grams = Counter()
+    for word in text.split(" "):
+        padded = f" {word} "
+        for n in sizes:
+            for i in range(len(padded) - n + 1):
+                grams[padded[i:i + n]] += 1
+    return grams
+
+
+def _unit_vector(counts: Counter, idf: Dict[str, float]) -> Dict[str, float]:
+    weighted = {g: c * idf.get(g, 0.0) for g, c in counts.items()}
+    norm = math.sqrt(sum(v * v for v in weighted.values()))
+    if norm == 0:
+        return {}
+    return {g: v / norm for g, v in weighted.items() if v}
+
+
+class IntentClassifier:
+    """
+    Picks a tool for a question without calling the LLM.
+
+    Keyword rules are tried first. If no single rule matches, a character n-gram
+    TF-IDF model compares the question with one centroid per route. The softmax over
+    those similarities is used as the confidence.
+    """
+
+    def __init__(self, examples: Dict[str, List[str]] = None, temperature: float = 0.05):
+        examples = examples or INTENT_EXAMPLES
+        self.temperature = temperature
+        self.stats = Counter()
+        self._lock = threading.Lock()
+
+        docs = [(route, _char_ngrams(normalize_text(text))) for route, texts in examples.items() for text in texts]
+        doc_freq = Counter(g for _, grams in docs for g in grams)
+        self._idf = {g: math.log((1 + len(docs)) / (1 + df)) + 1.0 for g, df in doc_freq.items()}
+
+        self._centroids: Dict[str, Dict[str, float]] = {}
+        for route in examples:
+            summed = Counter()
+            for doc_route, grams in docs:
+                if doc_route == route:
+                    for g, v in _unit_vector(grams, self._idf).items():
+                        summed[g] += v
+            norm = math.sqrt(sum(v * v for v in summed.values())) or 1.0
+            self._centroids[route] = {g: v / norm for g, v in summed.items()}
+
+    def _rule_route(self, text: str) -> Optional[str]:
+        if GREETING_PATTERN.match(text):
+            return CONVERSATIONAL
+        if DEVANAGARI_ONLY_PATTERN.match(text):
+            return TRANSLATOR
+        wants_translation = bool(TRANSLATOR_PATTERN.search(text))
+        wants_grammar = bool(GRAMMAR_PATTERN.search(text))
+        if wants_translation != wants_grammar:
+            return TRANSLATOR if wants_translation else GRAMMAR
+        return None
+
+    def _model_route(self, text: str) -> Tuple[str, float]:
+        query = _unit_vector(_char_ngrams(text), self._idf)
+        scores = {
+            route: sum(v * centroid.get(g, 0.0) for g, v in query.items())
+            for route, centroid in self._centroids.items()
+        }
+        top = max(scores.values())
+        exp_scores = {route: math.exp((s - top) / self.temperature) for route, s in scores.items()}
+        total = sum(exp_scores.values())
+        route = max(exp_scores, key=exp_scores.get)
+        return route, exp_scores[route] / total
+
+    def classify(self, question: str) -> Tuple[str, float, str]:
+        """Returns (route, confidence, source) where source is "rules" or "model"."""
+        text = normalize_text(question)
+        route = self._rule_route(text)
+        if route:
+            return route, 1.0, "rules"
+        route, confidence = self._model_route(text)
+        return route, confidence, "model"
+
+    def decide(self, question: str, threshold: float = None) -> Tuple[Optional[str], str]:
+        """
+        Returns (route, best_guess). route is None when the confidence is below the
+        threshold and the LLM router has to decide; the decision path is counted either way.
+        """
+        threshold = INTENT_CONFIDENCE_THRESHOLD if threshold is None else threshold
+        route, confidence, source = self.classify(question)
+        if confidence >= threshold:
+            self.record(source)
+            return route, route
+        self.record("llm")
+        return None, route
+
+    def record(self, path: str):
+        with self._lock:
+            self.stats[path] += 1
+
+    def get_stats(self) -> Dict[str, int]:
+        """How many routing decisions were made by rules, the model and the LLM fallback."""
+        with self._lock:
+            return {path: self.stats.get(path, 0) for path in ("rules", "model", "llm")}
+
+
+def create_routing_chain(router_chain: Runnable, classifier: IntentClassifier,
+                         threshold: float = None) -> Runnable:
+    """
+    Wraps the LLM router so it is only called when the local classifier is unsure.
+    Returns the route name as a string, like the router chain does.
+    """
+    def local_route(x: dict) -> Optional[str]:
+        route, _ = classifier.decide(x.get("current_question", ""), threshold)
+        return route
+
+    def route(x: dict) -> str:
+        return local_route(x) or router_chain.invoke(x)
+
+    async def aroute(x: dict) -> str:
+        return local_route(x) or await router_chain.ainvoke(x)
+
+    return RunnableLambda(route, afunc=aroute, name="intent_router")
+
+
+def resolve_route(tool_choice: str) -> str:
+    """Maps the router's free-text answer to a tool name, defaulting to the conversational tool."""
+    choice = (tool_choice or "").lower()
+    if "translator" in choice:
+        return TRANSLATOR
+    if "grammar" in choice:
+        return GRAMMAR
+    return CONVERSATIONAL
+
+
+_default_classifier: Optional[IntentClassifier] = None
+
+
+def get_intent_classifier() -> Optional[IntentClassifier]:
+    """Returns the shared classifier, or None when INTENT_CLASSIFIER_ENABLED is off."""
+    global _default_classifier
+    if not INTENT_CLASSIFIER_ENABLED:
+        return None
+    if _default_classifier is None:
+        _default_classifier = IntentClassifier()
+    return _default_classifier
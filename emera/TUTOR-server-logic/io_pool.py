@@ -0,0 +1,25 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
+
+from config import FILE_IO_MAX_WORKERS, RETRIEVAL_MAX_WORKERS
+
+T = TypeVar("T")
+
+# A small dedicated pool, so slow disk reads can't take over the default executor
+# that LangChain and Starlette also use.
+_executor = ThreadPoolExecutor(max_workers=FILE_IO_MAX_WORKERS, thread_name_prefix="file-io")
+_search_executor = ThreadPoolExecutor(max_workers=RETRIEVAL_MAX_WORKERS, thread_name_prefix="vector-search")
+
+
+async def run_io(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Runs a blocking file/disk call on the I/O pool and awaits the result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+async def run_search(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Runs a blocking vector store search on the retrieval pool and awaits the result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_search_executor, functools.partial(func, *args, **kwargs))
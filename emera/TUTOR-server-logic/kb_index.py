@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Incremental indexing of a knowledge base folder into a vector store.
+
+A manifest in the store's folder records, for every .txt file, its hash and the
+IDs of its chunks. A chunk's ID is the hash of its source file name and text, so
+on a sync only files that changed are split again, only chunks the store does not
+have yet are embedded, and chunks of edited or removed files are deleted.
+The store itself is also checked against the manifest, so a sync that was
+interrupted half-way is completed by the next one.
+
+New chunks go through the embedding pipeline (batched, rate-limited, retried,
+checkpointed) before the store is touched, so a failed build leaves the store as
+it was and the next sync reuses the embeddings that were already paid for.
+
+A full rebuild (after the embedding model or chunking settings change) is written
+into a new store-<n> folder next to the live one, and the CURRENT file is switched
+to it only once it is complete, so a crash mid-rebuild never leaves a half-written
+store being served.
+
+Sync the grammar knowledge base (needs GOOGLE_API_KEY unless nothing changed or
+EMBEDDING_MODEL is a local backend):
+    python kb_index.py sync
+    python kb_index.py sync --language sanskrit
+    python kb_index.py sync --data curriculum/sanskrit/grammar_vocab --db ./chroma_db_grammar/sanskrit
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from config import EMBEDDING_MODEL, RAG_CHUNK_OVERLAP, RAG_CHUNK_SIZE, VECTOR_STORE
+from embedding_backends import embedding_model_id
+from embedding_pipeline import EmbeddingCheckpoint, EmbeddingPipeline
+from logging_config import get_logger
+
+logger = get_logger("kb_index")
+
+MANIFEST_FILENAME = "kb_manifest.json"
+CHECKPOINT_FILENAME = "embedding_checkpoint.jsonl"
+# Names the store-<n> folder holding the live store; without it the store is in the folder itself.
+CURRENT_FILENAME = "CURRENT"
+STORE_PREFIX = "store-"
+MANIFEST_VERSION = 1
+
+
+def chunk_id(source: str, text: str, occurrence: int = 0) -> str:
+    """Stable ID of a chunk: the same text in the same file always gets the same ID."""
+    return hashlib.sha256(f"{source}\0{occurrence}\0{text}".encode("utf-8")).hexdigest()[:32]
+
+
+def _write_text_atomic(path: str, text: str):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def _write_json_atomic(path: str, data: dict):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+def current_store_path(db_path: str) -> str:
+    """The folder of db_path's live store: the store-<n> folder named in CURRENT, else db_path itself."""
+    try:
+        with open(os.path.join(db_path, CURRENT_FILENAME), "r", encoding="utf-8") as f:
+            name = f.read().strip()
+    except OSError:
+        return db_path
+    return os.path.join(db_path, name) if name else db_path
+
+
+def open_vectorstore(db_path: str, embeddings, kind: str = VECTOR_STORE):
+    """The live vector store in db_path: "chroma" or "numpy" (see VECTOR_STORE in config.py)."""
+    path = current_store_path(db_path)
+    if kind == "numpy":
+        from numpy_store import NumpyVectorStore
+        return NumpyVectorStore(persist_directory=path, embedding_function=embeddings)
+    if kind != "chroma":
+        raise ValueError(f"Unknown VECTOR_STORE '{kind}'. Use 'chroma' or 'numpy'.")
+    from langchain_chroma import Chroma
+    return Chroma(persist_directory=path, embedding_function=embeddings)
+
+
+def write_vectors(vectorstore, ids: List[str], texts: List[str], metadatas: List[dict], vectors: List[List[float]],
+                  batch_size: int = 500):
+    """Upserts already-embedded chunks. Each batch is one transaction in the store."""
+    for start in range(0, len(ids), batch_size):
+        part = slice(start, start + batch_size)
+        if hasattr(vectorstore, "add_embeddings"):
+            vectorstore.add_embeddings(texts[part], vectors[part], metadatas=metadatas[part], ids=ids[part])
+        else:
+            # Chroma's add_texts always embeds, so the collection is written directly.
+            vectorstore._collection.upsert(ids=ids[part], embeddings=vectors[part], documents=texts[part],
+                                           metadatas=metadatas[part])
+
+
+class KnowledgeBaseIndexer:
+    """
+    Keeps a vector store in sync with the .txt files of one folder.
+    open_store(path) opens an empty store in a new folder; with it, full rebuilds are staged there
+    and swapped in when complete (without it they reset the store in place). After sync(),
+    .vectorstore is the store holding the index.
+    """
+
+    def __init__(self, data_path: str, db_path: str, embedding_model: Optional[str] = None,
+                 chunk_size: int = RAG_CHUNK_SIZE, chunk_overlap: int = RAG_CHUNK_OVERLAP,
+                 open_store: Optional[Callable[[str], Any]] = None):
+        self.data_path = data_path
+        self.db_path = db_path
+        self.open_store = open_store
+        self.vectorstore = None
+        self.checkpoint_path = os.path.join(db_path, CHECKPOINT_FILENAME)
+        self.manifest_path = os.path.join(db_path, MANIFEST_FILENAME)
+        self.settings = {"embedding_model": embedding_model or embedding_model_id(EMBEDDING_MODEL), "chunk_size": chunk_size, "chunk_overlap": chunk_overlap}
+        self.splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        self.settings_changed = False
+
+    def load_manifest(self) -> Dict[str, dict]:
+        """The files recorded by the last sync, or {} if there was none (or the settings changed since)."""
+        self.settings_changed = False
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if manifest.get("version") != MANIFEST_VERSION or manifest.get("settings") != self.settings:
+            logger.info("Knowledge base settings changed; every chunk will be re-embedded",
+                        extra={"manifest": self.manifest_path})
+            self.settings_changed = True
+            return {}
+        return manifest.get("files", {})
+
+    def list_files(self) -> List[str]:
+        if not os.path.isdir(self.data_path):
+            return []
+        return sorted(f for f in os.listdir(self.data_path)
+                      if f.endswith(".txt") and os.path.isfile(os.path.join(self.data_path, f)))
+
+    def split(self, source: str, content: str) -> Dict[str, str]:
+        """Chunk ID -> chunk text for one file."""
+        chunks, seen = {}, Counter()
+        for text in self.splitter.split_text(content):
+            chunks[chunk_id(source, text, seen[text])] = text
+            seen[text] += 1
+        return chunks
+
+    def sync(self, vectorstore, dry_run: bool = False, pipeline: EmbeddingPipeline = None) -> Dict[str, int]:
+        """
+        Brings the vector store in line with the folder. Returns counts of files
+        (unchanged/changed/removed) and chunks (added/deleted/kept/resumed).
+        The vector store needs .embeddings, get(include=[]) and delete(ids), and is written
+        with write_vectors(). pipeline defaults to one using the store's embeddings.
+        """
+        start = time.perf_counter()
+        self.vectorstore = vectorstore
+        previous = self.load_manifest()
+        old_ids = set(vectorstore.get(include=[])["ids"])
+        # Chunk IDs do not depend on the embedding model, so after a settings change nothing stored is reusable.
+        stored_ids = set() if self.settings_changed else old_ids
+        counts = Counter()
+        files: Dict[str, dict] = {}
+        to_add: Dict[str, tuple] = {}
+
+        for source in self.list_files():
+            path = os.path.join(self.data_path, source)
+            stat = os.stat(path)
+            entry = previous.get(source)
+            # Same size and mtime as last time, and all its chunks are in the store: nothing to read.
+            if (entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns
+                    and stored_ids.issuperset(entry["chunks"])):
+                files[source] = entry
+                counts["files_unchanged"] += 1
+                continue
+
+            with open(path, "r", encoding="utf-8") as f:
+                content = f.read()
+            content_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+            if entry and entry["sha256"] == content_hash and stored_ids.issuperset(entry["chunks"]):
+                files[source] = {**entry, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+                counts["files_unchanged"] += 1
+                continue
+
+            chunks = self.split(source, content)
+            for cid, text in chunks.items():
+                if cid not in stored_ids:
+                    to_add[cid] = (text, {"source": source, "chunk_id": cid})
+            files[source] = {"sha256": content_hash, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                             "chunks": list(chunks)}
+            counts["files_changed"] += 1
+
+        counts["files_removed"] = len(set(previous) - set(files))
+        expected_ids = {cid for entry in files.values() for cid in entry["chunks"]}
+        to_delete = sorted(old_ids if self.settings_changed else old_ids - expected_ids)
+        counts["chunks_added"] = len(to_add)
+        counts["chunks_deleted"] = len(to_delete)
+        counts["chunks_kept"] = len(expected_ids) - len(to_add)
+
+        if not dry_run:
+            # Embed everything first; the store is only changed once all vectors are in hand.
+            ids = list(to_add)
+            vectors = {}
+            if ids:
+                pipeline = pipeline or EmbeddingPipeline(vectorstore.embeddings, checkpoint_path=self.checkpoint_path,
+                                                         model=self.settings["embedding_model"])
+                vectors = pipeline.embed({i: to_add[i][0] for i in ids})
+                counts["chunks_resumed"] = pipeline.stats["resumed"]
+            staged = None
+            if self.settings_changed and self.open_store is not None:
+                # Everything is re-embedded anyway, so the new store is built beside the live one.
+                staged = f"{STORE_PREFIX}{time.time_ns()}"
+                target = self.open_store(os.path.join(self.db_path, staged))
+            else:
+                target = vectorstore
+                if to_delete and self.settings_changed and hasattr(vectorstore, "reset_collection"):
+                    # A different embedding model may have a different vector size; start from an empty collection.
+                    vectorstore.reset_collection()
+                elif to_delete:
+                    vectorstore.delete(ids=to_delete)
+            if ids:
+                write_vectors(target, ids, [to_add[i][0] for i in ids], [to_add[i][1] for i in ids],
+                              [vectors[i] for i in ids])
+            if staged:
+                # The switch is one atomic file write; the manifest follows, so a crash in between
+                # only means the next sync rebuilds again (from the embedding cache and checkpoint).
+                _write_text_atomic(os.path.join(self.db_path, CURRENT_FILENAME), staged)
+                self.vectorstore = target
+                self._remove_old_stores(keep=staged)
+            # Written last: if anything above fails, the next sync redoes the work.
+            _write_json_atomic(self.manifest_path, {"version": MANIFEST_VERSION, "settings": self.settings,
+                                                    "updated_at": time.time(), "files": files})
+            # The build is complete (and swapped in via CURRENT if staged); nothing is left to resume.
+            EmbeddingCheckpoint(self.checkpoint_path).clear()
+
+        result = dict(counts)
+        if not dry_run and self.settings_changed and self.open_store is not None:
+            result["rebuilt"] = 1
+        logger.info("Knowledge base synced", extra={"data_path": self.data_path, "dry_run": dry_run,
+                                                    "duration_ms": round((time.perf_counter() - start) * 1000, 1),
+                                                    **result})
+        return result
+
+    def _remove_old_stores(self, keep: str):
+        """Deletes replaced stores: other store-<n> folders and a store kept directly in db_path."""
+        own_files = {keep, CURRENT_FILENAME, MANIFEST_FILENAME, CHECKPOINT_FILENAME}
+        for name in os.listdir(self.db_path):
+            if name in own_files or name.endswith(".tmp"):
+                continue
+            path = os.path.join(self.db_path, name)
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+            except OSError:
+                logger.warning("Could not remove replaced store", extra={"path": path})
+
+
+if __name__ == "__main__":
+    from config import CURRICULUM_PATH, GRAMMAR_DATA_PATH, GRAMMAR_DB_PATH
+
+    parser = argparse.ArgumentParser(description="Re-embed only the changed chunks of a knowledge base folder.")
+    parser.add_argument("command", choices=["sync"], help="sync: add new/changed chunks, delete removed ones")
+    parser.add_argument("--data", default=GRAMMAR_DATA_PATH, help="folder with the .txt files")
+    parser.add_argument("--db", default=GRAMMAR_DB_PATH, help="vector store folder")
+    parser.add_argument("--language", help="sync the server's knowledge base for this language "
+                                           "(curriculum/<language>/grammar_vocab into GRAMMAR_DB_PATH/<language>)")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would change")
+    args = parser.parse_args()
+    if args.language:
+        args.data = os.path.join(CURRICULUM_PATH, args.language.lower(), "grammar_vocab")
+        args.db = os.path.join(GRAMMAR_DB_PATH, args.language.lower())
+
+    from embedding_backends import create_embeddings
+    from embedding_cache import get_embedding_cache
+
+    embeddings = create_embeddings(EMBEDDING_MODEL, get_embedding_cache())
+    store = open_vectorstore(args.db, embeddings)
+    indexer = KnowledgeBaseIndexer(args.data, args.db, open_store=lambda path: open_vectorstore(path, embeddings))
+    result = indexer.sync(store, dry_run=args.dry_run)
+    print(f"✅ Knowledge base synced: {result}")
@@ -0,0 +1,87 @@
+"""
+Background loading of knowledge bases.
+
+Building a knowledge base (syncing the store and embedding new chunks) can take minutes
+on a cold start, so requests never wait for it: the build is submitted to a small thread
+pool of its own and the caller checks back later. Until the retriever is ready the
+grammar tool answers with its fallback prompt.
+"""
+
+import os
+import time
+from concurrent.futures import Executor, Future
+from typing import Any, Callable, Dict, Optional
+
+from logging_config import get_logger
+
+logger = get_logger("kb_loader")
+
+PENDING = "pending"
+LOADING = "loading"
+READY = "ready"
+UNAVAILABLE = "unavailable"  # the build returned no retriever (no data files)
+FAILED = "failed"
+
+
+def folder_size(path: str) -> int:
+    """Bytes of all files under path (0 if it does not exist)."""
+    total = 0
+    for folder, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(folder, name))
+            except OSError:
+                pass
+    return total
+
+
+class KnowledgeBaseLoader:
+    """Runs build() (returning a retriever or None) once, in the background, and reports its state."""
+
+    def __init__(self, name: str, build: Callable[[], Any], db_path: Optional[str] = None):
+        self.name = name
+        self.db_path = db_path
+        self._build = build
+        self.state = PENDING
+        self.retriever = None
+        self.error: Optional[str] = None
+        self.duration_ms: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        # On-disk size of the store once loaded; a proxy for the memory it holds.
+        self.size_bytes = 0
+        self._future: Optional[Future] = None
+
+    def start(self, executor: Executor, on_done: Callable[["KnowledgeBaseLoader"], None] = None) -> Future:
+        """Submits the build to executor (once) and returns its future."""
+        if self._future is None:
+            self.state = LOADING
+            self._future = executor.submit(self.load, on_done)
+        return self._future
+
+    def load(self, on_done: Callable[["KnowledgeBaseLoader"], None] = None):
+        """Builds the retriever in the calling thread."""
+        self.state = LOADING
+        start = time.perf_counter()
+        try:
+            logger.info("Loading knowledge base in the background", extra={"kb": self.name})
+            retriever = self._build()
+            if retriever is None:
+                self.state = UNAVAILABLE
+            else:
+                self.size_bytes = folder_size(self.db_path) if self.db_path else 0
+                self.retriever = retriever
+                self.state = READY
+        except Exception as e:
+            self.state = FAILED
+            self.error = str(e)
+            logger.exception("Knowledge base failed to load", extra={"kb": self.name})
+        self.duration_ms = round((time.perf_counter() - start) * 1000, 1)
+        self.finished_at = time.monotonic()
+        logger.info("Knowledge base load finished", extra={"kb": self.name, "state": self.state,
+                                                           "duration_ms": self.duration_ms})
+        if on_done:
+            on_done(self)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"state": self.state, "ready": self.state == READY, "duration_ms": self.duration_ms,
+                "size_bytes": self.size_bytes, "error": self.error}
@@ -0,0 +1,188 @@
+"""
+Per-language grammar knowledge bases.
+
+Each language with a curriculum/<language>/grammar_vocab folder gets its own store
+(GRAMMAR_DB_PATH/<language>) and retriever. A knowledge base is loaded in the background
+the first time a grammar question in its language arrives, so adding languages does not
+add startup time. At most KB_MAX_RESIDENT knowledge bases (and KB_MAX_RESIDENT_MB of
+store data) are kept in memory; beyond that the least recently used one is dropped and
+reloaded from its synced store when it is needed again.
+
+Which languages have grammar data is read from disk when the registry is created, so
+requests never touch the file system to find out; call refresh() after adding a language.
+"""
+
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Optional, Set, Tuple
+
+from config import (CURRICULUM_PATH, GRAMMAR_DB_PATH, KB_BUILD_WORKERS, KB_MAX_RESIDENT, KB_MAX_RESIDENT_MB)
+from kb_loader import FAILED, READY, KnowledgeBaseLoader
+from logging_config import get_logger
+
+logger = get_logger("kb_registry")
+
+GRAMMAR_FOLDER = "grammar_vocab"
+# A knowledge base that failed to load is tried again on a request this long after the failure.
+RETRY_AFTER_SECONDS = 60
+_LANGUAGE_NAME = re.compile(r"^[\w-]+$")
+
+
+def _build_grammar_retriever(language: str, data_path: str, db_path: str):
+    from agent_logic import create_rag_retriever
+    retriever = create_rag_retriever(f"grammar:{language}", data_path, db_path)
+    if retriever is None:
+        # Only called for languages that have data, so None means the build failed (see the log).
+        raise RuntimeError(f"Grammar knowledge base for '{language}' could not be built")
+    return retriever
+
+
+class KnowledgeBaseRegistry:
+    """
+    Language -> grammar retriever, loaded on first use and kept under an LRU budget.
+    build(language, data_path, db_path) returns a retriever, or None if there is no data.
+    """
+
+    def __init__(self, root: str = CURRICULUM_PATH, db_root: str = GRAMMAR_DB_PATH,
+                 max_resident: int = KB_MAX_RESIDENT, max_resident_bytes: int = int(KB_MAX_RESIDENT_MB * 2 ** 20),
+                 build: Callable[[str, str, str], Any] = _build_grammar_retriever,
+                 max_workers: int = KB_BUILD_WORKERS):
+        self.root = root
+        self.db_root = db_root
+        self.max_resident = max(1, max_resident)
+        self.max_resident_bytes = max_resident_bytes
+        self._build = build
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="kb-build")
+        self._lock = threading.Lock()
+        # Least recently used first.
+        self._entries: "OrderedDict[str, KnowledgeBaseLoader]" = OrderedDict()
+        self._stats = Counter()
+        self._available: Set[str] = set()
+        self.refresh()
+
+    def data_path(self, language: str) -> str:
+        return os.path.join(self.root, language, GRAMMAR_FOLDER)
+
+    def _has_data(self, language: str) -> bool:
+        data_path = self.data_path(language)
+        return os.path.isdir(data_path) and any(f.endswith(".txt") for f in os.listdir(data_path))
+
+    def refresh(self):
+        """Re-reads which languages have grammar data."""
+        names = os.listdir(self.root) if os.path.isdir(self.root) else []
+        # Requests name languages in lower case, as do the data paths built from them.
+        available = {name for name in names if name == name.lower() and _LANGUAGE_NAME.match(name)
+                     and self._has_data(name)}
+        with self._lock:
+            self._available = available
+
+    def has_knowledge_base(self, language: Optional[str]) -> bool:
+        with self._lock:
+            return (language or "").lower() in self._available
+
+    def get(self, language: Optional[str]) -> Tuple[Any, bool]:
+        """
+        (the language's retriever if it is loaded else None, whether the language has a knowledge
+        base). A knowledge base that is not loaded yet starts loading in the background, so a
+        later call gets it.
+        """
+        language = (language or "").lower()
+        with self._lock:
+            entry = self._entries.get(language)
+            if (entry is not None and entry.state == FAILED
+                    and time.monotonic() - entry.finished_at > RETRY_AFTER_SECONDS):
+                del self._entries[language]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(language)
+                self._stats["hits" if entry.state == READY else "misses"] += 1
+                return entry.retriever, True
+            if language not in self._available:
+                return None, False
+        self._load(language)
+        return None, self.has_knowledge_base(language)
+
+    def wait(self, language: str, timeout: Optional[float] = None):
+        """Loads the language if needed and blocks until it is done; returns the retriever (or None)."""
+        language = (language or "").lower()
+        if not self.has_knowledge_base(language):
+            return None
+        self._load(language)
+        with self._lock:
+            entry = self._entries.get(language)
+        if entry is None:
+            return None
+        entry.start(self._executor).result(timeout)
+        return entry.retriever
+
+    def preload(self, languages: Iterable[str]):
+        """Starts loading these languages now instead of on their first question."""
+        for language in languages:
+            language = (language or "").strip().lower()
+            if self.has_knowledge_base(language):
+                self._load(language)
+
+    def _load(self, language: str):
+        with self._lock:
+            if language in self._entries:
+                return
+        # Loads are rare, so this is where a language's data folder is checked again.
+        has_data = self._has_data(language)
+        with self._lock:
+            if not has_data:
+                self._available.discard(language)
+                return
+            if language in self._entries:
+                return
+            entry = KnowledgeBaseLoader(
+                f"grammar:{language}",
+                lambda: self._build(language, self.data_path(language), os.path.join(self.db_root, language)),
+                db_path=os.path.join(self.db_root, language),
+            )
+            self._entries[language] = entry
+            self._stats["misses"] += 1
+            self._stats["loads"] += 1
+        entry.start(self._executor, on_done=lambda loaded: self._evict(keep=language))
+
+    def _evict(self, keep: str):
+        """Drops least recently used loaded knowledge bases until the budget is met (never `keep`)."""
+        with self._lock:
+            while True:
+                loaded = [name for name, entry in self._entries.items() if entry.state == READY]
+                resident_bytes = sum(self._entries[name].size_bytes for name in loaded)
+                over_count = len(loaded) > self.max_resident
+                over_bytes = self.max_resident_bytes > 0 and resident_bytes > self.max_resident_bytes
+                candidates = [name for name in loaded if name != keep]
+                if not (over_count or over_bytes) or not candidates:
+                    break
+                victim = candidates[0]
+                # Only the reference is dropped; requests holding the retriever finish with it.
+                del self._entries[victim]
+                self._stats["evictions"] += 1
+                logger.info("Knowledge base evicted", extra={"kb": f"grammar:{victim}",
+                                                              "resident": len(loaded) - 1})
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = {name: entry.get_stats() for name, entry in self._entries.items()}
+            stats = dict(self._stats)
+        loaded = [s for s in entries.values() if s["ready"]]
+        return {"resident": len(loaded), "resident_bytes": sum(s["size_bytes"] for s in loaded),
+                "hits": stats.get("hits", 0), "misses": stats.get("misses", 0), "loads": stats.get("loads", 0),
+                "evictions": stats.get("evictions", 0), "languages": entries}
+
+
+_default_registry: Optional[KnowledgeBaseRegistry] = None
+_default_registry_lock = threading.Lock()
+
+
+def get_knowledge_base_registry() -> KnowledgeBaseRegistry:
+    global _default_registry
+    with _default_registry_lock:
+        if _default_registry is None:
+            _default_registry = KnowledgeBaseRegistry()
+    return _default_registry
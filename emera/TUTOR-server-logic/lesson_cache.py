@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Cache of pre-rendered lesson openings for the curriculum chain.
+
+The curriculum chain's input is only (lesson content, language), so every student
+starting the same lesson gets an answer to the same prompt. Openings are stored on disk
+keyed by a hash of the lesson content, the language and the prompt as it is sent. Editing a
+lesson file, CURRICULUM_TUTOR_PROMPT or the prompt compaction setting changes the key, so
+stale openings are never served.
+
+Warm the cache for the whole curriculum/ tree (needs GOOGLE_API_KEY):
+    python lesson_cache.py warm
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Any, AsyncIterator, Dict, Iterator, Optional
+
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from config import CURRICULUM_PATH, LESSON_CACHE_DIR, LESSON_CACHE_ENABLED, PROMPT_COMPACTION_ENABLED
+from curriculum_index import CurriculumIndex
+from io_pool import run_io
+from prompt_budget import compact_template
+from prompts import CURRICULUM_TUTOR_PROMPT
+
+# Changes whenever the curriculum prompt or its compaction changes (lessons are never trimmed to a budget).
+PROMPT_VERSION = hashlib.sha256(json.dumps([
+    CURRICULUM_TUTOR_PROMPT,
+    compact_template(CURRICULUM_TUTOR_PROMPT) if PROMPT_COMPACTION_ENABLED else None,
+]).encode("utf-8")).hexdigest()[:12]
+
+
+def lesson_key(lesson_content: str, language: str, prompt_version: str = PROMPT_VERSION) -> str:
+    content_hash = hashlib.sha256(lesson_content.encode("utf-8")).hexdigest()
+    return hashlib.sha256(f"{content_hash}|{(language or '').lower()}|{prompt_version}".encode("utf-8")).hexdigest()
+
+
+class LessonOpeningCache:
+    """One JSON file per opening in cache_dir, written atomically."""
+
+    def __init__(self, cache_dir: str = LESSON_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self._stats = Counter()
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def contains(self, lesson_content: str, language: str) -> bool:
+        return os.path.exists(self._path(lesson_key(lesson_content, language)))
+
+    def get(self, lesson_content: str, language: str) -> Optional[str]:
+        try:
+            with open(self._path(lesson_key(lesson_content, language)), "r", encoding="utf-8") as f:
+                response = json.load(f)["response"]
+        except (OSError, ValueError, KeyError):
+            response = None
+        with self._lock:
+            self._stats["hits" if response is not None else "misses"] += 1
+        return response
+
+    def put(self, lesson_content: str, language: str, response: str, **metadata: Any) -> str:
+        key = lesson_key(lesson_content, language)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entry = {"language": language, "prompt_version": PROMPT_VERSION, "created_at": time.time(),
+                 "response": response, **metadata}
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, self._path(key))
+        return key
+
+    def prune(self, keep_keys: set) -> int:
+        """Deletes openings whose key is not in keep_keys (edited or removed lessons)."""
+        removed = 0
+        if not os.path.isdir(self.cache_dir):
+            return removed
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".json") and name[:-5] not in keep_keys:
+                os.remove(os.path.join(self.cache_dir, name))
+                removed += 1
+        return removed
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self._stats.get("hits", 0), "misses": self._stats.get("misses", 0)}
+
+
+class CachedLessonChain(Runnable[dict, str]):
+    """Wraps the curriculum chain: serves cached openings and stores fresh ones."""
+
+    def __init__(self, chain: Runnable, cache: LessonOpeningCache):
+        self.chain = chain
+        self.cache = cache
+
+    def invoke(self, input: dict, config: Optional[RunnableConfig] = None, **kwargs: Any) -> str:
+        cached = self.cache.get(input["context"], input["language"])
+        if cached is not None:
+            return cached
+        response = self.chain.invoke(input, config)
+        self.cache.put(input["context"], input["language"], response)
+        return response
+
+    async def ainvoke(self, input: dict, config: Optional[RunnableConfig] = None, **kwargs: Any) -> str:
+        return "".join([chunk async for chunk in self.astream(input, config)])
+
+    def stream(self, input: dict, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Iterator[str]:
+        yield self.invoke(input, config)
+
+    async def astream(self, input: dict, config: Optional[RunnableConfig] = None, **kwargs: Any) -> AsyncIterator[str]:
+        cached = await run_io(self.cache.get, input["context"], input["language"])
+        if cached is not None:
+            yield cached
+            return
+        chunks = []
+        async for chunk in self.chain.astream(input, config):
+            chunks.append(chunk)
+            yield chunk
+        await run_io(self.cache.put, input["context"], input["language"], "".join(chunks))
+
+
+def warm_cache(curriculum_chain: Runnable, cache: LessonOpeningCache, curriculum_path: str = CURRICULUM_PATH,
+               force: bool = False) -> Dict[str, int]:
+    """Renders the opening of every lesson that is not cached yet, then removes stale openings."""
+    counts = Counter()
+    current_keys = set()
+    index = CurriculumIndex(curriculum_path)
+    for language_folder in index.languages():
+        # Keys ignore case; the display name ("Sanskrit") is what the prompt should show.
+        language = language_folder.capitalize()
+        for lesson in index.lessons(language_folder):
+            current_keys.add(lesson_key(lesson.content, language))
+
+            if not force and cache.contains(lesson.content, language):
+                counts["skipped"] += 1
+                continue
+            print(f"🛠️ Rendering {language} lesson {lesson.number}...")
+            response = curriculum_chain.invoke({"context": lesson.content, "language": language})
+            cache.put(lesson.content, language, response, lesson=lesson.number)
+            counts["rendered"] += 1
+
+    counts["pruned"] = cache.prune(current_keys)
+    return dict(counts)
+
+
+_default_cache: Optional[LessonOpeningCache] = None
+
+
+def get_lesson_cache() -> Optional[LessonOpeningCache]:
+    """Returns the shared cache, or None when LESSON_CACHE_ENABLED is off."""
+    global _default_cache
+    if not LESSON_CACHE_ENABLED:
+        return None
+    if _default_cache is None:
+        _default_cache = LessonOpeningCache()
+    return _default_cache
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-render lesson openings for the curriculum chain.")
+    parser.add_argument("command", choices=["warm"], help="warm: render every uncached lesson in the curriculum tree")
+    parser.add_argument("--curriculum", default=CURRICULUM_PATH, help="curriculum root folder")
+    parser.add_argument("--force", action="store_true", help="re-render lessons that are already cached")
+    args = parser.parse_args()
+
+    # The same chain, model settings and temperature as the server, so the openings match what it would render.
+    from agent_logic import create_curriculum_chain
+    from config import GOOGLE_API_KEY
+    from llm_client import CHAT_TEMPERATURE, create_llm
+
+    chain = create_curriculum_chain(create_llm(GOOGLE_API_KEY, temperature=CHAT_TEMPERATURE))
+    result = warm_cache(chain, LessonOpeningCache(), args.curriculum, force=args.force)
+    print(f"✅ Lesson cache warmed: {result}")
@@ -0,0 +1,393 @@
+"""
+Resilient wrapper around the chat models shared by every chain.
+
+- Timeouts per route (router, translator, grammar, conversational, curriculum): a call that
+  has not answered in time (for streams: has not sent its next chunk) counts as failed.
+- Timeouts and transient errors are retried on the same model, with exponential backoff
+  and jitter. Quota errors (429) and open circuits move on to the next model in the list
+  (LLM_MODEL, then LLM_FALLBACK_MODELS).
+- Optional hedging: if a call is slower than the route's p95 latency, an identical second
+  call is started and whichever answers first is kept; the other is cancelled. Streams are
+  compared with the p95 time to first chunk, full calls with the p95 time to the answer.
+- A circuit breaker per model: after LLM_CIRCUIT_FAILURE_THRESHOLD failures in a row the
+  model is skipped for LLM_CIRCUIT_RESET_SECONDS, then one trial call decides whether it is back.
+
+A stream is only retried or moved to another model before its first chunk; after that the
+student has seen part of the answer, so errors are raised. Timeouts and hedging need an
+event loop and apply to ainvoke/astream (what the server uses); invoke/stream only retry
+and fall back.
+"""
+
+import asyncio
+import random
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Sequence, Tuple
+
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from config import (LLM_BACKOFF_BASE, LLM_BACKOFF_MAX, LLM_CIRCUIT_FAILURE_THRESHOLD, LLM_CIRCUIT_RESET_SECONDS,
+                    LLM_FALLBACK_MODELS, LLM_HEDGE_DELAY_SECONDS, LLM_HEDGE_ENABLED, LLM_HEDGE_MIN_SAMPLES,
+                    LLM_MAX_RETRIES, LLM_MODEL, LLM_ROUTE_TIMEOUTS, LLM_TEMPERATURE, LLM_TIMEOUT_SECONDS)
+from logging_config import get_logger
+from rate_limit import is_rate_limited, is_retryable
+
+logger = get_logger("llm_client")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_DONE = object()
+
+
+class LLMUnavailableError(RuntimeError):
+    """No model could be called (every circuit is open)."""
+
+
+class CircuitBreaker:
+    """Opens after failure_threshold consecutive failures; after reset_seconds one trial call is let through."""
+
+    def __init__(self, failure_threshold: int = LLM_CIRCUIT_FAILURE_THRESHOLD,
+                 reset_seconds: float = LLM_CIRCUIT_RESET_SECONDS):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            # Open, or half-open with a trial call running; a trial that never reported back is replaced.
+            if time.monotonic() - self._opened_at >= self.reset_seconds:
+                self.state = HALF_OPEN
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+
+
+class LatencyWindow:
+    """The last `size` latencies (seconds) of a route, for its p95."""
+
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def p95(self, min_samples: int) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < max(1, min_samples):
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+class ResilienceState:
+    """
+    Circuit breakers per model, latencies per route and counters, shared by all routes of one client.
+    A route keeps separate latencies for streams (time to first chunk) and full calls (time to the answer).
+    """
+
+    def __init__(self, failure_threshold: int = LLM_CIRCUIT_FAILURE_THRESHOLD,
+                 reset_seconds: float = LLM_CIRCUIT_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.latencies: Dict[Tuple[str, bool], LatencyWindow] = {}
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        with self._lock:
+            if model not in self.breakers:
+                self.breakers[model] = CircuitBreaker(self.failure_threshold, self.reset_seconds)
+            return self.breakers[model]
+
+    def latency(self, route: str, stream: bool = False) -> LatencyWindow:
+        with self._lock:
+            return self.latencies.setdefault((route, stream), LatencyWindow())
+
+    def add(self, **counts: int):
+        with self._lock:
+            self._counts.update(counts)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = {key: self._counts.get(key, 0) for key in ("calls", "failures", "retries", "timeouts",
+                                                                "fallbacks", "short_circuits", "hedges", "hedge_wins")}
+            stats["open_circuits"] = sum(1 for b in self.breakers.values() if b.state != CLOSED)
+            stats["circuits"] = {model: b.state for model, b in self.breakers.items()}
+        return stats
+
+
+# Shared by the server's client, reported on /health and /metrics.
+resilience_stats = ResilienceState()
+
+
+class _Attempt:
+    """One call to one model, run as a task; its chunks (or its result) are put on a queue."""
+
+    def __init__(self, model: Runnable, input: Any, config: Optional[RunnableConfig], stream: bool, kwargs: dict):
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._run(model, input, config, stream, kwargs))
+
+    async def _run(self, model: Runnable, input: Any, config: Optional[RunnableConfig], stream: bool, kwargs: dict):
+        try:
+            if stream:
+                async for chunk in model.astream(input, config, **kwargs):
+                    self.queue.put_nowait(chunk)
+            else:
+                self.queue.put_nowait(await model.ainvoke(input, config, **kwargs))
+            self.queue.put_nowait(_DONE)
+        except Exception as e:
+            self.queue.put_nowait(e)
+
+
+class ResilientLLM(Runnable):
+    """
+    Calls the first available of `models` ([(name, chat model)], in order of preference) with
+    timeouts, retries, optional hedging and circuit breaking. for_route(name) returns a copy
+    that uses that route's timeout and latency statistics (and shares everything else).
+    """
+
+    def __init__(self, models: Sequence[Tuple[str, Runnable]], route: str = "default",
+                 timeouts: Optional[Dict[str, float]] = None, default_timeout: float = LLM_TIMEOUT_SECONDS,
+                 max_retries: int = LLM_MAX_RETRIES, backoff_base: float = LLM_BACKOFF_BASE,
+                 backoff_max: float = LLM_BACKOFF_MAX, hedge: bool = LLM_HEDGE_ENABLED,
+                 hedge_delay: float = LLM_HEDGE_DELAY_SECONDS, hedge_min_samples: int = LLM_HEDGE_MIN_SAMPLES,
+                 state: Optional[ResilienceState] = None):
+        if not models:
+            raise ValueError("ResilientLLM needs at least one model")
+        self.models = list(models)
+        self.route = route
+        self.timeouts = LLM_ROUTE_TIMEOUTS if timeouts is None else timeouts
+        self.default_timeout = default_timeout
+        self.max_retries = max(0, max_retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_delay = hedge_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.state = state or ResilienceState()
+
+    def for_route(self, route: str) -> "ResilientLLM":
+        return ResilientLLM(self.models, route, self.timeouts, self.default_timeout, self.max_retries,
+                            self.backoff_base, self.backoff_max, self.hedge, self.hedge_delay,
+                            self.hedge_min_samples, self.state)
+
+    @property
+    def timeout(self) -> float:
+        return self.timeouts.get(self.route, self.default_timeout)
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _allowed(self, index: int, name: str, attempt: int) -> bool:
+        """Whether the model's circuit lets this call through (counting fallbacks and short circuits)."""
+        if not self.state.breaker(name).allow():
+            self.state.add(short_circuits=1)
+            return False
+        if index and not attempt:
+            self.state.add(fallbacks=1)
+            logger.warning("Falling back to another model", extra={"model": name, "route": self.route})
+        return True
+
+    def _failed(self, name: str, attempt: int, error: Exception) -> Optional[float]:
+        """Records a failed call; returns the backoff before retrying the same model, or None to move on."""
+        if not is_retryable(error):
+            # The model answered, just not with something usable (e.g. a bad request): raise it as is.
+            self.state.breaker(name).record_success()
+            raise error
+        self.state.breaker(name).record_failure()
+        self.state.add(failures=1, timeouts=int(isinstance(error, TimeoutError)))
+        logger.warning(f"LLM call failed: {error!r}",
+                       extra={"model": name, "route": self.route, "attempt": attempt + 1})
+        if is_rate_limited(error) or attempt == self.max_retries:
+            return None
+        self.state.add(retries=1)
+        return self._backoff(attempt)
+
+    @staticmethod
+    def _unavailable(last_error: Optional[Exception]):
+        if last_error is not None:
+            raise last_error
+        raise LLMUnavailableError("Every model's circuit is open; try again shortly")
+
+    # --- sync: retries and fallback only ---
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        self.state.add(calls=1)
+        last_error = None
+        for index, (name, model) in enumerate(self.models):
+            for attempt in range(self.max_retries + 1):
+                if not self._allowed(index, name, attempt):
+                    break
+                try:
+                    result = model.invoke(input, config, **kwargs)
+                except Exception as e:
+                    last_error = e
+                    delay = self._failed(name, attempt, e)
+                    if delay is None:
+                        break
+                    time.sleep(delay)
+                    continue
+                self.state.breaker(name).record_success()
+                return result
+        self._unavailable(last_error)
+
+    def stream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Iterator[Any]:
+        self.state.add(calls=1)
+        last_error = None
+        for index, (name, model) in enumerate(self.models):
+            for attempt in range(self.max_retries + 1):
+                if not self._allowed(index, name, attempt):
+                    break
+                chunks = model.stream(input, config, **kwargs)
+                try:
+                    first = next(chunks)
+                except StopIteration:
+                    self.state.breaker(name).record_success()
+                    return
+                except Exception as e:
+                    last_error = e
+                    delay = self._failed(name, attempt, e)
+                    if delay is None:
+                        break
+                    time.sleep(delay)
+                    continue
+                self.state.breaker(name).record_success()
+                yield first
+                yield from chunks
+                return
+        self._unavailable(last_error)
+
+    # --- async: timeouts and hedging too ---
+    def _hedge_after(self, stream: bool) -> Optional[float]:
+        if not self.hedge:
+            return None
+        p95 = self.state.latency(self.route, stream).p95(self.hedge_min_samples)
+        return p95 if p95 is not None else self.hedge_delay
+
+    async def _first(self, model: Runnable, input: Any, config: Optional[RunnableConfig], stream: bool,
+                     kwargs: dict) -> Tuple[_Attempt, Any]:
+        """Starts a call (and a hedge if it is slow); returns the attempt that produced the first item, and the item."""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = started + self.timeout
+        hedge_after = self._hedge_after(stream)
+        hedge_at = started + hedge_after if hedge_after is not None else None
+        attempts = [_Attempt(model, input, config, stream, kwargs)]
+        getters = {asyncio.ensure_future(attempts[0].queue.get()): attempts[0]}
+        winner = None
+        try:
+            while True:
+                wake = min(deadline, hedge_at) if hedge_at is not None else deadline
+                done, _ = await asyncio.wait(getters, timeout=max(0.0, wake - loop.time()),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for getter in done:
+                    attempt = getters.pop(getter)
+                    item = getter.result()
+                    if isinstance(item, Exception) and getters:
+                        continue  # one of two hedged calls failed; the other may still answer
+                    winner = attempt
+                    if not isinstance(item, Exception):
+                        self.state.latency(self.route, stream).add(loop.time() - started)
+                        self.state.add(hedge_wins=int(len(attempts) > 1 and attempt is attempts[1]))
+                    return attempt, item
+                if hedge_at is not None and loop.time() >= hedge_at:
+                    hedge_at = None
+                    if getters:
+                        hedge = _Attempt(model, input, config, stream, kwargs)
+                        attempts.append(hedge)
+                        getters[asyncio.ensure_future(hedge.queue.get())] = hedge
+                        self.state.add(hedges=1)
+                elif loop.time() >= deadline:
+                    raise TimeoutError(f"No answer from the model within {self.timeout:.0f}s")
+        finally:
+            for getter in getters:
+                getter.cancel()
+            for attempt in attempts:
+                if attempt is not winner:
+                    attempt.task.cancel()
+
+    async def _acall(self, input: Any, config: Optional[RunnableConfig], stream: bool,
+                     kwargs: dict) -> AsyncIterator[Any]:
+        self.state.add(calls=1)
+        last_error = None
+        for index, (name, model) in enumerate(self.models):
+            for attempt_number in range(self.max_retries + 1):
+                if not self._allowed(index, name, attempt_number):
+                    break
+                try:
+                    attempt, item = await self._first(model, input, config, stream, kwargs)
+                    if isinstance(item, Exception):
+                        raise item
+                except Exception as e:
+                    last_error = e
+                    delay = self._failed(name, attempt_number, e)
+                    if delay is None:
+                        break
+                    await asyncio.sleep(delay)
+                    continue
+                self.state.breaker(name).record_success()
+                try:
+                    while item is not _DONE:
+                        if isinstance(item, Exception):
+                            raise item
+                        yield item
+                        item = await asyncio.wait_for(attempt.queue.get(), self.timeout)
+                finally:
+                    attempt.task.cancel()
+                return
+        self._unavailable(last_error)
+
+    async def ainvoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        results = self._acall(input, config, False, kwargs)
+        try:
+            return await results.__anext__()
+        finally:
+            await results.aclose()
+
+    async def astream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> AsyncIterator[Any]:
+        async for chunk in self._acall(input, config, True, kwargs):
+            yield chunk
+
+
+def for_route(llm: Runnable, route: str) -> Runnable:
+    """The route's view of a ResilientLLM; any other model is returned as is."""
+    return llm.for_route(route) if isinstance(llm, ResilientLLM) else llm
+
+
+# Temperature of the tutor's chains, shared by the server and lesson_cache.py's warm-up.
+CHAT_TEMPERATURE = 0.7
+
+
+def create_llm(api_key: str, temperature: float = LLM_TEMPERATURE) -> ResilientLLM:
+    """LLM_MODEL followed by LLM_FALLBACK_MODELS, as Gemini chat models behind one ResilientLLM."""
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    models = []
+    for name in [LLM_MODEL] + [m for m in LLM_FALLBACK_MODELS if m != LLM_MODEL]:
+        # Retries and timeouts are handled here, so the client's own are turned off.
+        models.append((name, ChatGoogleGenerativeAI(model=name, temperature=temperature, google_api_key=api_key,
+                                                    max_retries=0)))
+    return ResilientLLM(models, state=resilience_stats)
@@ -0,0 +1,173 @@
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+import uuid
+from typing import Dict, Optional
+
+from config import DEBUG, LOG_DEBUG_SAMPLE_RATE, LOG_FORMAT, VERBOSE_LOGGING
+
+# Correlation ID of the request being handled; "-" outside of a request.
+request_id_var: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="-")
+# Counters that code handling a request adds to (e.g. prompt tokens); logged on the request's line.
+request_stats_var: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "request_stats", default=None)
+
+# Attributes every LogRecord has; anything else was passed through `extra=` and goes into the JSON.
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamps each record with the current request ID."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class DebugSamplingFilter(logging.Filter):
+    """Keeps all INFO and above, but only a fraction of DEBUG records."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or self.rate >= 1 or random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, request_id, message and any extra fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        entry.update({k: v for k, v in vars(record).items() if k not in _STANDARD_ATTRS})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _StdoutHandler(logging.StreamHandler):
+    """Writes to whatever sys.stdout is at emit time (uvicorn and pytest both swap it)."""
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+class _CheapQueueHandler(logging.handlers.QueueHandler):
+    """
+    Only resolves the message on the calling thread. Formatting (including
+    tracebacks) and the stdout write happen on the listener thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+_listener = None
+
+
+def setup_logging() -> logging.Logger:
+    """
+    Configures the "tutor" logger once. Request handlers only put records on a queue;
+    a background thread formats and writes them.
+    DEBUG=true logs every debug line. VERBOSE_LOGGING=true logs a sample of them.
+    """
+    global _listener
+    logger = logging.getLogger("tutor")
+    if _listener is not None:
+        return logger
+
+    handler = _StdoutHandler()
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s"))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _CheapQueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+    if not DEBUG:
+        queue_handler.addFilter(DebugSamplingFilter(LOG_DEBUG_SAMPLE_RATE))
+
+    logger.handlers[:] = [queue_handler]
+    logger.setLevel(logging.DEBUG if DEBUG or VERBOSE_LOGGING else logging.INFO)
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return logger
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Returns a child of the "tutor" logger, e.g. get_logger("server") -> "tutor.server"."""
+    setup_logging()
+    return logging.getLogger(f"tutor.{name}")
+
+
+class RequestLoggingMiddleware:
+    """
+    ASGI middleware: gives each HTTP request a correlation ID (taken from X-Request-ID
+    or generated), returns it as a response header and logs one line per request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.logger = get_logger("http")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1")[:64] or uuid.uuid4().hex[:12]
+        token = request_id_var.set(request_id)
+        stats_token = request_stats_var.set({})
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_request_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers") or []) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            stats = request_stats_var.get() or {}
+            self.logger.info(
+                "request finished",
+                extra={
+                    "method": scope.get("method"),
+                    "path": scope.get("path"),
+                    "status": status,
+                    "duration_ms": round((time.perf_counter() - start) * 1000, 2),
+                    **stats,
+                },
+            )
+            request_stats_var.reset(stats_token)
+            request_id_var.reset(token)
@@ -0,0 +1,348 @@
+"""
+Minimal Prometheus metrics: counters, gauges and histograms with labels,
+rendered in the Prometheus text exposition format on /metrics.
+"""
+
+import bisect
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from tokens import estimate_tokens
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(n, "")) for n in self.label_names)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        return self.header() + [f"{self.name}{_format_labels(self.label_names, k)} {_format_value(v)}" for k, v in values.items()]
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        return self.header() + [f"{self.name}{_format_labels(self.label_names, k)} {_format_value(v)}" for k, v in values.items()]
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelValues, List[float]] = {}  # bucket counts..., sum, count
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.setdefault(key, [0.0] * (len(self.buckets) + 2))
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def time(self, **labels: str):
+        """Context manager that observes the elapsed time of its block."""
+        return _Timer(self, labels)
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        lines = self.header()
+        for key, values in series.items():
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{labels} {_format_value(cumulative)}")
+            labels = _format_labels(self.label_names, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {_format_value(values[-1])}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(values[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {_format_value(values[-1])}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: Dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class StatsCollector:
+    """
+    Exposes an existing stats dict (e.g. ResponseCache.get_stats()) as metrics at scrape time.
+    fields maps a stats key to (metric suffix, type, labels).
+    """
+
+    def __init__(self, prefix: str, help_text: str, get_stats: Callable[[], Optional[Dict[str, float]]],
+                 fields: Dict[str, Tuple[str, str, Dict[str, str]]]):
+        self.prefix = prefix
+        self.help_text = help_text
+        self.get_stats = get_stats
+        self.fields = fields
+
+    def collect(self) -> List[str]:
+        stats = self.get_stats()
+        if not stats:
+            return []
+        grouped: Dict[Tuple[str, str], List[str]] = {}
+        for key, (suffix, type_name, labels) in self.fields.items():
+            if stats.get(key) is None:
+                continue
+            name = f"{self.prefix}_{suffix}"
+            label_text = _format_labels(tuple(labels), tuple(labels.values()))
+            grouped.setdefault((name, type_name), []).append(f"{name}{label_text} {_format_value(stats[key])}")
+        lines = []
+        for (name, type_name), samples in grouped.items():
+            lines += [f"# HELP {name} {self.help_text}", f"# TYPE {name} {type_name}"] + samples
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
+        return collector
+
+    def counter(self, name, help_text, labels=()) -> Counter:
+        return self.register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()) -> Gauge:
+        return self.register(Gauge(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            collectors = list(self._collectors)
+        lines = []
+        for collector in collectors:
+            lines += collector.collect()
+        return "\n".join(lines) + "\n"
+
+
+# --------------------------------------------------------------------------
+# --- Tutor metrics ---
+# --------------------------------------------------------------------------
+registry = Registry()
+
+HTTP_REQUEST_DURATION = registry.histogram(
+    "tutor_http_request_duration_seconds", "Time to complete an HTTP request.", ("method", "path", "status"))
+HTTP_REQUESTS_IN_FLIGHT = registry.gauge(
+    "tutor_http_requests_in_flight", "HTTP requests currently being handled.", ("path",))
+STAGE_DURATION = registry.histogram(
+    "tutor_stage_duration_seconds", "Time spent in each chain stage (router, retriever, tools, llm...).", ("stage",))
+STAGE_ERRORS = registry.counter(
+    "tutor_stage_errors_total", "Chain stages that raised an error.", ("stage",))
+LLM_TIME_TO_FIRST_TOKEN = registry.histogram(
+    "tutor_llm_time_to_first_token_seconds", "Time from an LLM call starting to its first streamed token.")
+REQUEST_TIME_TO_FIRST_TOKEN = registry.histogram(
+    "tutor_request_time_to_first_token_seconds", "Time from a streaming request arriving to its first chunk.", ("endpoint",))
+LLM_TOKENS = registry.counter(
+    "tutor_llm_tokens_total", "LLM tokens used (from usage metadata, or estimated).", ("kind",))
+PROMPT_TOKENS = registry.counter(
+    "tutor_prompt_tokens_total", "Prompt tokens sent, and saved by compaction and budgets (estimated).",
+    ("chain", "kind"))
+PROMPT_TRUNCATIONS = registry.counter(
+    "tutor_prompt_truncations_total", "Prompt fields shortened to fit a chain's token budget.", ("chain", "field"))
+ADMISSION_WAIT = registry.histogram(
+    "tutor_admission_wait_seconds", "Time a chat request waited for an upstream slot.", ("priority",))
+
+# Only these chain run names are timed; the run names are set in agent_logic.create_tutor_agent.
+TRACKED_STAGES = {"intent_router", "router", "translator", "grammar", "conversational", "curriculum"}
+KNOWN_PATHS = {"/", "/health", "/keep-alive", "/lessons", "/chat", "/chat/stream", "/metrics", "/test"}
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """Times tracked chain stages, retriever and LLM calls, and counts tokens."""
+
+    run_inline = True
+    # Runs that never end (e.g. cancelled speculative branches) are dropped after this long.
+    max_run_age = 600.0
+
+    def __init__(self):
+        self._runs: Dict[object, Tuple[str, float]] = {}
+        self._first_token_pending = set()
+        self._lock = threading.Lock()
+
+    def _start(self, run_id, stage: str):
+        now = time.perf_counter()
+        with self._lock:
+            if len(self._runs) > 1000:
+                stale = [r for r, (_, start) in self._runs.items() if now - start > self.max_run_age]
+                for r in stale:
+                    del self._runs[r]
+                    self._first_token_pending.discard(r)
+            self._runs[run_id] = (stage, now)
+
+    def _end(self, run_id, error: bool = False):
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+            self._first_token_pending.discard(run_id)
+        if run is None:
+            return
+        stage, start = run
+        STAGE_DURATION.observe(time.perf_counter() - start, stage=stage)
+        if error:
+            STAGE_ERRORS.inc(stage=stage)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, **kwargs):
+        if kwargs.get("name") in TRACKED_STAGES:
+            self._start(run_id, kwargs["name"])
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=True)
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        self._start(run_id, "retriever")
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=True)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id, "llm")
+        with self._lock:
+            self._first_token_pending.add(run_id)
+        LLM_TOKENS.inc(sum(estimate_tokens(str(m.content)) for batch in messages for m in batch), kind="prompt_estimated")
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        with self._lock:
+            if run_id not in self._first_token_pending:
+                return
+            self._first_token_pending.discard(run_id)
+            start = self._runs.get(run_id, (None, None))[1]
+        if start is not None:
+            LLM_TIME_TO_FIRST_TOKEN.observe(time.perf_counter() - start)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    LLM_TOKENS.inc(usage.get("input_tokens", 0), kind="prompt")
+                    LLM_TOKENS.inc(usage.get("output_tokens", 0), kind="completion")
+                else:
+                    LLM_TOKENS.inc(estimate_tokens(generation.text), kind="completion_estimated")
+        self._end(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=True)
+
+
+metrics_callback = MetricsCallbackHandler()
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request duration and in-flight requests per path."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        path = scope.get("path") if scope.get("path") in KNOWN_PATHS else "other"
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_REQUESTS_IN_FLIGHT.inc(path=path)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.dec(path=path)
+            HTTP_REQUEST_DURATION.observe(time.perf_counter() - start, method=scope.get("method"), path=path, status=status)
@@ -0,0 +1,239 @@
+"""
+In-process vector store for small knowledge bases, as an alternative to Chroma.
+
+All chunk vectors live in one contiguous float32 matrix, normalized once when they
+are added, so cosine similarity is a single matrix-vector product. Top-k uses
+argpartition and MMR works on the precomputed similarity matrix of the candidates,
+so neither loops over chunks in Python. Several queries can be searched in one
+matrix-matrix product with similarity_search_by_vectors().
+
+On disk, the folder holds the matrix (memory-mapped when loading, so opening a store
+takes milliseconds) and a JSON file with ids, texts and metadata. Every change writes
+a new matrix file first and then replaces the JSON file, which names the matrix file
+to use; a crash in between leaves the previous version intact.
+"""
+
+import json
+import os
+import tempfile
+import threading
+import uuid
+from typing import Any, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+INDEX_FILENAME = "numpy_index.json"
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[None, :]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+
+def mmr_select(query: np.ndarray, candidates: np.ndarray, k: int, lambda_mult: float = 0.5) -> List[int]:
+    """
+    Maximal marginal relevance over normalized vectors. Similarities between the candidates
+    are computed once; each step is a vectorized update of the best redundancy per candidate.
+    """
+    count = candidates.shape[0]
+    if count == 0 or k <= 0:
+        return []
+    relevance = candidates @ query
+    pairwise = candidates @ candidates.T
+    selected = [int(np.argmax(relevance))]
+    redundancy = pairwise[selected[0]].copy()
+    available = np.ones(count, dtype=bool)
+    available[selected[0]] = False
+    while len(selected) < min(k, count):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(redundancy, pairwise[best], out=redundancy)
+    return selected
+
+
+class NumpyVectorStore(VectorStore):
+    """Vector store kept in memory as a NumPy matrix and persisted to a folder."""
+
+    def __init__(self, persist_directory: str, embedding_function: Embeddings):
+        self.persist_directory = persist_directory
+        self._embedding_function = embedding_function
+        self._lock = threading.Lock()
+        # One tuple, swapped as a whole, so searches never see a half-applied update.
+        self._data: Tuple[np.ndarray, List[str], List[str], List[dict]] = (np.zeros((0, 0), np.float32), [], [], [])
+        self._matrix_file: Optional[str] = None
+        self._load()
+
+    # --- persistence ---
+    def _load(self):
+        try:
+            with open(os.path.join(self.persist_directory, INDEX_FILENAME), "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return
+        ids = index["ids"]
+        matrix = np.zeros((0, 0), np.float32)
+        if ids:
+            path = os.path.join(self.persist_directory, index["matrix_file"])
+            matrix = np.memmap(path, dtype=np.float32, mode="r", shape=(len(ids), index["dim"]))
+        self._data = (matrix, ids, index["texts"], index["metadatas"])
+        self._matrix_file = index.get("matrix_file")
+
+    def _save(self, matrix: np.ndarray, ids: List[str], texts: List[str], metadatas: List[dict]):
+        os.makedirs(self.persist_directory, exist_ok=True)
+        matrix_file = f"numpy_vectors-{uuid.uuid4().hex[:12]}.f32"
+        with open(os.path.join(self.persist_directory, matrix_file), "wb") as f:
+            f.write(np.ascontiguousarray(matrix, dtype=np.float32).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        index = {"dim": int(matrix.shape[1]) if matrix.size else 0, "matrix_file": matrix_file,
+                 "ids": ids, "texts": texts, "metadatas": metadatas}
+        fd, tmp_path = tempfile.mkstemp(dir=self.persist_directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(self.persist_directory, INDEX_FILENAME))
+
+        previous, self._matrix_file = self._matrix_file, matrix_file
+        if previous:
+            try:
+                os.remove(os.path.join(self.persist_directory, previous))
+            except OSError:
+                pass
+
+    # --- writing ---
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding_function
+
+    def add_embeddings(self, texts: Sequence[str], embeddings: Sequence[Sequence[float]],
+                       metadatas: Optional[Sequence[dict]] = None, ids: Optional[Sequence[str]] = None) -> List[str]:
+        """Adds (or replaces, by id) chunks whose vectors are already computed."""
+        ids = list(ids) if ids else [uuid.uuid4().hex for _ in texts]
+        metadatas = list(metadatas) if metadatas else [{} for _ in texts]
+        vectors = _normalize(embeddings) if len(ids) else None
+        with self._lock:
+            matrix, old_ids, old_texts, old_metadatas = self._data
+            replaced = set(ids)
+            keep = [i for i, doc_id in enumerate(old_ids) if doc_id not in replaced]
+            kept = np.asarray(matrix[keep]) if keep else np.zeros((0, vectors.shape[1] if vectors is not None else 0), np.float32)
+            if vectors is not None:
+                if kept.shape[0] and kept.shape[1] != vectors.shape[1]:
+                    raise ValueError(f"Vector size {vectors.shape[1]} does not match the store ({kept.shape[1]})")
+                new_matrix = np.vstack([kept, vectors]) if kept.shape[0] else vectors
+            else:
+                new_matrix = kept
+            data = (new_matrix,
+                    [old_ids[i] for i in keep] + ids,
+                    [old_texts[i] for i in keep] + list(texts),
+                    [old_metadatas[i] for i in keep] + metadatas)
+            self._save(*data)
+            self._data = data
+        return ids
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        return self.add_embeddings(texts, self._embedding_function.embed_documents(texts), metadatas, ids)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> None:
+        if not ids:
+            return
+        removed = set(ids)
+        with self._lock:
+            matrix, old_ids, texts, metadatas = self._data
+            keep = [i for i, doc_id in enumerate(old_ids) if doc_id not in removed]
+            data = (np.asarray(matrix[keep]) if keep else np.zeros((0, matrix.shape[1] if matrix.ndim == 2 else 0), np.float32),
+                    [old_ids[i] for i in keep], [texts[i] for i in keep], [metadatas[i] for i in keep])
+            self._save(*data)
+            self._data = data
+
+    def reset_collection(self) -> None:
+        with self._lock:
+            data = (np.zeros((0, 0), np.float32), [], [], [])
+            self._save(*data)
+            self._data = data
+
+    def get(self, ids: Optional[List[str]] = None, include: Optional[List[str]] = None, **kwargs: Any) -> dict:
+        """Chroma-style listing: {"ids": [...], "documents": [...], "metadatas": [...]}."""
+        _, all_ids, texts, metadatas = self._data
+        positions = range(len(all_ids)) if ids is None else [i for i, doc_id in enumerate(all_ids) if doc_id in set(ids)]
+        include = ["documents", "metadatas"] if include is None else include
+        result = {"ids": [all_ids[i] for i in positions]}
+        if "documents" in include:
+            result["documents"] = [texts[i] for i in positions]
+        if "metadatas" in include:
+            result["metadatas"] = [metadatas[i] for i in positions]
+        return result
+
+    def __len__(self) -> int:
+        return len(self._data[1])
+
+    # --- searching ---
+    def _document(self, data, i: int) -> Document:
+        _, ids, texts, metadatas = data
+        return Document(page_content=texts[i], metadata=dict(metadatas[i] or {}), id=ids[i])
+
+    def _top_k(self, data, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Indices and scores of the k best rows for each query row, best first."""
+        matrix = data[0]
+        scores = queries @ matrix.T
+        k = min(k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+    def similarity_search_by_vectors(self, vectors: Sequence[Sequence[float]], k: int = 4) -> List[List[Tuple[Document, float]]]:
+        """Top-k for several queries at once (one matrix product)."""
+        data = self._data
+        if not data[1]:
+            return [[] for _ in vectors]
+        indices, scores = self._top_k(data, _normalize(vectors), k)
+        return [[(self._document(data, int(i)), float(s)) for i, s in zip(row, row_scores)]
+                for row, row_scores in zip(indices, scores)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vectors([self._embedding_function.embed_query(query)], k)[0]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vectors([embedding], k)[0]]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def _select_relevance_score_fn(self):
+        # Scores are cosine similarities in [-1, 1].
+        return lambda score: (score + 1.0) / 2.0
+
+    def max_marginal_relevance_search_by_vector(self, embedding: List[float], k: int = 4, fetch_k: int = 20,
+                                                lambda_mult: float = 0.5, **kwargs: Any) -> List[Document]:
+        data = self._data
+        if not data[1]:
+            return []
+        query = _normalize(embedding)
+        candidates, _ = self._top_k(data, query, fetch_k)
+        candidates = candidates[0]
+        chosen = mmr_select(query[0], np.asarray(data[0][candidates]), k, lambda_mult)
+        return [self._document(data, int(candidates[i])) for i in chosen]
+
+    def max_marginal_relevance_search(self, query: str, k: int = 4, fetch_k: int = 20, lambda_mult: float = 0.5,
+                                      **kwargs: Any) -> List[Document]:
+        return self.max_marginal_relevance_search_by_vector(self._embedding_function.embed_query(query), k, fetch_k,
+                                                            lambda_mult)
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   ids: Optional[List[str]] = None, persist_directory: str = None, **kwargs: Any) -> "NumpyVectorStore":
+        store = cls(persist_directory or tempfile.mkdtemp(), embedding)
+        store.add_texts(texts, metadatas, ids)
+        return store
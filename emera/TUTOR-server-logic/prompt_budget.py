@@ -0,0 +1,189 @@
+"""
+Prompt compaction and per-chain token budgets.
+
+Every chain's prompt goes through compact_prompt before the LLM sees it:
+
+- Fields the template repeats (the question appears under CONTEXT and again just before the
+  answer cue) are sent once, at their last position, which is the one the model reads last.
+- Retrieved chunks are listed as numbered passages with whitespace collapsed and duplicates
+  removed, instead of the repr of a list of Documents.
+- If the prompt is still over the chain's PROMPT_TOKEN_BUDGETS entry, its fields are trimmed
+  least valuable first: the oldest history lines, then the lowest-ranked chunks, then whatever
+  is left of each field in the chain's trim order. A prompt that cannot be trimmed enough (the
+  curriculum chain trims nothing) is sent whole and logged as a warning.
+
+Token counts are the local tokens.estimate_tokens estimate, so nothing is sent to count them.
+Tokens sent and saved go to /metrics per chain and onto the request's log line.
+"""
+
+import re
+import string
+from typing import Any, Dict, List, Optional, Sequence
+
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import Runnable, RunnableLambda
+
+from config import PROMPT_COMPACTION_ENABLED, PROMPT_TOKEN_BUDGETS
+from logging_config import get_logger, request_stats_var
+from metrics import PROMPT_TOKENS, PROMPT_TRUNCATIONS
+from tokens import estimate_tokens, truncate_to_tokens
+
+logger = get_logger("prompt_budget")
+
+# Fields long enough to be worth sending only once.
+DEDUPE_FIELDS = ("current_question", "context", "history")
+# A trimmed field keeps at least this many tokens, so the model still sees what it was about.
+MIN_FIELD_TOKENS = 16
+
+_SECTION_HEADER = re.compile(r"^\s*---.*---\s*$")
+
+
+def _field_counts(template: str) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for _, field, _, _ in string.Formatter().parse(template):
+        if field:
+            counts[field] = counts.get(field, 0) + 1
+    return counts
+
+
+def compact_template(template: str, fields: Sequence[str] = DEDUPE_FIELDS) -> str:
+    """
+    The template with repeated fields kept only at their last occurrence. Only lines that are
+    just the field (optionally after a short "Label:") are dropped; sections left empty go too.
+    """
+    lines = template.split("\n")
+    counts = _field_counts(template)
+    for field in fields:
+        own_line = re.compile(r"^\s*(?:[^{}\n]{0,40}:\s*)?\{%s\}\s*$" % re.escape(field))
+        for i, line in enumerate(lines):
+            if counts.get(field, 0) > 1 and line is not None and own_line.match(line):
+                lines[i] = None
+                counts[field] -= 1
+
+    kept = [line for line in lines if line is not None]
+    # Drop section headers that now have nothing under them before the next header.
+    result: List[str] = []
+    for i, line in enumerate(kept):
+        if _SECTION_HEADER.match(line):
+            rest = kept[i + 1:]
+            body = next((other for other in rest if other.strip()), None)
+            if body is None or _SECTION_HEADER.match(body):
+                continue
+        result.append(line)
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(result))
+
+
+def _chunk_text(doc: Any) -> str:
+    return " ".join(str(getattr(doc, "page_content", doc)).split())
+
+
+def format_documents(docs: Sequence[Any]) -> str:
+    """Retrieved chunks as "[1] text" lines, best first, with duplicate chunks left out."""
+    texts: List[str] = []
+    for doc in docs:
+        text = _chunk_text(doc)
+        if text and text not in texts:
+            texts.append(text)
+    return "\n".join(f"[{i}] {text}" for i, text in enumerate(texts, 1))
+
+
+def _keep_newest(text: str, max_tokens: int) -> str:
+    """History within max_tokens: the oldest lines are dropped first, then the newest is cut."""
+    lines = text.split("\n")
+    while len(lines) > 1 and estimate_tokens("\n".join(lines)) > max_tokens:
+        lines.pop(0)
+    return truncate_to_tokens("\n".join(lines), max_tokens)
+
+
+def _fit_documents(docs: List[str], max_tokens: int) -> List[str]:
+    """Drops the lowest-ranked chunks until they fit; the best one is then cut if still needed."""
+    docs = list(docs)
+    while len(docs) > 1 and estimate_tokens(format_documents(docs)) > max_tokens:
+        docs.pop()
+    if docs and estimate_tokens(format_documents(docs)) > max_tokens:
+        docs[0] = truncate_to_tokens(docs[0], max(MIN_FIELD_TOKENS, max_tokens - 2))
+    return docs
+
+
+class PromptBudget:
+    """
+    Formats one chain's prompt fields within its token budget and records what that saved.
+    trim_order lists the fields that may be shortened, least valuable first.
+    """
+
+    def __init__(self, chain: str, template: str, trim_order: Sequence[str] = (), budget: Optional[int] = None):
+        self.chain = chain
+        self.template = template
+        self.compact = compact_template(template)
+        self.trim_order = tuple(trim_order)
+        self.budget = PROMPT_TOKEN_BUDGETS.get(chain, 0) if budget is None else budget
+        self._counts = _field_counts(self.compact)
+        self._static_tokens = estimate_tokens(self.compact.format(**{f: "" for f in self._counts}))
+
+    def _tokens(self, values: Dict[str, str]) -> int:
+        return self._static_tokens + sum(n * estimate_tokens(values.get(f, "")) for f, n in self._counts.items())
+
+    def apply(self, x: Dict[str, Any]) -> Dict[str, Any]:
+        """The chain input with its prompt fields compacted and trimmed to the budget."""
+        raw = {f: x.get(f, "") for f in self._counts}
+        docs = raw.get("context")
+        docs = [_chunk_text(d) for d in docs] if isinstance(docs, (list, tuple)) else None
+        values = {f: format_documents(docs) if f == "context" and docs is not None else str(v or "")
+                  for f, v in raw.items()}
+
+        trimmed: List[str] = []
+        over = self._tokens(values) - self.budget if self.budget > 0 else 0
+        for field in self.trim_order:
+            if over <= 0:
+                break
+            if field not in values:
+                continue
+            current = estimate_tokens(values[field])
+            needed = -(-over // self._counts[field])  # per occurrence, rounded up
+            allowed = max(MIN_FIELD_TOKENS, current - needed)
+            if allowed >= current:
+                continue
+            if field == "history":
+                values[field] = _keep_newest(values[field], allowed)
+            elif field == "context" and docs is not None:
+                docs = _fit_documents(docs, allowed)
+                values[field] = format_documents(docs)
+            else:
+                values[field] = truncate_to_tokens(values[field], allowed)
+            trimmed.append(field)
+            over = self._tokens(values) - self.budget
+
+        sent = self._tokens(values)
+        if self.budget > 0 and sent > self.budget:
+            logger.warning("Prompt is still over its token budget", extra={
+                "chain": self.chain, "prompt_tokens": sent, "budget": self.budget,
+            })
+        saved = max(0, estimate_tokens(self.template.format(**{f: str(v) for f, v in raw.items()})) - sent)
+        self._record(sent, saved, trimmed)
+        return {**x, **values}
+
+    def _record(self, sent: int, saved: int, trimmed: List[str]):
+        PROMPT_TOKENS.inc(sent, chain=self.chain, kind="sent")
+        PROMPT_TOKENS.inc(saved, chain=self.chain, kind="saved")
+        for field in trimmed:
+            PROMPT_TRUNCATIONS.inc(chain=self.chain, field=field)
+        stats = request_stats_var.get()
+        if stats is not None:
+            stats["prompt_tokens"] = stats.get("prompt_tokens", 0) + sent
+            stats["prompt_tokens_saved"] = stats.get("prompt_tokens_saved", 0) + saved
+        logger.debug("Prompt compacted", extra={
+            "chain": self.chain, "prompt_tokens": sent, "tokens_saved": saved, "trimmed": trimmed,
+        })
+
+
+def compact_prompt(chain: str, template: str, trim_order: Sequence[str] = (), prompt_class=ChatPromptTemplate,
+                   budget: Optional[int] = None) -> Runnable:
+    """
+    The prompt step for a chain: prompt_class.from_template(template), preceded by a PromptBudget
+    step when PROMPT_COMPACTION_ENABLED (budget defaults to the chain's PROMPT_TOKEN_BUDGETS entry).
+    """
+    if not PROMPT_COMPACTION_ENABLED:
+        return prompt_class.from_template(template)
+    prompt_budget = PromptBudget(chain, template, trim_order, budget)
+    return (RunnableLambda(prompt_budget.apply).with_config(run_name="prompt_budget")
+            | prompt_class.from_template(prompt_budget.compact))
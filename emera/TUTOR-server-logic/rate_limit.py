@@ -0,0 +1,58 @@
+import asyncio
+import re
+import threading
+import time
+
+# Quota and transient errors, recognised by type or message (the Google clients raise many exception types).
+_RATE_LIMITED = re.compile(r"\b429\b|resource.?exhausted|quota|rate.?limit|too many requests", re.IGNORECASE)
+_TRANSIENT = re.compile(r"\b(500|502|503|504)\b|unavailable|deadline|timed? ?out|connection", re.IGNORECASE)
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    return bool(_RATE_LIMITED.search(f"{type(error).__name__} {error}"))
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return is_rate_limited(error) or bool(_TRANSIENT.search(f"{type(error).__name__} {error}"))
+
+
+class TokenBucket:
+    """
+    Allows `rate` operations per second on average, with bursts of up to `capacity`.
+    try_acquire() never waits; acquire() waits (asynchronously) until tokens are available.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> float:
+        """Takes the tokens and returns 0, or returns how many seconds until they would be available."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    async def acquire(self, tokens: float = 1.0):
+        while True:
+            wait = self.try_acquire(tokens)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def drain(self):
+        """Empties the bucket, e.g. after the remote side said we are over quota."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self._tokens, 0.0)
@@ -0,0 +1,298 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional, Tuple
+
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from config import (
+    RESPONSE_CACHE_BACKEND,
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_PATH,
+    RESPONSE_CACHE_TTL_SECONDS,
+)
+from intent_router import normalize_text
+from io_pool import run_io
+
+# Words that never change what is asked. Everything else, negations included, must match for a semantic hit.
+FILLER_WORDS = frozenset({"a", "an", "the", "please", "pls", "kindly"})
+
+
+def normalize_question(question: str) -> str:
+    """Normalizes a question for exact matching: case, whitespace and trailing punctuation."""
+    return re.sub(r"[\s?!.।॥]+$", "", normalize_text(question))
+
+
+def hash_text(*parts: Optional[str]) -> str:
+    return hashlib.sha256("\x1f".join(p or "" for p in parts).encode("utf-8")).hexdigest()
+
+
+def content_words(question: str) -> Tuple[str, ...]:
+    """The question's words in order, without punctuation and filler words ("don't" counts as "do not")."""
+    text = re.sub(r"n['’]t\b", " not", normalize_question(question))
+    return tuple(w for w in re.split(r"[\s,.;:!?¿¡।॥\"'“”‘’()\[\]-]+", text) if w and w not in FILLER_WORDS)
+
+
+# --------------------------------------------------------------------------
+# --- Storage backends ---
+# --------------------------------------------------------------------------
+# An entry is a dict with: key, words_key, question, response, created_at.
+# words_key is a second key shared by every wording with the same content words; find(words_key)
+# returns the most recently stored of them. Backends handle storage and LRU eviction; TTL is
+# checked by ResponseCache.
+
+class InMemoryCacheBackend:
+    """Process-local backend; entries are lost on restart."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._by_words: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def find(self, words_key: str) -> Optional[dict]:
+        with self._lock:
+            key = self._by_words.get(words_key)
+        return self.get(key) if key is not None else None
+
+    def put(self, entry: dict):
+        with self._lock:
+            self._entries[entry["key"]] = entry
+            self._entries.move_to_end(entry["key"])
+            self._by_words[entry["words_key"]] = entry["key"]
+            while len(self._entries) > self.max_entries:
+                self._forget(self._entries.popitem(last=False)[1])
+
+    def delete(self, key: str):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._forget(entry)
+
+    def _forget(self, entry: dict):
+        if self._by_words.get(entry["words_key"]) == entry["key"]:
+            del self._by_words[entry["words_key"]]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCacheBackend:
+    """On-disk backend so answers survive restarts and can be shared by several workers."""
+
+    def __init__(self, path: str, max_entries: int):
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(responses)")]
+            if columns and "words_key" not in columns:
+                # Written by a version that matched questions by vector; those answers are simply recomputed.
+                self._conn.execute("DROP TABLE responses")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, words_key TEXT NOT NULL, question TEXT,"
+                " response TEXT, created_at REAL, last_used REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_words_key ON responses (words_key, created_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+
+    def _get(self, where: str, value: str) -> Optional[dict]:
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT key, words_key, question, response, created_at FROM responses"
+                f" WHERE {where} = ? ORDER BY created_at DESC LIMIT 1", (value,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), row[0]))
+        return {"key": row[0], "words_key": row[1], "question": row[2], "response": row[3], "created_at": row[4]}
+
+    def get(self, key: str) -> Optional[dict]:
+        return self._get("key", key)
+
+    def find(self, words_key: str) -> Optional[dict]:
+        return self._get("words_key", words_key)
+
+    def put(self, entry: dict):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (entry["key"], entry["words_key"], entry["question"], entry["response"], entry["created_at"],
+                 time.time()),
+            )
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def delete(self, key: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+# --------------------------------------------------------------------------
+# --- Cache ---
+# --------------------------------------------------------------------------
+class ResponseCache:
+    """
+    Caches final answers keyed on (language, route, normalized question, context hash).
+
+    Lookups try the exact key first, then the words key: a differently worded question in the
+    same (language, route, context) group is only reused if it has the same content words in the
+    same order. Similar-looking questions that differ in a word ("I do not eat meat" / "I do eat
+    meat", pathati / pathanti) need different answers, so nothing looser than that is a hit.
+    """
+
+    def __init__(self, backend, ttl_seconds: float = RESPONSE_CACHE_TTL_SECONDS):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self._stats = Counter()
+        self._lock = threading.Lock()
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl_seconds > 0 and time.time() - created_at > self.ttl_seconds
+
+    def _fresh(self, entry: Optional[dict]) -> Optional[dict]:
+        """The entry, or None if there is none or it has expired (and is dropped)."""
+        if entry is not None and self._expired(entry["created_at"]):
+            self.backend.delete(entry["key"])
+            return None
+        return entry
+
+    @staticmethod
+    def make_keys(language: str, route: str, question: str, context_hash: str = "") -> Tuple[str, str, str]:
+        """Returns (key, words_key, normalized_question)."""
+        normalized = normalize_question(question)
+        group = hash_text((language or "").lower(), route, context_hash)
+        return hash_text(group, normalized), hash_text(group, *content_words(normalized)), normalized
+
+    def lookup(self, language: str, route: str, question: str, context_hash: str = "") -> Optional[str]:
+        key, words_key, _ = self.make_keys(language, route, question, context_hash)
+
+        entry = self._fresh(self.backend.get(key))
+        if entry is not None:
+            self._count("exact_hits")
+            return entry["response"]
+        entry = self._fresh(self.backend.find(words_key))
+        if entry is not None:
+            self._count("semantic_hits")
+            return entry["response"]
+
+        self._count("misses")
+        return None
+
+    def store(self, language: str, route: str, question: str, response: str, context_hash: str = ""):
+        if not response:
+            return
+        key, words_key, normalized = self.make_keys(language, route, question, context_hash)
+        self.backend.put({
+            "key": key, "words_key": words_key, "question": normalized, "response": response,
+            "created_at": time.time(),
+        })
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = {name: self._stats.get(name, 0) for name in ("exact_hits", "semantic_hits", "misses")}
+        lookups = sum(stats.values())
+        stats["hit_rate"] = round((stats["exact_hits"] + stats["semantic_hits"]) / lookups, 4) if lookups else 0.0
+        stats["entries"] = len(self.backend)
+        return stats
+
+
+class CachedChain(Runnable[dict, str]):
+    """
+    Wraps a tool chain (dict in, string out) with a ResponseCache.
+    context_fields are the input fields, besides the question, that change the answer, and
+    version names whatever else does (the knowledge base index the chain retrieves from).
+    """
+
+    def __init__(self, chain: Runnable, cache: ResponseCache, route: str, context_fields: Tuple[str, ...] = (),
+                 version: str = ""):
+        self.chain = chain
+        self.cache = cache
+        self.route = route
+        self.context_fields = context_fields
+        self.version = version
+
+    def _lookup(self, x: dict) -> Tuple[Optional[str], Callable[[str], None]]:
+        """Returns the cached answer (or None) and a function that stores a fresh answer."""
+        language, question = x.get("language") or "", x.get("current_question") or ""
+        context = [self.version] if self.version else []
+        context += [str(x.get(f) or "") for f in self.context_fields]
+        context_hash = hash_text(*context) if context else ""
+        cached = self.cache.lookup(language, self.route, question, context_hash)
+        return cached, lambda response: self.cache.store(language, self.route, question, response, context_hash)
+
+    def invoke(self, input: dict, config: Optional[RunnableConfig] = None, **kwargs: Any) -> str:
+        cached, store = self._lookup(input)
+        if cached is not None:
+            return cached
+        response = self.chain.invoke(input, config)
+        store(response)
+        return response
+
+    async def ainvoke(self, input: dict, config: Optional[RunnableConfig] = None, **kwargs: Any) -> str:
+        return "".join([chunk async for chunk in self.astream(input, config)])
+
+    def stream(self, input: dict, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Iterator[str]:
+        cached, store = self._lookup(input)
+        if cached is not None:
+            yield cached
+            return
+        chunks = []
+        for chunk in self.chain.stream(input, config):
+            chunks.append(chunk)
+            yield chunk
+        store("".join(chunks))
+
+    async def astream(self, input: dict, config: Optional[RunnableConfig] = None, **kwargs: Any) -> AsyncIterator[str]:
+        # The SQLite backend reads from disk, so lookups and stores run on the I/O pool.
+        cached, store = await run_io(self._lookup, input)
+        if cached is not None:
+            yield cached
+            return
+        chunks = []
+        async for chunk in self.chain.astream(input, config):
+            chunks.append(chunk)
+            yield chunk
+        # Only complete answers are stored; an interrupted stream never reaches this line.
+        await run_io(store, "".join(chunks))
+
+
+_default_cache: Optional[ResponseCache] = None
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Returns the shared cache for RESPONSE_CACHE_BACKEND ("memory", "sqlite" or "off")."""
+    global _default_cache
+    if RESPONSE_CACHE_BACKEND == "off":
+        return None
+    if _default_cache is None:
+        if RESPONSE_CACHE_BACKEND == "sqlite":
+            backend = SQLiteCacheBackend(RESPONSE_CACHE_PATH, RESPONSE_CACHE_MAX_ENTRIES)
+        else:
+            backend = InMemoryCacheBackend(RESPONSE_CACHE_MAX_ENTRIES)
+        _default_cache = ResponseCache(backend)
+    return _default_cache
@@ -0,0 +1,193 @@
+"""
+Cache of grammar retrieval results, shared by every knowledge base.
+
+A whole class often asks the same question. The first request runs the retrieval
+(query embedding plus search) and the chunk IDs it found are kept under the normalized
+question. The same question asked again is answered from memory, and identical questions
+arriving while the first is still running wait for its result instead of running their own.
+
+Entries are keyed on the index version: a hash of the knowledge base's chunk IDs (which
+are content hashes) and the retrieval settings. After a re-index the version changes,
+so old entries are never returned again and age out of the LRU.
+"""
+
+import asyncio
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+
+from config import (RETRIEVAL_CACHE_ENABLED, RETRIEVAL_CACHE_MAX_ENTRIES, RETRIEVER_SEARCH_KWARGS,
+                    RETRIEVER_SEARCH_TYPE)
+from hybrid_retriever import _doc_key, tokenize
+
+
+def normalize_query(query: str) -> str:
+    """Case, punctuation, spacing and IAST diacritics do not change the key."""
+    return " ".join(tokenize(query))
+
+
+def index_version(ids, settings: Tuple = ()) -> str:
+    digest = hashlib.sha256(repr(settings).encode("utf-8"))
+    for doc_id in sorted(ids):
+        digest.update(doc_id.encode("utf-8") + b"\0")
+    return digest.hexdigest()[:16]
+
+
+class RetrievalCache:
+    """LRU of key -> chunk IDs, with concurrent computations of the same key coalesced."""
+
+    def __init__(self, max_entries: int = RETRIEVAL_CACHE_MAX_ENTRIES):
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[Hashable, List[str]]" = OrderedDict()
+        self._in_flight: Dict[Hashable, Future] = {}
+        self._tasks = set()
+        self._lock = threading.Lock()
+        self._stats = Counter()
+
+    def _join(self, key: Hashable) -> Tuple[Optional[List[str]], Future, bool]:
+        """(cached IDs or None, the key's in-flight future, whether the caller must compute it)."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return self._entries[key], None, False
+            flight = self._in_flight.get(key)
+            if flight is None:
+                flight = self._in_flight[key] = Future()
+                self._stats["misses"] += 1
+                return None, flight, True
+            self._stats["coalesced"] += 1
+            return None, flight, False
+
+    def _finish(self, key: Hashable, flight: Future, ids: List[str] = None, error: BaseException = None):
+        with self._lock:
+            if error is None:
+                self._entries[key] = ids
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            del self._in_flight[key]
+        if error is None:
+            flight.set_result(ids)
+        else:
+            flight.set_exception(error)
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], List[str]]) -> List[str]:
+        cached, flight, leader = self._join(key)
+        if cached is not None:
+            return cached
+        if not leader:
+            return flight.result()
+        try:
+            ids = compute()
+        except BaseException as e:
+            self._finish(key, flight, error=e)
+            raise
+        self._finish(key, flight, ids)
+        return ids
+
+    async def aget_or_compute(self, key: Hashable, compute: Callable[[], Awaitable[List[str]]]) -> List[str]:
+        """Async version; waiting for another request's result does not hold a thread."""
+        cached, flight, leader = self._join(key)
+        if cached is not None:
+            return cached
+        if leader:
+            # The retrieval runs in its own task, so the first request being cancelled (a student
+            # disconnecting) does not cancel it for the others waiting on the same key.
+            task = asyncio.get_running_loop().create_task(self._acompute(key, flight, compute))
+            # Keep a reference until it finishes, or the task could be garbage-collected.
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        # shield: a cancelled caller must not cancel the shared future.
+        return await asyncio.shield(asyncio.wrap_future(flight))
+
+    async def _acompute(self, key: Hashable, flight: Future, compute: Callable[[], Awaitable[List[str]]]):
+        try:
+            ids = await compute()
+        except BaseException as e:
+            self._finish(key, flight, error=e)
+            if not isinstance(e, Exception):
+                raise
+            return
+        self._finish(key, flight, ids)
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self._stats.get("hits", 0), "misses": self._stats.get("misses", 0),
+                    "coalesced": self._stats.get("coalesced", 0), "entries": len(self._entries)}
+
+
+class CachedRetriever(BaseRetriever):
+    """Wraps a retriever over a fixed set of documents (chunk ID -> Document) with a RetrievalCache."""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    retriever: BaseRetriever
+    cache: RetrievalCache
+    documents: Dict[str, Document]
+    version: str
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        fresh: List[Document] = []
+
+        def retrieve() -> List[str]:
+            fresh.extend(self.retriever.invoke(query, config={"callbacks": run_manager.get_child()}))
+            return [_doc_key(doc) for doc in fresh]
+
+        ids = self.cache.get_or_compute((self.version, normalize_query(query)), retrieve)
+        if fresh:
+            return fresh
+        return [self.documents[doc_id] for doc_id in ids if doc_id in self.documents]
+
+    async def _aget_relevant_documents(self, query: str, *,
+                                       run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        fresh: List[Document] = []
+
+        async def retrieve() -> List[str]:
+            fresh.extend(await self.retriever.ainvoke(query, config={"callbacks": run_manager.get_child()}))
+            return [_doc_key(doc) for doc in fresh]
+
+        ids = await self.cache.aget_or_compute((self.version, normalize_query(query)), retrieve)
+        if fresh:
+            return fresh
+        return [self.documents[doc_id] for doc_id in ids if doc_id in self.documents]
+
+
+def with_retrieval_cache(retriever: BaseRetriever, vectorstore, settings: Tuple = (),
+                         cache: Optional[RetrievalCache] = None) -> BaseRetriever:
+    """
+    Wraps the retriever of a synced store with cache (the shared one by default; unchanged if disabled).
+    settings are the values besides the chunks that change results (embedding model, retriever mode...).
+    """
+    cache = cache or get_retrieval_cache()
+    if cache is None:
+        return retriever
+    stored = vectorstore.get(include=["documents", "metadatas"])
+    documents = {}
+    for doc_id, text, metadata in zip(stored["ids"], stored["documents"], stored["metadatas"]):
+        doc = Document(page_content=text, metadata=metadata or {}, id=doc_id)
+        documents[_doc_key(doc)] = doc
+    settings = (*settings, RETRIEVER_SEARCH_TYPE, sorted(RETRIEVER_SEARCH_KWARGS.items()))
+    return CachedRetriever(retriever=retriever, cache=cache, documents=documents,
+                           version=index_version(documents, settings))
+
+
+_default_cache: Optional[RetrievalCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_retrieval_cache() -> Optional[RetrievalCache]:
+    """Returns the shared cache, or None when RETRIEVAL_CACHE_ENABLED is off."""
+    global _default_cache
+    if not RETRIEVAL_CACHE_ENABLED:
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = RetrievalCache()
+    return _default_cache
@@ -1,9 +1,30 @@
 import os
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+import time
+from contextlib import nullcontext
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
 from typing import Optional, Any, List
 from dotenv import load_dotenv
 
+from admission import (CONVERSATIONAL, GENERAL, LESSON, AdmissionRejected, client_key, get_admission_controller,
+                       retry_after_header)
+from intent_router import CONVERSATIONAL as CONVERSATIONAL_ROUTE, get_intent_classifier
+from llm_client import CHAT_TEMPERATURE, create_llm, resilience_stats
+from speculative import speculation_stats
+from response_cache import get_response_cache
+from lesson_cache import get_lesson_cache
+from embedding_cache import get_embedding_cache
+from retrieval_cache import get_retrieval_cache
+from single_flight import get_single_flight
+from session_store import get_session_store, legacy_turns, render_history
+from io_pool import run_io
+from config import CURRICULUM_PATH, GRAMMAR_RAG_ENABLED, KB_PRELOAD_LANGUAGES
+from curriculum_index import get_curriculum_index
+from kb_registry import get_knowledge_base_registry
+from logging_config import RequestLoggingMiddleware, get_logger
+from metrics import REQUEST_TIME_TO_FIRST_TOKEN, STAGE_DURATION, MetricsMiddleware, StatsCollector, registry
+
 # --- 1. FastAPI setup & Environment Variables ---
 load_dotenv()
 app = FastAPI(
@@ -11,104 +32,50 @@ app = FastAPI(
     description="API for the multi-language AI Tutor application.",
     version="1.0.0"
 )
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(RequestLoggingMiddleware)
+logger = get_logger("server")
 
 # --- 2. Agent initialization ---
 agent_chains = {}
+curriculum_index = get_curriculum_index()
 
 @app.on_event("startup")
 async def startup_event():
     """Initializes the AI agent when the server starts."""
+    # Lessons are served even if the agent fails to start.
+    logger.info("Curriculum index loaded", extra={"languages": await curriculum_index.alanguages()})
+
     try:
-        print("=" * 50)
-        print("🚀 STARTING AGENT INITIALIZATION")
-        print("=" * 50)
+        logger.info("Starting agent initialization")
         
         # Step 1: Check API Key
         api_key = os.getenv("GOOGLE_API_KEY")
         if not api_key:
-            print("❌ GOOGLE_API_KEY not found in .env file")
             raise ValueError("GOOGLE_API_KEY not found in .env file")
         
-        print(f"✅ Step 1: API Key found: {api_key[:10]}...")
-        
-        # Step 2: Test basic imports
-        try:
-            from langchain_google_genai import ChatGoogleGenerativeAI
-            print("✅ Step 2: ChatGoogleGenerativeAI import successful")
-        except Exception as e:
-            print(f"❌ Step 2: Import error: {e}")
-            raise e
-        
-        # Step 3: Initialize LLM
-        try:
-            llm = ChatGoogleGenerativeAI(
-                model="gemini-1.5-flash",
-                temperature=0.7,
-                google_api_key=api_key
-            )
-            print("✅ Step 3: LLM initialized successfully")
-        except Exception as e:
-            print(f"❌ Step 3: LLM initialization error: {e}")
-            raise e
-        
-        # Step 4: Test config import
-        try:
-            from config import GOOGLE_API_KEY as config_key
-            print("✅ Step 4: Config import successful")
-        except Exception as e:
-            print(f"❌ Step 4: Config import error: {e}")
-            # Continue without config for now
-        
-        # Step 5: Test prompts import
-        try:
-            from prompts import CURRICULUM_TUTOR_PROMPT
-            print("✅ Step 5: Prompts import successful")
-        except Exception as e:
-            print(f"❌ Step 5: Prompts import error: {e}")
-            raise e
-        
-        # Step 6: Test agent_logic import
-        try:
-            from agent_logic import create_tutor_agent
-            print("✅ Step 6: Agent logic import successful")
-        except Exception as e:
-            print(f"❌ Step 6: Agent logic import error: {e}")
-            raise e
-        
-        # Step 7: Create agent
-        try:
-            print("🔧 Step 7: Creating tutor agent...")
-            agent_result = create_tutor_agent(llm, grammar_retriever=None)
-            print(f"✅ Step 7: Agent creation returned: {type(agent_result)}")
-            print(f"✅ Step 7: Agent keys: {list(agent_result.keys()) if agent_result else 'Empty'}")
-        except Exception as e:
-            print(f"❌ Step 7: Agent creation error: {e}")
-            import traceback
-            print(f"❌ Step 7: Full traceback: {traceback.format_exc()}")
-            raise e
+        # Step 2: Initialize LLM (LLM_MODEL plus LLM_FALLBACK_MODELS, with timeouts, retries and circuit breakers)
+        llm = create_llm(api_key, temperature=CHAT_TEMPERATURE)
+        logger.debug("LLM initialized")
         
-        # Step 8: Update agent chains
-        try:
-            agent_chains.update(agent_result)
-            print(f"✅ Step 8: Agent chains updated: {list(agent_chains.keys())}")
-        except Exception as e:
-            print(f"❌ Step 8: Agent chains update error: {e}")
-            raise e
+        # Step 3: Create agent. Grammar knowledge bases load in the background on first use
+        # (or now, for KB_PRELOAD_LANGUAGES); the fallback grammar prompt is used until they are ready.
+        from agent_logic import create_tutor_agent
+        grammar_registry = get_knowledge_base_registry() if GRAMMAR_RAG_ENABLED else None
+        agent_result = create_tutor_agent(llm, grammar_registry=grammar_registry)
+        agent_chains.update(agent_result)
         
-        # Step 9: Final verification
+        # Step 4: Final verification
         if "agent" in agent_chains and "curriculum" in agent_chains:
-            print("🎉 SUCCESS: Agent ready and all chains loaded!")
+            logger.info("Agent ready", extra={"chains": list(agent_chains.keys())})
         else:
-            print(f"⚠️ WARNING: Some chains missing. Available: {list(agent_chains.keys())}")
-            
-        print("=" * 50)
+            logger.warning("Some chains missing", extra={"chains": list(agent_chains.keys())})
 
-    except Exception as e:
-        print("=" * 50)
-        print(f"❌ FATAL: Agent initialization failed at: {e}")
-        import traceback
-        print(f"❌ FULL ERROR: {traceback.format_exc()}")
-        print("=" * 50)
+        if grammar_registry and agent_chains:
+            grammar_registry.preload(KB_PRELOAD_LANGUAGES)
+
+    except Exception:
+        logger.exception("Agent initialization failed")
         # We keep agent_chains empty so the app knows the agent is not available.
         agent_chains.clear()
 
@@ -119,12 +86,15 @@ async def root():
     return {
         "message": "🚀 AI Tutor API is running!",
         "version": "1.0.0",
-        "endpoints": ["/health", "/lessons", "/chat", "/test"]
+        "endpoints": ["/health", "/lessons", "/chat", "/chat/stream", "/metrics", "/test"]
     }
 
 class ChatRequest(BaseModel):
     query: str
     language: Optional[str] = None
+    # The server keeps the conversation per session_id; previous_query/previous_response are
+    # only used by clients that do not send one.
+    session_id: Optional[str] = Field(None, max_length=128, pattern=r"^[\w-]+$")
     previous_query: Optional[str] = None
     previous_response: Optional[str] = None
     lesson_to_teach: Optional[int] = None
@@ -137,142 +107,338 @@ class LessonsResponse(BaseModel):
     lessons: List[Lesson]
 
 # --- 4. Lessons endpoint ---
-CURRICULUM_PATH = "curriculum"
 
 @app.get("/lessons", response_model=LessonsResponse)
-async def get_lessons(language: str):
+async def get_lessons(language: str, request: Request, response: Response):
     """Fetches the list of available lessons for a given language."""
     if not language:
         raise HTTPException(status_code=400, detail="Language query parameter is required.")
 
-    language_path = os.path.join(CURRICULUM_PATH, language.lower())
-    print(f"🔍 Looking for lessons in: {language_path}")
-    
-    if not os.path.isdir(language_path):
-        print(f"⚠️ Directory not found: {language_path}")
+    # Served from the in-memory curriculum index; clients that send the last ETag get a 304.
+    etag = await curriculum_index.aetag(language)
+    if etag is None:
+        logger.info("No lessons found", extra={"language": language})
         return {"lessons": []}
-    
-    try:
-        files = [f for f in os.listdir(language_path) if f.startswith("lesson_") and f.endswith(".txt")]
-        files.sort(key=lambda x: int(x.split("_")[1].split(".")[0]))
-        print(f"✅ Found {len(files)} lesson files: {files}")
-        
-        lessons = []
-        for f in files:
-            lesson_num = int(f.split("_")[1].split(".")[0])
-            file_path = os.path.join(language_path, f)
-            try:
-                with open(file_path, "r", encoding="utf-8") as file:
-                    title = file.readline().strip() or f"Lesson {lesson_num}"
-            except Exception as e:
-                print(f"⚠️ Error reading {f}: {e}")
-                title = f"Lesson {lesson_num}"
-            lessons.append({"number": lesson_num, "title": title})
-            
-        print(f"✅ Returning {len(lessons)} lessons")
-        return {"lessons": lessons}
-    except Exception as e:
-        print(f"❌ Error reading lesson files for {language}: {e}")
-        raise HTTPException(status_code=500, detail="Could not read lesson files from the server.")
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
 
-# --- 5. Chat endpoint ---
-@app.post("/chat")
-async def chat(request: ChatRequest):
-    """Handles both curriculum-based and general chat requests."""
-    print("=" * 30)
-    print(f"🔥 CHAT REQUEST RECEIVED")
-    print(f"🔥 lesson_to_teach: {request.lesson_to_teach}")
-    print(f"🔥 language: {request.language}")
-    print(f"🔥 Available agent chains: {list(agent_chains.keys())}")
-    print(f"🔥 Agent chains empty?: {len(agent_chains) == 0}")
-    print("=" * 30)
+    response.headers["ETag"] = etag
+    lessons = [{"number": lesson.number, "title": lesson.title} for lesson in await curriculum_index.alessons(language)]
+    return {"lessons": lessons}
+
+# --- 5. Chat endpoints ---
+async def _prepare_chat(request: ChatRequest):
+    """Picks the chain for a chat request and builds its input."""
+    logger.debug("Chat request received", extra={"lesson_to_teach": request.lesson_to_teach, "language": request.language})
     
     if not agent_chains:
-        print("❌ NO AGENT CHAINS AVAILABLE!")
-        print("❌ This means agent initialization failed during startup")
-        print("❌ Check server startup logs above")
+        logger.error("No agent chains available; agent initialization failed during startup")
         raise HTTPException(status_code=503, detail="Agent is not available or failed to initialize. Please check server logs and restart server.")
 
     if request.lesson_to_teach is not None:
-        print(f"📚 Teaching lesson {request.lesson_to_teach}")
         chain_to_run = agent_chains.get("curriculum")
         
         if not chain_to_run:
-            print("❌ Curriculum chain not found!")
-            print(f"❌ Available chains: {list(agent_chains.keys())}")
+            logger.error("Curriculum chain not found", extra={"chains": list(agent_chains.keys())})
             raise HTTPException(status_code=503, detail="Curriculum chain is not available.")
         
         if not request.language:
             raise HTTPException(status_code=400, detail="Language is required when teaching a lesson.")
             
-        language_folder = request.language.lower()
         lesson_number = request.lesson_to_teach
-        file_path = os.path.join(CURRICULUM_PATH, language_folder, f"lesson_{lesson_number}.txt")
-        print(f"📖 Looking for lesson file: {file_path}")
+        lesson = await curriculum_index.aget_lesson(request.language, lesson_number)
         
-        if not os.path.exists(file_path):
-            print(f"❌ Lesson file not found: {file_path}")
+        if lesson is None:
             raise HTTPException(status_code=404, detail=f"Lesson {lesson_number} for {request.language} not found.")
 
-        try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                lesson_content = f.read()
-            print(f"✅ Lesson content loaded: {len(lesson_content)} characters")
-        except Exception as e:
-            print(f"❌ Error reading lesson file: {e}")
-            raise HTTPException(status_code=500, detail=f"Error reading lesson file: {e}")
-
         agent_input = {
-            "context": lesson_content,
+            "context": lesson.content,
             "language": request.language
         }
     else:
-        print("💬 General chat request")
         chain_to_run = agent_chains.get("agent")
         
         if not chain_to_run:
-            print("❌ General agent chain not found!")
-            print(f"❌ Available chains: {list(agent_chains.keys())}")
+            logger.error("General agent chain not found", extra={"chains": list(agent_chains.keys())})
             raise HTTPException(status_code=503, detail="General agent chain is not available.")
             
+        session_store = get_session_store()
+        if request.session_id and session_store:
+            history = await run_io(session_store.prompt_history, request.session_id)
+        else:
+            history = render_history(legacy_turns(request.previous_query, request.previous_response))
         agent_input = {
             "current_question": request.query,
-            "previous_query": request.previous_query,
-            "previous_response": request.previous_response,
+            "history": history,
             "language": request.language
         }
 
+    return chain_to_run, agent_input
+
+async def _remember(request: ChatRequest, output: str):
+    """Adds the finished turn to the request's session."""
+    session_store = get_session_store()
+    if request.session_id and session_store and output:
+        await run_io(session_store.append, request.session_id, request.query, output)
+
+def _client_id(http_request: Request) -> str:
+    """The signed X-Client-ID (one per browser session in app.py), else the caller's IP; see admission.client_key."""
+    return client_key(http_request.client.host if http_request.client else None, http_request.headers)
+
+def _priority(request: ChatRequest) -> int:
+    if request.lesson_to_teach is not None:
+        return LESSON
+    intent_classifier = get_intent_classifier()
+    if intent_classifier and intent_classifier.classify(request.query)[0] == CONVERSATIONAL_ROUTE:
+        return CONVERSATIONAL
+    return GENERAL
+
+def _admit(request: ChatRequest, http_request: Request):
+    """
+    Applies the client's rate limit (raising AdmissionRejected) and returns the guard to hold
+    around the upstream call, or None when admission control is off.
+    """
+    controller = get_admission_controller()
+    if controller is None:
+        return None
+    controller.check_client(_client_id(http_request))
+    priority = _priority(request)
+    return lambda: controller.slot(priority)
+
+async def _guarded_stream(chain_to_run, agent_input, guard):
+    async with guard() if guard else nullcontext():
+        async for chunk in chain_to_run.astream(agent_input):
+            yield chunk
+
+async def _prefixed(first, chunks):
+    yield first
+    async for chunk in chunks:
+        yield chunk
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected(request: Request, exc: AdmissionRejected):
+    logger.info("Chat request rejected by admission control", extra={"reason": exc.reason})
+    return JSONResponse(status_code=429, content={"detail": str(exc), "reason": exc.reason},
+                        headers={"Retry-After": retry_after_header(exc)})
+
+@app.post("/chat")
+async def chat(request: ChatRequest, http_request: Request):
+    """Handles both curriculum-based and general chat requests."""
+    with STAGE_DURATION.time(stage="prepare"):
+        chain_to_run, agent_input = await _prepare_chat(request)
+    # Only requests that passed validation count against the client's rate limit.
+    guard = _admit(request, http_request)
+
     try:
-        print(f"🤖 Invoking agent with input keys: {list(agent_input.keys())}")
-        response: Any = await chain_to_run.ainvoke(agent_input)
-        print(f"✅ Agent response received: {type(response)}")
-        
+        # Identical requests already being answered share that answer instead of calling the model again.
+        single_flight = get_single_flight()
+        if single_flight:
+            response: Any = await single_flight.ainvoke(chain_to_run, agent_input, guard=guard)
+        else:
+            async with guard() if guard else nullcontext():
+                response = await chain_to_run.ainvoke(agent_input)
         output = response.get("output", str(response)) if isinstance(response, dict) else str(response)
-        print(f"✅ Final output length: {len(output)} characters")
+        logger.debug("Agent response ready", extra={"output_chars": len(output)})
+        await _remember(request, output)
         
         return {"response": output}
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        logger.exception("Error during agent invocation")
+        raise HTTPException(status_code=500, detail=f"Error processing your request: {e}")
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest, http_request: Request):
+    """Same as /chat, but sends the answer as plain-text chunks while the model generates it."""
+    # Validation errors (missing language, unknown lesson...) and admission rejections still come
+    # back as normal HTTP errors because they are raised before the stream starts. Requests that fail
+    # validation never count against the client's rate limit.
+    started = time.perf_counter()
+    with STAGE_DURATION.time(stage="prepare"):
+        chain_to_run, agent_input = await _prepare_chat(request)
+    guard = _admit(request, http_request)
+
+    single_flight = get_single_flight()
+    if single_flight:
+        chunks = single_flight.astream(chain_to_run, agent_input, guard=guard)
+    else:
+        chunks = _guarded_stream(chain_to_run, agent_input, guard)
+    # The first chunk is awaited here, so a request that is not admitted gets a 429, and one that fails
+    # before anything was generated a 500, instead of a 200 stream.
+    try:
+        chunks = _prefixed(await chunks.__anext__(), chunks)
+    except StopAsyncIteration:
+        pass
+    except AdmissionRejected:
+        raise
     except Exception as e:
-        print(f"❌ Error during agent invocation: {e}")
-        import traceback
-        print(f"❌ Full error: {traceback.format_exc()}")
+        logger.exception("Error during agent streaming")
         raise HTTPException(status_code=500, detail=f"Error processing your request: {e}")
 
+    async def token_stream():
+        parts = []
+        try:
+            async for chunk in chunks:
+                text = chunk.get("output", "") if isinstance(chunk, dict) else str(chunk)
+                if text:
+                    if not parts:
+                        REQUEST_TIME_TO_FIRST_TOKEN.observe(time.perf_counter() - started, endpoint="/chat/stream")
+                    parts.append(text)
+                    yield text
+            output = "".join(parts)
+            logger.debug("Stream finished", extra={"output_chars": len(output)})
+            # Only complete answers go into the session; an interrupted stream never reaches this line.
+            await _remember(request, output)
+        except Exception as e:
+            # The status line has already been sent, so the error goes into the body.
+            logger.exception("Error during agent streaming")
+            yield f"\n\n⚠️ Error processing your request: {e}"
+
+    return StreamingResponse(
+        token_stream(),
+        media_type="text/plain; charset=utf-8",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # --- 6. Health check endpoint ---
 @app.get("/health")
 async def health_check():
     """Health check endpoint to verify server status."""
     agent_status = "ready" if agent_chains else "not_ready"
     available_chains = list(agent_chains.keys()) if agent_chains else []
+    intent_classifier = get_intent_classifier()
+    response_cache = get_response_cache()
+    lesson_cache = get_lesson_cache()
+    embedding_cache = get_embedding_cache(create=False)
+    retrieval_cache = get_retrieval_cache()
+    single_flight = get_single_flight()
+    admission = get_admission_controller()
+    session_store = get_session_store()
     
     return {
         "status": "healthy",
         "agent_status": agent_status,
         "available_chains": available_chains,
+        "router_stats": intent_classifier.get_stats() if intent_classifier else None,
+        "speculation_stats": speculation_stats.get_stats(),
+        "llm_client_stats": resilience_stats.get_stats(),
+        "response_cache_stats": response_cache.get_stats() if response_cache else None,
+        "lesson_cache_stats": lesson_cache.get_stats() if lesson_cache else None,
+        "embedding_cache_stats": embedding_cache.get_stats() if embedding_cache else None,
+        "retrieval_cache_stats": retrieval_cache.get_stats() if retrieval_cache else None,
+        "single_flight_stats": single_flight.get_stats() if single_flight else None,
+        "admission_stats": admission.get_stats() if admission else None,
+        "session_stats": session_store.get_stats() if session_store else None,
+        "knowledge_bases": get_knowledge_base_registry().get_stats() if GRAMMAR_RAG_ENABLED else None,
         "curriculum_path_exists": os.path.exists(CURRICULUM_PATH),
         "google_api_key_exists": bool(os.getenv("GOOGLE_API_KEY"))
     }
 
-# --- 7. Test endpoint ---
+# --- 7. Metrics endpoint ---
+def _stats_or_none(get_component):
+    def get_stats():
+        component = get_component()
+        return component.get_stats() if component else None
+    return get_stats
+
+# The existing stats dicts (also shown on /health) are exported as-is.
+registry.register(StatsCollector(
+    "tutor_router", "Routing decisions by source.", _stats_or_none(get_intent_classifier),
+    {"rules": ("decisions_total", "counter", {"source": "rules"}),
+     "model": ("decisions_total", "counter", {"source": "model"}),
+     "llm": ("decisions_total", "counter", {"source": "llm"})},
+))
+registry.register(StatsCollector(
+    "tutor_speculation", "Speculative routing outcomes.", speculation_stats.get_stats,
+    {"hits": ("outcomes_total", "counter", {"outcome": "hit"}),
+     "misses": ("outcomes_total", "counter", {"outcome": "miss"}),
+     "wasted_branches": ("wasted_branches_total", "counter", {}),
+     "wasted_tokens": ("wasted_tokens_total", "counter", {})},
+))
+registry.register(StatsCollector(
+    "tutor_llm_client", "LLM calls, failures and how they were handled.", resilience_stats.get_stats,
+    {"calls": ("calls_total", "counter", {}),
+     "failures": ("failures_total", "counter", {}),
+     "timeouts": ("timeouts_total", "counter", {}),
+     "retries": ("retries_total", "counter", {}),
+     "fallbacks": ("fallbacks_total", "counter", {}),
+     "short_circuits": ("short_circuits_total", "counter", {}),
+     "hedges": ("hedges_total", "counter", {}),
+     "hedge_wins": ("hedge_wins_total", "counter", {}),
+     "open_circuits": ("open_circuits", "gauge", {})},
+))
+registry.register(StatsCollector(
+    "tutor_response_cache", "Response cache lookups by result.", _stats_or_none(get_response_cache),
+    {"exact_hits": ("lookups_total", "counter", {"result": "exact_hit"}),
+     "semantic_hits": ("lookups_total", "counter", {"result": "semantic_hit"}),
+     "misses": ("lookups_total", "counter", {"result": "miss"}),
+     "entries": ("entries", "gauge", {})},
+))
+registry.register(StatsCollector(
+    "tutor_lesson_cache", "Lesson opening cache lookups by result.", _stats_or_none(get_lesson_cache),
+    {"hits": ("lookups_total", "counter", {"result": "hit"}),
+     "misses": ("lookups_total", "counter", {"result": "miss"})},
+))
+registry.register(StatsCollector(
+    "tutor_embedding_cache", "Embedding cache lookups by result.", _stats_or_none(lambda: get_embedding_cache(create=False)),
+    {"hits": ("lookups_total", "counter", {"result": "hit"}),
+     "misses": ("lookups_total", "counter", {"result": "miss"}),
+     "entries": ("entries", "gauge", {}),
+     "query_entries": ("query_entries", "gauge", {})},
+))
+registry.register(StatsCollector(
+    "tutor_retrieval_cache", "Grammar retrieval cache lookups by result.", _stats_or_none(get_retrieval_cache),
+    {"hits": ("lookups_total", "counter", {"result": "hit"}),
+     "misses": ("lookups_total", "counter", {"result": "miss"}),
+     "coalesced": ("lookups_total", "counter", {"result": "coalesced"}),
+     "entries": ("entries", "gauge", {})},
+))
+registry.register(StatsCollector(
+    "tutor_single_flight", "Chat chain calls made upstream and requests that shared one.",
+    _stats_or_none(get_single_flight),
+    {"flights": ("calls_total", "counter", {"result": "upstream"}),
+     "coalesced": ("calls_total", "counter", {"result": "coalesced"}),
+     "in_flight": ("in_flight", "gauge", {})},
+))
+registry.register(StatsCollector(
+    "tutor_sessions", "Conversation sessions kept by the server and history lookups by result.",
+    _stats_or_none(get_session_store),
+    {"sessions": ("active", "gauge", {}),
+     "hits": ("lookups_total", "counter", {"result": "hit"}),
+     "misses": ("lookups_total", "counter", {"result": "miss"}),
+     "turns_stored": ("turns_stored_total", "counter", {}),
+     "expired": ("expired_total", "counter", {})},
+))
+registry.register(StatsCollector(
+    "tutor_knowledge_base", "Grammar knowledge bases in memory, lookups, loads and evictions.",
+    lambda: get_knowledge_base_registry().get_stats() if GRAMMAR_RAG_ENABLED else None,
+    {"resident": ("resident", "gauge", {}),
+     "resident_bytes": ("resident_bytes", "gauge", {}),
+     "hits": ("lookups_total", "counter", {"result": "hit"}),
+     "misses": ("lookups_total", "counter", {"result": "miss"}),
+     "loads": ("loads_total", "counter", {}),
+     "evictions": ("evictions_total", "counter", {})},
+))
+
+registry.register(StatsCollector(
+    "tutor_admission", "Chat requests holding or waiting for an upstream slot, admitted and rejected.",
+    _stats_or_none(get_admission_controller),
+    {"active": ("active", "gauge", {}),
+     "queued": ("queue_depth", "gauge", {}),
+     "admitted": ("requests_total", "counter", {"result": "admitted"}),
+     "rejected_client_rate": ("requests_total", "counter", {"result": "client_rate_limited"}),
+     "rejected_queue_full": ("requests_total", "counter", {"result": "queue_full"}),
+     "rejected_timeout": ("requests_total", "counter", {"result": "queue_timeout"}),
+     "rejected_preempted": ("requests_total", "counter", {"result": "preempted"})},
+))
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: request and per-stage latency, time to first token, tokens and cache stats."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+# --- 8. Test endpoint ---
 @app.get("/test")
 async def test_imports():
     """Test endpoint to check all imports work."""
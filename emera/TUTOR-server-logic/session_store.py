@@ -0,0 +1,315 @@
+"""
+Server-side conversation history, keyed by the session_id the client sends with each chat request.
+
+Clients used to send their previous question and the whole previous answer back on every
+turn, which made requests large and limited memory to one turn. The server now keeps each
+session's last SESSION_MAX_TURNS turns itself and expires sessions SESSION_TTL_SECONDS after
+their last turn. Backends:
+
+- memory: process-local, capped at SESSION_MAX_SESSIONS sessions and SESSION_STORE_MAX_MB;
+  the least recently active sessions are dropped first.
+- sqlite: on disk, so history survives restarts and is shared by workers on one machine.
+- redis: any Redis-compatible server (needs the `redis` package), for several machines.
+
+Before history goes into a prompt it is rendered within SESSION_HISTORY_TOKEN_BUDGET tokens
+(render_history): the newest turns in full, older answers shortened, and the oldest turns
+reduced to their questions.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from config import (SESSION_HISTORY_TOKEN_BUDGET, SESSION_MAX_SESSIONS, SESSION_MAX_TURNS, SESSION_STORE_BACKEND,
+                    SESSION_STORE_MAX_MB, SESSION_STORE_PATH, SESSION_STORE_URL, SESSION_TTL_SECONDS)
+from logging_config import get_logger
+from tokens import estimate_tokens, truncate_to_tokens
+
+logger = get_logger("session_store")
+
+NO_HISTORY = "(none)"
+# Older turns get answers no shorter than this (tokens); below it only their question is kept.
+MIN_ANSWER_TOKENS = 24
+
+
+# --------------------------------------------------------------------------
+# --- Storage backends ---
+# --------------------------------------------------------------------------
+# A session is stored as one JSON string; backends handle storage and eviction, and the
+# TTL is checked by SessionStore (the Redis backend also lets the server expire keys).
+# update(session_id, change, ttl) is an atomic read-modify-write: change(old data or None)
+# returns the new data, and concurrent turns of one session are never lost.
+
+class InMemorySessionBackend:
+    """Process-local backend; sessions are lost on restart. They are kept UTF-8 encoded, so max_bytes is exact."""
+
+    def __init__(self, max_sessions: int = SESSION_MAX_SESSIONS, max_bytes: int = int(SESSION_STORE_MAX_MB * 2 ** 20)):
+        self.max_sessions = max(1, max_sessions)
+        self.max_bytes = max_bytes
+        self._sessions: "OrderedDict[str, bytes]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def load(self, session_id: str) -> Optional[str]:
+        with self._lock:
+            data = self._sessions.get(session_id)
+            if data is None:
+                return None
+            self._sessions.move_to_end(session_id)
+        return data.decode("utf-8")
+
+    def save(self, session_id: str, data: str, ttl_seconds: float):
+        with self._lock:
+            self._save(session_id, data)
+
+    def update(self, session_id: str, change: Callable[[Optional[str]], str], ttl_seconds: float):
+        with self._lock:
+            old = self._sessions.get(session_id)
+            self._save(session_id, change(old.decode("utf-8") if old is not None else None))
+
+    def _save(self, session_id: str, data: str):
+        encoded = data.encode("utf-8")
+        self._bytes += len(encoded) - len(self._sessions.get(session_id, b""))
+        self._sessions[session_id] = encoded
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > 1 and (len(self._sessions) > self.max_sessions
+                                           or (self.max_bytes > 0 and self._bytes > self.max_bytes)):
+            _, dropped = self._sessions.popitem(last=False)
+            self._bytes -= len(dropped)
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._bytes -= len(self._sessions.pop(session_id, b""))
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class SQLiteSessionBackend:
+    """On-disk backend so sessions survive restarts and can be shared by several workers."""
+
+    def __init__(self, path: str = SESSION_STORE_PATH, max_sessions: int = SESSION_MAX_SESSIONS):
+        self.max_sessions = max(1, max_sessions)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data TEXT, updated_at REAL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+
+    def load(self, session_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return row[0] if row else None
+
+    def save(self, session_id: str, data: str, ttl_seconds: float):
+        with self._lock, self._conn:
+            self._save(session_id, data, ttl_seconds)
+
+    def update(self, session_id: str, change: Callable[[Optional[str]], str], ttl_seconds: float):
+        with self._lock:
+            # BEGIN IMMEDIATE takes SQLite's write lock, so other workers' turns wait instead of being overwritten.
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT data FROM sessions WHERE id = ?", (session_id,)).fetchone()
+                self._save(session_id, change(row[0] if row else None), ttl_seconds)
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+
+    def _save(self, session_id: str, data: str, ttl_seconds: float):
+        now = time.time()
+        self._conn.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)", (session_id, data, now))
+        if ttl_seconds > 0:
+            self._conn.execute("DELETE FROM sessions WHERE updated_at < ?", (now - ttl_seconds,))
+        self._conn.execute(
+            "DELETE FROM sessions WHERE id IN (SELECT id FROM sessions ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_sessions,),
+        )
+
+    def delete(self, session_id: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+class RedisSessionBackend:
+    """Sessions in a Redis-compatible server; expiry and memory limits are left to the server."""
+
+    def __init__(self, client=None, url: str = SESSION_STORE_URL, prefix: str = "tutor:session:"):
+        if client is None:
+            import redis  # optional dependency, only needed for this backend
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.client = client
+        self.prefix = prefix
+
+    def load(self, session_id: str) -> Optional[str]:
+        data = self.client.get(self.prefix + session_id)
+        return data.decode("utf-8") if isinstance(data, bytes) else data
+
+    def save(self, session_id: str, data: str, ttl_seconds: float):
+        self.client.set(self.prefix + session_id, data, ex=int(ttl_seconds) if ttl_seconds > 0 else None)
+
+    def update(self, session_id: str, change: Callable[[Optional[str]], str], ttl_seconds: float):
+        key = self.prefix + session_id
+
+        def apply(pipe):
+            # WATCH/MULTI/EXEC: redis-py retries apply if another worker changed the key meanwhile.
+            data = pipe.get(key)
+            new = change(data.decode("utf-8") if isinstance(data, bytes) else data)
+            pipe.multi()
+            pipe.set(key, new, ex=int(ttl_seconds) if ttl_seconds > 0 else None)
+
+        self.client.transaction(apply, key)
+
+    def delete(self, session_id: str):
+        self.client.delete(self.prefix + session_id)
+
+    def __len__(self):
+        return sum(1 for _ in self.client.scan_iter(match=self.prefix + "*"))
+
+
+# --------------------------------------------------------------------------
+# --- Store ---
+# --------------------------------------------------------------------------
+class SessionStore:
+    """Rolling history of (question, answer) turns per session."""
+
+    def __init__(self, backend, ttl_seconds: float = SESSION_TTL_SECONDS, max_turns: int = SESSION_MAX_TURNS,
+                 history_token_budget: int = SESSION_HISTORY_TOKEN_BUDGET):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.max_turns = max(1, max_turns)
+        self.history_token_budget = history_token_budget
+        self._stats = Counter()
+        self._lock = threading.Lock()
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _parse(self, data: Optional[str]) -> Optional[Dict[str, Any]]:
+        """The stored session, or None if there is none or it has expired."""
+        if data is None:
+            return None
+        session = json.loads(data)
+        if self.ttl_seconds > 0 and time.time() - session.get("updated_at", 0) > self.ttl_seconds:
+            self._count("expired")
+            return None
+        return session
+
+    def _load(self, session_id: str) -> Dict[str, Any]:
+        data = self.backend.load(session_id)
+        session = self._parse(data)
+        if session is None:
+            if data is not None:
+                self.backend.delete(session_id)
+            return {"turns": []}
+        return session
+
+    def history(self, session_id: str) -> List[Dict[str, str]]:
+        """The session's turns, oldest first ([] for a new or expired session)."""
+        turns = self._load(session_id)["turns"]
+        self._count("hits" if turns else "misses")
+        return turns
+
+    def prompt_history(self, session_id: str) -> str:
+        """The session's history rendered for a prompt, within history_token_budget."""
+        return render_history(self.history(session_id), self.history_token_budget)
+
+    def append(self, session_id: str, question: str, answer: str):
+        # More than the history budget is never put into a prompt, so it is not kept either.
+        turn = {
+            "question": truncate_to_tokens(question or "", self.history_token_budget),
+            "answer": truncate_to_tokens(answer or "", self.history_token_budget),
+        }
+
+        def add_turn(data: Optional[str]) -> str:
+            session = self._parse(data) or {"turns": []}
+            session["turns"] = (session["turns"] + [turn])[-self.max_turns:]
+            session["updated_at"] = time.time()
+            return json.dumps(session, ensure_ascii=False)
+
+        # One atomic read-modify-write, so two requests of the same session cannot drop each other's turn.
+        self.backend.update(session_id, add_turn, self.ttl_seconds)
+        self._count("turns_stored")
+
+    def clear(self, session_id: str):
+        self.backend.delete(session_id)
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = {name: self._stats.get(name, 0) for name in ("hits", "misses", "turns_stored", "expired")}
+        stats["sessions"] = len(self.backend)
+        return stats
+
+
+# --------------------------------------------------------------------------
+# --- Prompt history ---
+# --------------------------------------------------------------------------
+def render_history(turns: List[Dict[str, str]], token_budget: int = SESSION_HISTORY_TOKEN_BUDGET) -> str:
+    """
+    The turns as "Student: ... / Tutor: ..." lines within token_budget. The newest answer may use
+    half the budget, each older one half as much as the next; once that drops below
+    MIN_ANSWER_TOKENS only questions are kept, and turns that no longer fit are left out.
+    """
+    blocks = []
+    remaining = token_budget
+    answer_budget = token_budget // 2
+    for turn in reversed(turns):
+        question = "Student: " + truncate_to_tokens(turn.get("question") or "", max(1, token_budget // 4))
+        if estimate_tokens(question) > remaining:
+            break
+        block = question
+        answer_tokens = min(answer_budget, remaining - estimate_tokens(question) - 3)
+        if turn.get("answer") and answer_tokens >= MIN_ANSWER_TOKENS:
+            block += "\nTutor: " + truncate_to_tokens(turn["answer"], answer_tokens)
+        answer_budget //= 2
+        remaining -= estimate_tokens(block) + 1
+        blocks.append(block)
+    return "\n".join(reversed(blocks)) or NO_HISTORY
+
+
+def legacy_turns(previous_query: Optional[str], previous_response: Optional[str]) -> List[Dict[str, str]]:
+    """The single turn older clients send as previous_query/previous_response."""
+    if not previous_query and not previous_response:
+        return []
+    return [{"question": previous_query or "", "answer": previous_response or ""}]
+
+
+def history_text(x: dict) -> str:
+    """A chain input's history: the rendered "history" the server adds, else the legacy previous turn."""
+    if x.get("history"):
+        return x["history"]
+    return render_history(legacy_turns(x.get("previous_query"), x.get("previous_response")))
+
+
+_default_store: Optional[SessionStore] = None
+_default_store_lock = threading.Lock()
+
+
+def get_session_store() -> Optional[SessionStore]:
+    """Returns the shared store for SESSION_STORE_BACKEND ("memory", "sqlite", "redis" or "off")."""
+    global _default_store
+    if SESSION_STORE_BACKEND == "off":
+        return None
+    with _default_store_lock:
+        if _default_store is None:
+            if SESSION_STORE_BACKEND == "sqlite":
+                backend = SQLiteSessionBackend()
+            elif SESSION_STORE_BACKEND == "redis":
+                backend = RedisSessionBackend()
+            else:
+                backend = InMemorySessionBackend()
+            _default_store = SessionStore(backend)
+            logger.debug("Session store created", extra={"backend": SESSION_STORE_BACKEND})
+    return _default_store
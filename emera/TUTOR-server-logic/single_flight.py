@@ -0,0 +1,146 @@
+"""
+Single-flight coalescing of identical chain calls.
+
+When a teacher tells a class to start a lesson, dozens of identical requests arrive
+within a second. Requests whose chain and (normalized) input match a call that is
+still running do not call the model again: they wait for that call and get the same
+answer. For streaming, every waiter gets the chunks produced so far and then each new
+chunk as it arrives, so a late joiner's stream is identical to the first one's.
+
+The upstream call runs in a task of its own, so a client that disconnects does not
+cancel it for the others.
+"""
+
+import asyncio
+import json
+import re
+from collections import Counter
+from contextlib import nullcontext
+from typing import Any, AsyncContextManager, AsyncIterator, Callable, Dict, List, Optional
+
+from langchain_core.runnables import Runnable
+
+from config import SINGLE_FLIGHT_ENABLED
+from logging_config import get_logger
+
+logger = get_logger("single_flight")
+
+_SPACES = re.compile(r"\s+")
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        return _SPACES.sub(" ", value).strip()
+    if isinstance(value, dict):
+        return {key: _normalize(v) for key, v in value.items()}
+    return value
+
+
+def flight_key(chain: Runnable, mode: str, input: Any) -> str:
+    """Same chain object, same kind of call and same input (whitespace and language case aside)."""
+    normalized = _normalize(input)
+    if isinstance(normalized, dict) and isinstance(normalized.get("language"), str):
+        normalized["language"] = normalized["language"].lower()
+    return f"{id(chain)}|{mode}|{json.dumps(normalized, sort_keys=True, ensure_ascii=False, default=str)}"
+
+
+class _Flight:
+    def __init__(self):
+        self.chunks: List[Any] = []
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self.waiters = 0
+        self._changed = asyncio.Event()
+
+    def notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def wait_for_change(self):
+        await self._changed.wait()
+
+
+class SingleFlight:
+    """Coalesces concurrent identical ainvoke/astream calls on one event loop."""
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self._tasks = set()
+        self._stats = Counter()
+
+    def _join(self, key: str, start) -> _Flight:
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _Flight()
+            self._stats["flights"] += 1
+            task = asyncio.get_running_loop().create_task(self._run(key, flight, start))
+            # Keep a reference until it finishes, or the task could be garbage-collected.
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        else:
+            self._stats["coalesced"] += 1
+        flight.waiters += 1
+        return flight
+
+    async def _run(self, key: str, flight: _Flight, start):
+        try:
+            await start(flight)
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            self._flights.pop(key, None)
+            if flight.waiters > 1:
+                logger.debug("Coalesced chain call finished", extra={"waiters": flight.waiters})
+            flight.notify()
+
+    async def ainvoke(self, chain: Runnable, input: Any, guard: Callable[[], AsyncContextManager] = None) -> Any:
+        """guard(), if given, is entered around the upstream call (only the first caller's is used)."""
+        async def start(flight: _Flight):
+            async with guard() if guard else nullcontext():
+                flight.result = await chain.ainvoke(input)
+
+        flight = self._join(flight_key(chain, "invoke", input), start)
+        while not flight.done:
+            await flight.wait_for_change()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    async def astream(self, chain: Runnable, input: Any,
+                      guard: Callable[[], AsyncContextManager] = None) -> AsyncIterator[Any]:
+        async def start(flight: _Flight):
+            async with guard() if guard else nullcontext():
+                async for chunk in chain.astream(input):
+                    flight.chunks.append(chunk)
+                    flight.notify()
+
+        flight = self._join(flight_key(chain, "stream", input), start)
+        sent = 0
+        while True:
+            while sent < len(flight.chunks):
+                sent += 1
+                yield flight.chunks[sent - 1]
+            if flight.done:
+                if flight.error is not None:
+                    raise flight.error
+                return
+            await flight.wait_for_change()
+
+    def get_stats(self) -> Dict[str, int]:
+        return {"flights": self._stats.get("flights", 0), "coalesced": self._stats.get("coalesced", 0),
+                "in_flight": len(self._flights)}
+
+
+_default_single_flight: Optional[SingleFlight] = None
+
+
+def get_single_flight() -> Optional[SingleFlight]:
+    """Returns the shared instance, or None when SINGLE_FLIGHT_ENABLED is off."""
+    global _default_single_flight
+    if not SINGLE_FLIGHT_ENABLED:
+        return None
+    if _default_single_flight is None:
+        _default_single_flight = SingleFlight()
+    return _default_single_flight
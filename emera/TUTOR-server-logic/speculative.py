@@ -0,0 +1,181 @@
+import asyncio
+import threading
+from collections import Counter
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.runnables.config import ensure_config
+
+from intent_router import CONVERSATIONAL, IntentClassifier, resolve_route
+from tokens import estimate_tokens
+
+SPECULATION_MODES = ("off", "top1", "all")
+
+_DONE = object()
+
+
+class _TokenCounter(BaseCallbackHandler):
+    """Counts prompt and output tokens of the LLM calls made by one speculative branch."""
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self._streamed_tokens = 0
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.prompt_tokens += sum(estimate_tokens(str(m.content)) for batch in messages for m in batch)
+
+    def on_llm_new_token(self, token: str, **kwargs):
+        self._streamed_tokens += estimate_tokens(token)
+
+    def on_llm_end(self, response, **kwargs):
+        text = "".join(g.text for generations in response.generations for g in generations)
+        self.output_tokens += max(self._streamed_tokens, estimate_tokens(text))
+        self._streamed_tokens = 0
+
+    @property
+    def total(self) -> int:
+        # A cancelled call never reaches on_llm_end, so count what was streamed so far.
+        return self.prompt_tokens + self.output_tokens + self._streamed_tokens
+
+
+class SpeculationStats:
+    """Hit rate and wasted-token totals for the speculative executor."""
+
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, **counts: int):
+        with self._lock:
+            self._counts.update(counts)
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                key: self._counts.get(key, 0)
+                for key in ("local_routes", "speculations", "hits", "misses", "wasted_branches", "wasted_tokens")
+            }
+
+
+# Shared counters, reported on /health.
+speculation_stats = SpeculationStats()
+
+
+class _Branch:
+    """A tool chain started before the router has decided; its chunks are buffered in a queue."""
+
+    def __init__(self, chain: Runnable, x: dict, config: RunnableConfig):
+        self.counter = _TokenCounter()
+        self.queue: asyncio.Queue = asyncio.Queue()
+        callbacks = config.get("callbacks")
+        if callbacks is None or isinstance(callbacks, list):
+            callbacks = list(callbacks or []) + [self.counter]
+        else:
+            callbacks = callbacks.copy()
+            callbacks.add_handler(self.counter, inherit=True)
+        branch_config = {**config, "callbacks": callbacks}
+        self.task = asyncio.create_task(self._run(chain, x, branch_config))
+
+    async def _run(self, chain: Runnable, x: dict, config: RunnableConfig):
+        try:
+            async for chunk in chain.astream(x, config=config):
+                self.queue.put_nowait(chunk)
+            self.queue.put_nowait(_DONE)
+        except Exception as e:
+            self.queue.put_nowait(e)
+
+    async def chunks(self) -> AsyncIterator[Any]:
+        while True:
+            item = await self.queue.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+
+class SpeculativeAgent(Runnable[dict, str]):
+    """
+    Runs the LLM router and the likely tool chain(s) at the same time.
+
+    Modes:
+    - "top1": start only the classifier's best guess next to the router.
+    - "all": start every tool chain next to the router.
+    Once the router answers, the matching branch is kept (its buffered output is
+    replayed) and the others are cancelled. If the router picks a tool that was not
+    started, it runs after the router, just like the sequential pipeline.
+    Questions the classifier is confident about skip the router entirely.
+    """
+
+    def __init__(self, router_chain: Runnable, tool_chains: Dict[str, Runnable], mode: str = "top1",
+                 classifier: Optional[IntentClassifier] = None, stats: Optional[SpeculationStats] = None):
+        if mode not in SPECULATION_MODES or mode == "off":
+            raise ValueError(f"Speculation mode must be 'top1' or 'all', got '{mode}'")
+        self.router_chain = router_chain
+        self.tool_chains = tool_chains
+        self.mode = mode
+        self.classifier = classifier
+        self.stats = stats or speculation_stats
+
+    def _local_decision(self, x: dict):
+        if not self.classifier:
+            return None, CONVERSATIONAL
+        return self.classifier.decide(x.get("current_question", ""))
+
+    def _candidates(self, guess: str) -> List[str]:
+        if self.mode == "all":
+            return list(self.tool_chains)
+        return [guess]
+
+    def invoke(self, input: dict, config: Optional[RunnableConfig] = None, **kwargs: Any) -> str:
+        # Without an event loop there is nothing to overlap, so this is the plain sequential path.
+        route, _ = self._local_decision(input)
+        if route is None:
+            route = resolve_route(self.router_chain.invoke(input, config))
+        return self.tool_chains[route].invoke({**input, "tool_choice": route}, config)
+
+    async def ainvoke(self, input: dict, config: Optional[RunnableConfig] = None, **kwargs: Any) -> str:
+        return "".join([chunk async for chunk in self.astream(input, config)])
+
+    def stream(self, input: dict, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Iterator[str]:
+        yield self.invoke(input, config)
+
+    async def astream(self, input: dict, config: Optional[RunnableConfig] = None, **kwargs: Any) -> AsyncIterator[str]:
+        config = ensure_config(config)
+        route, guess = self._local_decision(input)
+        if route is not None:
+            self.stats.add(local_routes=1)
+            async for chunk in self.tool_chains[route].astream({**input, "tool_choice": route}, config):
+                yield chunk
+            return
+
+        branches = {name: _Branch(self.tool_chains[name], input, config) for name in self._candidates(guess)}
+        winner = None
+        try:
+            route = resolve_route(await self.router_chain.ainvoke(input, config))
+            winner = branches.pop(route, None)
+            self.stats.add(speculations=1, hits=int(winner is not None), misses=int(winner is None))
+            self._discard(branches)
+
+            if winner is None:
+                async for chunk in self.tool_chains[route].astream({**input, "tool_choice": route}, config):
+                    yield chunk
+            else:
+                async for chunk in winner.chunks():
+                    yield chunk
+        finally:
+            # Covers router errors and clients that disconnect mid-stream.
+            if branches:
+                self._discard(branches)
+            if winner is not None:
+                winner.task.cancel()
+
+    def _discard(self, branches: Dict[str, _Branch]):
+        wasted = 0
+        for branch in branches.values():
+            branch.task.cancel()
+            wasted += branch.counter.total
+        self.stats.add(wasted_branches=len(branches), wasted_tokens=wasted)
+        branches.clear()
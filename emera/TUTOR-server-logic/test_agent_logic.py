@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+Tests for the chains assembled in agent_logic.py and the helpers they use.
+A fake LLM stands in for Gemini, so these run offline.
+"""
+
+import asyncio
+import os
+import tempfile
+import time
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableGenerator, RunnableLambda
+
+import agent_logic
+import kb_index
+import prompt_budget
+from agent_logic import create_rag_retriever, create_tutor_agent
+from embedding_pipeline import EmbeddingPipeline
+from kb_index import open_vectorstore
+from intent_router import IntentClassifier, TRANSLATOR, GRAMMAR, CONVERSATIONAL
+from llm_client import OPEN, ResilienceState, ResilientLLM
+from prompt_budget import PromptBudget, compact_prompt
+from response_cache import InMemoryCacheBackend, ResponseCache
+from speculative import SpeculativeAgent, SpeculationStats
+from tokens import estimate_tokens
+
+GENERAL_INPUT = {"language": "Sanskrit", "previous_query": None, "previous_response": None}
+
+
+def _fresh_cache():
+    return ResponseCache(InMemoryCacheBackend(max_entries=100))
+
+
+def test_intent_classifier_rules():
+    """Obvious questions are routed by the keyword rules."""
+    classifier = IntentClassifier()
+    cases = {
+        "What does namaste mean?": TRANSLATOR,
+        "What is sandhi?": GRAMMAR,
+        "Hello guru!": CONVERSATIONAL,
+        "रामः वनं गच्छति": TRANSLATOR,
+    }
+
+    for question, expected_route in cases.items():
+        route, confidence, source = classifier.classify(question)
+        assert (route, confidence, source) == (expected_route, 1.0, "rules")
+
+
+def test_intent_classifier_model():
+    """Questions without keywords fall through to the n-gram model."""
+    route, confidence, source = IntentClassifier().classify("how should I practice every morning?")
+
+    assert source == "model"
+    assert route == CONVERSATIONAL
+    assert 0 < confidence <= 1
+
+
+def test_agent_skips_router_llm_when_confident():
+    """A confident local decision means the only LLM call is the tool itself."""
+    classifier = IntentClassifier()
+    chains = create_tutor_agent(FakeListChatModel(responses=["Sandhi joins sounds."]), intent_classifier=classifier,
+                                response_cache=_fresh_cache())
+
+    answer = chains["agent"].invoke({**GENERAL_INPUT, "current_question": "What is sandhi?"})
+
+    assert answer == "Sandhi joins sounds."
+    assert classifier.get_stats() == {"rules": 1, "model": 0, "llm": 0}
+
+
+def test_agent_falls_back_to_router_llm():
+    """Below the confidence threshold the LLM router decides."""
+    classifier = IntentClassifier()
+    classifier.classify = lambda question: (CONVERSATIONAL, 0.1, "model")
+    chains = create_tutor_agent(FakeListChatModel(responses=["translator", "It means peace."]), intent_classifier=classifier,
+                                response_cache=_fresh_cache())
+
+    answer = chains["agent"].invoke({**GENERAL_INPUT, "current_question": "shanti?"})
+
+    assert answer == "It means peace."
+    assert classifier.get_stats()["llm"] == 1
+
+
+def _tool(answer, sleep=None):
+    return ChatPromptTemplate.from_template("{current_question}") | FakeListChatModel(responses=[answer], sleep=sleep) | StrOutputParser()
+
+
+def _speculative_agent(router_answer, mode, guess):
+    classifier = IntentClassifier()
+    classifier.classify = lambda question: (guess, 0.1, "model")
+    router = ChatPromptTemplate.from_template("{current_question}") | FakeListChatModel(responses=[router_answer]) | StrOutputParser()
+    tools = {
+        TRANSLATOR: _tool("It means peace.", sleep=0.01),
+        GRAMMAR: _tool("Shanti is a feminine noun.", sleep=0.01),
+        CONVERSATIONAL: _tool("Keep going!", sleep=0.01),
+    }
+    return SpeculativeAgent(router, tools, mode=mode, classifier=classifier, stats=SpeculationStats())
+
+
+def test_speculative_top1_hit():
+    """When the guess matches the router, the speculated answer is used and nothing is wasted."""
+    agent = _speculative_agent("translator", "top1", guess=TRANSLATOR)
+
+    answer = asyncio.run(agent.ainvoke({**GENERAL_INPUT, "current_question": "shanti?"}))
+
+    assert answer == "It means peace."
+    stats = agent.stats.get_stats()
+    assert (stats["hits"], stats["misses"], stats["wasted_tokens"]) == (1, 0, 0)
+
+
+def test_speculative_top1_miss_reports_waste():
+    """A wrong guess is cancelled, the routed tool runs, and the wasted prompt tokens are counted."""
+    agent = _speculative_agent("grammar_vocab_expert", "top1", guess=TRANSLATOR)
+
+    answer = asyncio.run(agent.ainvoke({**GENERAL_INPUT, "current_question": "shanti?"}))
+
+    assert answer == "Shanti is a feminine noun."
+    stats = agent.stats.get_stats()
+    assert (stats["hits"], stats["misses"], stats["wasted_branches"]) == (0, 1, 1)
+    assert stats["wasted_tokens"] > 0
+
+
+def test_speculative_all_branches():
+    """In "all" mode every tool starts; the two losers are discarded."""
+    agent = _speculative_agent("conversational_response", "all", guess=TRANSLATOR)
+
+    answer = asyncio.run(agent.ainvoke({**GENERAL_INPUT, "current_question": "shanti?"}))
+
+    assert answer == "Keep going!"
+    assert agent.stats.get_stats()["wasted_branches"] == 2
+
+
+class _CountingEmbeddings(DeterministicFakeEmbedding):
+    embedded: list = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+
+def test_rag_retriever_reindexes_only_changed_chunks(monkeypatch):
+    """Rebuilding the retriever only embeds new or edited chunks and deletes removed ones."""
+    embeddings = _CountingEmbeddings(size=16, embedded=[])
+    monkeypatch.setattr(agent_logic, "create_embeddings", lambda *args: embeddings)
+    data_path, db_path = tempfile.mkdtemp(), tempfile.mkdtemp()
+
+    def write(name, text):
+        with open(os.path.join(data_path, name), "w", encoding="utf-8") as f:
+            f.write(text)
+
+    write("sandhi.txt", "Sandhi joins sounds at word boundaries.")
+    write("cases.txt", "Sanskrit nouns have eight cases.")
+    assert create_rag_retriever("grammar", data_path, db_path) is not None
+    assert len(embeddings.embedded) == 2
+
+    embeddings.embedded.clear()
+    create_rag_retriever("grammar", data_path, db_path)
+    assert embeddings.embedded == []
+
+    write("sandhi.txt", "Sandhi joins sounds at word and morpheme boundaries.")
+    os.remove(os.path.join(data_path, "cases.txt"))
+    retriever = create_rag_retriever("grammar", data_path, db_path)
+    assert embeddings.embedded == ["Sandhi joins sounds at word and morpheme boundaries."]
+    assert [doc.page_content for doc in retriever.retriever.index.documents] == embeddings.embedded
+
+
+def test_kb_rebuild_is_staged_and_swapped_in_when_complete(monkeypatch):
+    """A rebuild that fails half-way leaves the old store live; a complete one replaces it."""
+    data_path, db_path = tempfile.mkdtemp(), tempfile.mkdtemp()
+    with open(os.path.join(data_path, "sandhi.txt"), "w", encoding="utf-8") as f:
+        f.write("Sandhi joins sounds at word boundaries.")
+    embeddings = DeterministicFakeEmbedding(size=8)
+
+    def indexer(model):
+        return kb_index.KnowledgeBaseIndexer(data_path, db_path, embedding_model=model,
+                                             open_store=lambda path: open_vectorstore(path, embeddings, "numpy"))
+
+    first = indexer("model-a")
+    first.sync(open_vectorstore(db_path, embeddings, "numpy"))
+    live = kb_index.current_store_path(db_path)
+
+    def crash(store, ids, *args, **kwargs):
+        store.add_embeddings(["half"], [[0.0] * 8], metadatas=[{}], ids=["half"])
+        raise ConnectionError("crashed mid-rebuild")
+
+    monkeypatch.setattr(kb_index, "write_vectors", crash)
+    try:
+        indexer("model-b").sync(open_vectorstore(db_path, embeddings, "numpy"))
+        assert False, "expected the rebuild to fail"
+    except ConnectionError:
+        pass
+    assert kb_index.current_store_path(db_path) == live
+    assert open_vectorstore(db_path, embeddings, "numpy").get()["ids"] == first.vectorstore.get()["ids"]
+    assert os.path.exists(os.path.join(db_path, kb_index.CHECKPOINT_FILENAME))  # so the retry resumes
+
+    monkeypatch.undo()
+    second = indexer("model-b")
+    assert second.sync(open_vectorstore(db_path, embeddings, "numpy"))["rebuilt"] == 1
+    current = kb_index.current_store_path(db_path)
+    assert current != live
+    assert open_vectorstore(db_path, embeddings, "numpy").get()["ids"] == second.vectorstore.get()["ids"] != ["half"]
+    # The old store, the half-written staging folder and the checkpoint are gone.
+    assert sorted(os.listdir(db_path)) == sorted([os.path.basename(current), kb_index.CURRENT_FILENAME,
+                                                  kb_index.MANIFEST_FILENAME])
+
+
+class _FlakyEmbeddings(DeterministicFakeEmbedding):
+    """Each call takes the next outcome: an exception to raise, or None to answer normally."""
+    outcomes: list = []
+    batches: list = []
+
+    def embed_documents(self, texts):
+        outcome = self.outcomes.pop(0) if self.outcomes else None
+        if outcome is not None:
+            raise outcome
+        self.batches.append(list(texts))
+        return super().embed_documents(texts)
+
+
+def test_embedding_pipeline_retries_and_resumes():
+    """429s are retried; after a hard failure, a second run only embeds what the first did not finish."""
+    texts = {f"id{i}": f"chunk {i}" for i in range(5)}
+    checkpoint = os.path.join(tempfile.mkdtemp(), "checkpoint.jsonl")
+
+    def pipeline(embeddings):
+        return EmbeddingPipeline(embeddings, batch_size=2, max_concurrency=1, requests_per_minute=60000,
+                                 backoff_base=0.01, checkpoint_path=checkpoint)
+
+    # Two batches succeed (the first after one retry), then the service rejects the request.
+    flaky = _FlakyEmbeddings(size=8, batches=[], outcomes=[
+        RuntimeError("429 Resource exhausted"), None, None, ValueError("400 Invalid request")])
+    first = pipeline(flaky)
+    try:
+        first.embed(texts)
+        raise AssertionError("expected the pipeline to fail")
+    except ValueError:
+        pass
+    assert first.stats["retries"] == 1
+    assert flaky.batches == [["chunk 0", "chunk 1"], ["chunk 2", "chunk 3"]]
+
+    healthy = _FlakyEmbeddings(size=8, batches=[], outcomes=[])
+    second = pipeline(healthy)
+    vectors = second.embed(texts)
+    assert healthy.batches == [["chunk 4"]]
+    assert second.stats["resumed"] == 4
+    assert vectors == {text_id: DeterministicFakeEmbedding(size=8).embed_query(text) for text_id, text in texts.items()}
+
+
+def test_resilient_llm_retries_falls_back_and_opens_circuit():
+    """A failing model is retried, then skipped for the fallback; once its circuit opens it is not called at all."""
+    calls = []
+
+    async def unavailable(prompt):
+        calls.append("primary")
+        raise ConnectionError("503 Service Unavailable")
+
+    state = ResilienceState(failure_threshold=2, reset_seconds=60)
+    llm = ResilientLLM([("primary", RunnableLambda(unavailable)),
+                        ("backup", FakeListChatModel(responses=["Namaste!"] * 2))],
+                       max_retries=1, backoff_base=0, state=state)
+    chain = ChatPromptTemplate.from_template("Greet in {language}") | llm.for_route("conversational") | StrOutputParser()
+
+    async def run():
+        first = "".join([chunk async for chunk in chain.astream({"language": "Sanskrit"})])
+        second = await chain.ainvoke({"language": "Sanskrit"})
+        return first, second
+
+    assert asyncio.run(run()) == ("Namaste!", "Namaste!")
+    assert calls == ["primary", "primary"]  # one retry, then the circuit is open
+    stats = state.get_stats()
+    assert stats["circuits"]["primary"] == OPEN
+    assert (stats["retries"], stats["fallbacks"], stats["short_circuits"]) == (1, 2, 1)
+
+
+def test_resilient_llm_hedges_slow_calls_and_times_out():
+    """A slow call is hedged with a second one that answers first; a call slower than its route's timeout fails."""
+    delays = [1.0, 0.0]
+
+    async def sometimes_slow(prompt):
+        await asyncio.sleep(delays.pop(0) if delays else 1.0)
+        return "Dhanyavadah"
+
+    state = ResilienceState()
+    llm = ResilientLLM([("gemini", RunnableLambda(sometimes_slow))], timeouts={"translator": 0.3}, max_retries=0,
+                       hedge=True, hedge_delay=0.05, state=state).for_route("translator")
+
+    started = time.perf_counter()
+    assert asyncio.run(llm.ainvoke("Translate: thank you")) == "Dhanyavadah"
+    assert time.perf_counter() - started < 0.3
+    assert (state.get_stats()["hedges"], state.get_stats()["hedge_wins"]) == (1, 1)
+
+    try:
+        asyncio.run(llm.ainvoke("Translate: thank you"))
+        assert False, "expected a timeout"
+    except TimeoutError:
+        pass
+    assert state.get_stats()["timeouts"] == 1
+
+
+def test_resilient_llm_keeps_stream_and_full_call_latencies_apart():
+    """Time to first chunk and time to the whole answer are different distributions, so each has its own p95."""
+    async def answer(prompts):
+        async for _ in prompts:
+            pass
+        yield "Dhanya"
+        await asyncio.sleep(0.2)
+        yield "vadah"
+
+    state = ResilienceState()
+    llm = ResilientLLM([("gemini", RunnableGenerator(answer))], max_retries=0, hedge=True, hedge_delay=1.0,
+                       hedge_min_samples=1, state=state).for_route("translator")
+
+    async def run():
+        assert await llm.ainvoke("Translate: thank you") == "Dhanyavadah"
+        assert "".join([chunk async for chunk in llm.astream("Translate: thank you")]) == "Dhanyavadah"
+
+    asyncio.run(run())
+    assert state.latency("translator").p95(1) >= 0.2
+    assert state.latency("translator", stream=True).p95(1) < 0.1
+    assert state.get_stats()["hedges"] == 0
+
+
+def test_prompt_budget_dedupes_formats_chunks_and_trims_least_valuable_first():
+    """The question is sent once, chunks as numbered passages, and old history and low-ranked chunks go first."""
+    template = ("Question: {current_question}\nHistory:\n{history}\nReference: {context}\n"
+                "--- ASKED ---\n{current_question}\nAnswer:")
+    docs = [Document(page_content="Sandhi   joins sounds."), Document(page_content="Sandhi   joins sounds."),
+            Document(page_content="Visarga " * 60)]
+    history = "\n".join(f"Student: old question {i}" for i in range(20)) + "\nStudent: What is sandhi?"
+    budget = PromptBudget("grammar", template, ("history", "context", "current_question"), budget=60)
+
+    values = budget.apply({"current_question": "What is sandhi?", "history": history, "context": docs})
+    prompt = ChatPromptTemplate.from_template(budget.compact).invoke(values).to_string()
+
+    assert prompt.count("What is sandhi?") == 2  # once as the question, once as the newest history line
+    assert "old question 0" not in prompt and "Student: What is sandhi?" in prompt
+    assert values["context"] == "[1] Sandhi joins sounds."
+    assert estimate_tokens(prompt) <= 60
+
+    chain = compact_prompt("translator", template, budget=0) | FakeListChatModel(responses=["ok"]) | StrOutputParser()
+    assert chain.invoke({"current_question": "Namaste", "history": "", "context": []}) == "ok"
+
+
+def test_curriculum_prompt_keeps_the_whole_lesson_over_its_budget(monkeypatch):
+    """A lesson longer than a curriculum budget is sent whole: its end holds the practice exercise."""
+    monkeypatch.setattr(prompt_budget, "PROMPT_TOKEN_BUDGETS", {"curriculum": 50})
+    prompts = []
+    chain = agent_logic.create_curriculum_chain(RunnableLambda(lambda p: prompts.append(p.to_string()) or "ok"))
+    lesson = "Lesson 3: Vibhakti. " + "The cases of a noun. " * 200 + "Practice: decline deva."
+
+    assert chain.invoke({"language": "Sanskrit", "context": lesson}) == "ok"
+    assert lesson in prompts[0]
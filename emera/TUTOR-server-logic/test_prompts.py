@@ -20,6 +20,7 @@ def test_prompts():
         "current_question": "What is the meaning of 'namaste'?",
         "previous_query": "Hello",
         "previous_response": "Namaste! How can I help you learn Sanskrit today?",
+        "history": "Student: Hello\nTutor: Namaste! How can I help you learn Sanskrit today?",
         "context": "This is a test lesson about Sanskrit greetings.",
         "lesson_to_teach": 1
     }
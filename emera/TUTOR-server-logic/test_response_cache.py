@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Tests for the translator/grammar response cache (response_cache.py),
+the lesson opening cache (lesson_cache.py) and the embedding cache (embedding_cache.py).
+"""
+
+import asyncio
+import os
+
+import numpy as np
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.runnables import RunnableLambda
+
+from embedding_cache import CachedEmbeddings, EmbeddingStore
+from lesson_cache import CachedLessonChain, LessonOpeningCache, warm_cache
+from response_cache import CachedChain, InMemoryCacheBackend, ResponseCache, SQLiteCacheBackend
+
+
+def _memory_cache(**kwargs):
+    return ResponseCache(InMemoryCacheBackend(max_entries=kwargs.pop("max_entries", 100)), **kwargs)
+
+
+def test_exact_hit_ignores_case_and_punctuation():
+    cache = _memory_cache()
+    cache.store("Sanskrit", "translator", "What does namaste mean?", "Hello / I bow to you.")
+
+    assert cache.lookup("sanskrit", "translator", "  what does NAMASTE mean ") == "Hello / I bow to you."
+    assert cache.lookup("Sanskrit", "grammar_vocab_expert", "What does namaste mean?") is None
+    assert cache.get_stats()["exact_hits"] == 1
+
+
+def test_semantic_hit_needs_the_same_content_words(tmp_path):
+    for cache in (_memory_cache(), ResponseCache(SQLiteCacheBackend(str(tmp_path / "r.sqlite3"), max_entries=10))):
+        cache.store("Sanskrit", "translator", "meaning of dhanyavad", "Thank you.")
+
+        assert cache.lookup("Sanskrit", "translator", "Please, the meaning of dhanyavad!") == "Thank you."
+        assert cache.lookup("Sanskrit", "translator", "meaning of shanti") is None
+        assert cache.lookup("Hindi", "translator", "the meaning of dhanyavad") is None
+        stats = cache.get_stats()
+        assert (stats["semantic_hits"], stats["misses"]) == (1, 2)
+
+
+def test_semantic_lookup_never_serves_questions_differing_in_a_word():
+    """Near-identical questions (negation, one changed word or ending) score above the threshold but must miss."""
+    cache = _memory_cache()
+    pairs = [
+        ("How do you say I do not eat meat in Sanskrit?", "How do you say I do eat meat in Sanskrit?"),
+        ("translate: I am going", "translate: I am not going"),
+        ("what does pathati mean", "what does pathanti mean"),
+        ("meaning of dhanyavad", "meaning of dhanyavadah"),
+    ]
+    for cached, asked in pairs:
+        cache.store("Sanskrit", "translator", cached, f"answer to {cached}")
+
+    for cached, asked in pairs:
+        assert cache.lookup("Sanskrit", "translator", asked) is None, asked
+    assert cache.get_stats()["semantic_hits"] == 0
+
+
+def test_context_hash_separates_entries():
+    cache = _memory_cache()
+    cache.store("Sanskrit", "grammar_vocab_expert", "why?", "Because of sandhi.", context_hash="turn-1")
+
+    assert cache.lookup("Sanskrit", "grammar_vocab_expert", "why?", context_hash="turn-2") is None
+
+
+def test_cached_chain_keys_on_the_index_version():
+    """Answers retrieved from one version of a knowledge base are not served once it is re-indexed."""
+    cache = _memory_cache()
+    question = {"language": "Sanskrit", "current_question": "What is sandhi?", "history": ""}
+    CachedChain(RunnableLambda(lambda x: "old answer"), cache, "grammar_vocab_expert", ("history",),
+                version="v1").invoke(question)
+
+    reindexed = CachedChain(RunnableLambda(lambda x: "new answer"), cache, "grammar_vocab_expert", ("history",),
+                            version="v2")
+    assert reindexed.invoke(question) == "new answer"
+
+
+def test_ttl_and_lru_eviction():
+    expired = _memory_cache(ttl_seconds=1e-9)
+    expired.store("Sanskrit", "translator", "what is water", "Jalam.")
+    assert expired.lookup("Sanskrit", "translator", "what is water") is None
+
+    small = _memory_cache(max_entries=2)
+    small.store("Sanskrit", "translator", "one", "ekam")
+    small.store("Sanskrit", "translator", "two", "dve")
+    small.lookup("Sanskrit", "translator", "one")
+    small.store("Sanskrit", "translator", "three", "trini")
+    assert small.lookup("Sanskrit", "translator", "two") is None
+    assert small.lookup("Sanskrit", "translator", "one") == "ekam"
+
+
+def test_sqlite_backend_persists(tmp_path):
+    path = str(tmp_path / "responses.sqlite3")
+    ResponseCache(SQLiteCacheBackend(path, max_entries=10)).store("Sanskrit", "translator", "what is fire", "Agni.")
+
+    reopened = ResponseCache(SQLiteCacheBackend(path, max_entries=10))
+    assert reopened.lookup("Sanskrit", "translator", "What is fire?") == "Agni."
+    assert reopened.get_stats()["entries"] == 1
+
+
+def test_cached_chain_calls_wrapped_chain_once():
+    calls = []
+
+    def answer(x):
+        calls.append(x["current_question"])
+        return "Namaste means hello."
+
+    chain = CachedChain(RunnableLambda(answer), _memory_cache(), "translator")
+    question = {"language": "Sanskrit", "current_question": "What does namaste mean?"}
+
+    assert chain.invoke(question) == "Namaste means hello."
+    assert asyncio.run(chain.ainvoke(question)) == "Namaste means hello."
+    assert calls == ["What does namaste mean?"]
+
+
+def test_lesson_cache_warm_and_invalidate(tmp_path):
+    """Warm-up renders each lesson once; editing a lesson file changes its key and prunes the old opening."""
+    lesson_file = tmp_path / "curriculum" / "sanskrit" / "lesson_1.txt"
+    lesson_file.parent.mkdir(parents=True)
+    lesson_file.write_text("Lesson 1: Greetings", encoding="utf-8")
+    rendered = []
+    chain = RunnableLambda(lambda x: rendered.append(x["context"]) or f"Opening for {x['context']}")
+    cache = LessonOpeningCache(str(tmp_path / "openings"))
+
+    assert warm_cache(chain, cache, str(tmp_path / "curriculum")) == {"rendered": 1, "pruned": 0}
+    assert warm_cache(chain, cache, str(tmp_path / "curriculum")) == {"skipped": 1, "pruned": 0}
+
+    lesson_file.write_text("Lesson 1: Greetings and numbers", encoding="utf-8")
+    assert cache.get("Lesson 1: Greetings and numbers", "Sanskrit") is None
+    assert warm_cache(chain, cache, str(tmp_path / "curriculum")) == {"rendered": 1, "pruned": 1}
+    assert len(rendered) == 2
+
+
+def test_cached_lesson_chain_serves_from_disk(tmp_path):
+    calls = []
+    chain = CachedLessonChain(RunnableLambda(lambda x: calls.append(1) or "Welcome!"), LessonOpeningCache(str(tmp_path)))
+    lesson = {"context": "Lesson 2: Basic Words", "language": "Sanskrit"}
+
+    assert asyncio.run(chain.ainvoke(lesson)) == "Welcome!"
+    assert chain.invoke({**lesson, "language": "sanskrit"}) == "Welcome!"
+    assert len(calls) == 1
+
+
+class _CountingEmbeddings(DeterministicFakeEmbedding):
+    calls: list = []
+
+    def embed_documents(self, texts):
+        self.calls.append(("documents", list(texts)))
+        return super().embed_documents(texts)
+
+    def embed_query(self, text):
+        self.calls.append(("query", text))
+        return super().embed_query(text)
+
+
+def test_embedding_cache_persists_documents_and_keeps_queries_in_memory(tmp_path):
+    """Only unseen texts reach the model; documents survive a restart, queries stay in a bounded in-memory LRU."""
+    model = _CountingEmbeddings(size=8, calls=[])
+    cached = CachedEmbeddings(model, EmbeddingStore(str(tmp_path)), "fake-model")
+    reference = DeterministicFakeEmbedding(size=8)
+    expected = lambda *texts: np.asarray(reference.embed_documents(list(texts)), dtype=np.float32).tolist()
+
+    assert cached.embed_documents(["agni", "jalam"]) == expected("agni", "jalam")
+    assert cached.embed_documents(["jalam", "vayu", "agni"]) == expected("jalam", "vayu", "agni")
+    assert model.calls == [("documents", ["agni", "jalam"]), ("documents", ["vayu"])]
+    assert cached.embed_query("agni") == expected("agni")[0]
+    assert asyncio.run(cached.aembed_query("agni")) == expected("agni")[0]
+    assert model.calls[-1] == ("query", "agni") and len(model.calls) == 3
+
+    model.calls.clear()
+    reopened = CachedEmbeddings(model, EmbeddingStore(str(tmp_path), max_queries=2), "fake-model")
+    assert reopened.embed_documents(["agni", "jalam", "vayu"]) == expected("agni", "jalam", "vayu")
+    assert reopened.store.get_stats() == {"hits": 3, "misses": 0, "entries": 3, "query_entries": 0}
+    assert model.calls == []
+
+    for question in ["agni", "jalam", "vayu", "vayu"]:
+        reopened.embed_query(question)
+    assert [text for _, text in model.calls] == ["agni", "jalam", "vayu"]
+    assert reopened.store.get_stats()["query_entries"] == 2
+    assert len([name for name in os.listdir(tmp_path) if name.endswith(".f32")]) == 1  # the document space only
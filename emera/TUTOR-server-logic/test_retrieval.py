@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Tests for grammar retrieval: tokenization, the hybrid BM25 + vector retriever (hybrid_retriever.py)
+and the local embedding backend (embedding_backends.py). Nothing here needs the network.
+"""
+
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.retrievers import BaseRetriever
+
+import agent_logic
+import embedding_backends
+from agent_logic import create_rag_retriever
+from config import CURRICULUM_PATH
+from embedding_backends import HashedNgramEmbeddings
+from hybrid_retriever import BM25Index, HybridRetriever, create_retriever, tokenize
+from numpy_store import NumpyVectorStore
+from retrieval_cache import RetrievalCache, with_retrieval_cache
+
+CHUNKS = [
+    Document(page_content="Sandhi refers to the phonetic changes when words are combined: a + i = e.", id="sandhi"),
+    Document(page_content="Nouns decline in eight cases (vibhakti): nominative, accusative and more.", id="cases"),
+    Document(page_content="धर्म means duty or righteousness; कर्म means action.", id="words"),
+    Document(page_content="Verbs have three persons and three numbers: singular, dual, plural.", id="verbs"),
+]
+
+
+class _FakeVectorRetriever(BaseRetriever):
+    """Returns fixed documents and records the queries it was asked."""
+    results: list
+    queries: list = []
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        self.queries.append(query)
+        return self.results
+
+
+def test_tokenize_devanagari_and_iast():
+    """Devanagari words stay whole (virama, vowel signs), dandas split, IAST diacritics fold to ASCII."""
+    assert tokenize("संस्कृतम् भाषा। धर्मः॥") == ["संस्कृतम्", "भाषा", "धर्मः"]
+    assert tokenize("Saṃdhi and MOKṢA") == tokenize("samdhi and moksa") == ["samdhi", "and", "moksa"]
+    # Decomposed input (a + combining macron) matches the precomposed form.
+    assert tokenize("ātman") == tokenize("ātman") == ["atman"]
+
+
+def test_hybrid_short_circuits_on_exact_match():
+    """A clear keyword hit is answered by BM25 alone, without asking the vector retriever."""
+    vector = _FakeVectorRetriever(results=[CHUNKS[3]], queries=[])
+    retriever = HybridRetriever(index=BM25Index(CHUNKS), vector_retriever=vector, k=2)
+
+    assert retriever.invoke("What is sandhi?")[0].id == "sandhi"
+    assert retriever.invoke("धर्म")[0].id == "words"
+    assert vector.queries == []
+
+
+def test_hybrid_fuses_lexical_and_vector_results():
+    """Vague questions use both retrievers; a chunk found by both ranks first, one only the vector side found still makes the top k."""
+    vector = _FakeVectorRetriever(results=[CHUNKS[2], CHUNKS[3]], queries=[])
+    retriever = HybridRetriever(index=BM25Index(CHUNKS), vector_retriever=vector, k=3)
+
+    results = retriever.invoke("How do nouns and verbs change form in sentences?")
+    assert vector.queries == ["How do nouns and verbs change form in sentences?"]
+    assert results[0].id == "verbs"
+    assert {doc.id for doc in results} == {"verbs", "cases", "words"}
+
+
+def test_hashed_ngram_embeddings_are_similar_for_related_text():
+    embeddings = HashedNgramEmbeddings(dim=256)
+    query, related, unrelated = embeddings.embed_documents(["declension of nouns", "Nouns decline in eight cases", "Verbs have three persons"])
+    similarity = lambda a, b: sum(x * y for x, y in zip(a, b))
+    assert abs(similarity(query, query) - 1.0) < 1e-5
+    assert similarity(query, related) > similarity(query, unrelated)
+    assert embeddings.embed_query("धर्म") == embeddings.embed_documents(["धर्म"])[0]
+
+
+def test_rag_path_runs_offline_with_local_embeddings(monkeypatch, tmp_path):
+    """The grammar KB builds and answers with EMBEDDING_MODEL=local:..., and switching models rebuilds the store."""
+    data_path = os.path.join(CURRICULUM_PATH, "sanskrit", "grammar_vocab")
+    db_path = str(tmp_path / "grammar_db")
+
+    # Built first with another model (different vector size)...
+    fake = DeterministicFakeEmbedding(size=16)
+    with monkeypatch.context() as patch:
+        patch.setattr(agent_logic, "EMBEDDING_MODEL", "fake-model")
+        patch.setattr(agent_logic, "create_embeddings", lambda *args: fake)
+        assert create_rag_retriever("grammar", data_path, db_path) is not None
+
+    # ...then switched to the local backend.
+    monkeypatch.setattr(agent_logic, "EMBEDDING_MODEL", "local:hashed-ngram")
+    retriever = create_rag_retriever("grammar", data_path, db_path)
+    assert isinstance(retriever.retriever.vector_retriever.vectorstore.embeddings, HashedNgramEmbeddings)
+    assert "dharma" in retriever.invoke("What does dharma mean?")[0].page_content
+    assert "Sandhi" in retriever.invoke("How do sounds combine between words?")[0].page_content
+
+
+def test_changing_local_embedding_dim_re_embeds_the_knowledge_base(monkeypatch, tmp_path):
+    """The local model's dimension is part of its identity, so a new LOCAL_EMBEDDING_DIM rebuilds the store."""
+    monkeypatch.setattr(agent_logic, "EMBEDDING_MODEL", "local:hashed-ngram")
+    monkeypatch.setattr(agent_logic, "VECTOR_STORE", "numpy")
+    data_path = os.path.join(CURRICULUM_PATH, "sanskrit", "grammar_vocab")
+    db_path = str(tmp_path / "grammar_db")
+
+    for dim in (32, 48):
+        monkeypatch.setattr(embedding_backends, "LOCAL_EMBEDDING_DIM", dim)
+        retriever = create_rag_retriever("grammar", data_path, db_path)
+        store = retriever.retriever.vector_retriever.vectorstore
+        assert store.embeddings.dim == dim
+        assert "dharma" in retriever.invoke("What does dharma mean?")[0].page_content
+    with open(os.path.join(db_path, "kb_manifest.json"), encoding="utf-8") as f:
+        assert json.load(f)["settings"]["embedding_model"] == "local:hashed-ngram-48"
+
+
+def test_numpy_store_matches_exact_search_and_persists(monkeypatch, tmp_path):
+    """Top-k and MMR agree with brute force, updates survive a reload, and the store serves the RAG path."""
+    embeddings = HashedNgramEmbeddings(dim=128)
+    texts = ["Nouns decline in eight cases", "Verbs have three persons", "Sandhi joins sounds",
+             "Dharma means duty", "Nouns and pronouns decline alike"]
+    store = NumpyVectorStore(str(tmp_path / "store"), embeddings)
+    store.add_texts(texts, metadatas=[{"n": i} for i in range(len(texts))], ids=[f"c{i}" for i in range(len(texts))])
+
+    query = embeddings.embed_query("how do nouns decline")
+    exact = sorted(range(len(texts)), key=lambda i: -sum(a * b for a, b in zip(query, embeddings.embed_query(texts[i]))))
+    assert [doc.id for doc in store.similarity_search("how do nouns decline", k=3)] == [f"c{i}" for i in exact[:3]]
+    mmr = store.max_marginal_relevance_search("how do nouns decline", k=2, fetch_k=5)
+    assert mmr[0].id == f"c{exact[0]}" and len({doc.id for doc in mmr}) == 2
+
+    store.delete(["c1"])
+    store.add_texts(["Dharma is righteous duty"], ids=["c3"])
+    reloaded = NumpyVectorStore(str(tmp_path / "store"), embeddings)
+    assert sorted(reloaded.get(include=[])["ids"]) == ["c0", "c2", "c3", "c4"]
+    assert reloaded.similarity_search("righteous duty", k=1)[0].page_content == "Dharma is righteous duty"
+
+    monkeypatch.setattr(agent_logic, "EMBEDDING_MODEL", "local:hashed-ngram")
+    monkeypatch.setattr(agent_logic, "VECTOR_STORE", "numpy")
+    data_path = os.path.join(CURRICULUM_PATH, "sanskrit", "grammar_vocab")
+    retriever = create_rag_retriever("grammar", data_path, str(tmp_path / "grammar_db"))
+    assert isinstance(retriever.retriever.vector_retriever.vectorstore, NumpyVectorStore)
+    assert "dharma" in retriever.invoke("What does dharma mean?")[0].page_content
+
+
+def test_retrieval_cache_coalesces_identical_queries_and_follows_index_version(tmp_path):
+    """Concurrent identical questions run one search; a changed index (new version) searches again."""
+    embeddings = HashedNgramEmbeddings(dim=64)
+    store = NumpyVectorStore(str(tmp_path / "store"), embeddings)
+    store.add_texts(["Sandhi joins sounds", "Dharma means duty"], ids=["sandhi", "dharma"])
+    searches = []
+
+    class SlowRetriever(BaseRetriever):
+        def _get_relevant_documents(self, query, *, run_manager):
+            searches.append(query)
+            time.sleep(0.05)
+            return store.similarity_search(query, k=1)
+
+    cache = RetrievalCache(max_entries=10)
+    retriever = with_retrieval_cache(SlowRetriever(), store, cache=cache)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(retriever.invoke, ["What is sandhi?"] * 7 + ["what is  SANDHI"]))
+    assert len(searches) == 1
+    assert all(docs[0].id == "sandhi" for docs in results)
+    stats = cache.get_stats()
+    assert stats["misses"] == 1 and stats["coalesced"] + stats["hits"] == 7
+
+    store.add_texts(["Sandhi: rules for joining sounds at word boundaries"], ids=["sandhi-rules"])
+    assert with_retrieval_cache(SlowRetriever(), store, cache=cache).version != retriever.version
+    with_retrieval_cache(SlowRetriever(), store, cache=cache).invoke("What is sandhi?")
+    assert len(searches) == 2
+
+
+def test_async_retrieval_awaits_the_embedding_client(tmp_path):
+    """ainvoke awaits the query embedding, so 20 concurrent questions overlap instead of queueing."""
+
+    class SlowAsyncEmbeddings(HashedNgramEmbeddings):
+        def embed_query(self, text):
+            raise AssertionError("the async path must not call the blocking client")
+
+        async def aembed_query(self, text):
+            await asyncio.sleep(0.1)
+            return super().embed_query(text)
+
+    store = NumpyVectorStore(str(tmp_path / "store"), SlowAsyncEmbeddings(dim=64))
+    store.add_texts(["Sandhi joins sounds", "Dharma means duty"], ids=["sandhi", "dharma"])
+    retriever = create_retriever(store, "vector")
+
+    async def ask_all():
+        start = time.perf_counter()
+        results = await asyncio.gather(*(retriever.ainvoke(f"sandhi sounds {i}") for i in range(20)))
+        return time.perf_counter() - start, results
+
+    elapsed, results = asyncio.run(ask_all())
+    assert elapsed < 1.0
+    assert all(docs[0].id == "sandhi" for docs in results)
+
+
+def test_cancelled_first_request_does_not_cancel_coalesced_retrieval():
+    """The student who started a retrieval disconnecting leaves it running for those waiting on it."""
+    cache = RetrievalCache()
+    started = []
+
+    async def retrieve():
+        started.append(1)
+        await asyncio.sleep(0.05)
+        return ["sandhi"]
+
+    async def run():
+        first = asyncio.ensure_future(cache.aget_or_compute("what is sandhi", retrieve))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(cache.aget_or_compute("what is sandhi", retrieve))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return first, await second
+
+    first, second = asyncio.run(run())
+    assert first.cancelled() and second == ["sandhi"] and started == [1]
+    assert cache.get_stats()["entries"] == 1
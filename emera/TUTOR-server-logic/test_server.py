@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""
+Tests for the FastAPI endpoints in server.py.
+The agent chains are built around a fake LLM so no Gemini calls are made.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import threading
+
+import httpx
+from fastapi.testclient import TestClient
+from langchain_core.documents import Document
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.runnables import RunnableGenerator, RunnableLambda
+
+import admission
+import kb_registry
+import server
+from admission import CONVERSATIONAL, GENERAL, LESSON, AdmissionController, AdmissionRejected, sign_client_id
+from agent_logic import create_tutor_agent
+from curriculum_index import CurriculumIndex
+from kb_registry import KnowledgeBaseRegistry
+from lesson_cache import LessonOpeningCache
+from logging_config import JsonFormatter, RequestIdFilter, request_id_var
+from response_cache import InMemoryCacheBackend, ResponseCache
+from session_store import InMemorySessionBackend, SQLiteSessionBackend, SessionStore, render_history
+from tokens import estimate_tokens
+
+
+def _install_fake_agent(responses):
+    """Replaces the server's chains with ones backed by a fake LLM."""
+    server.agent_chains.clear()
+    server.agent_chains.update(create_tutor_agent(
+        FakeListChatModel(responses=responses),
+        response_cache=ResponseCache(InMemoryCacheBackend(max_entries=100)),
+        lesson_cache=LessonOpeningCache(tempfile.mkdtemp()),
+    ))
+
+
+def test_chat_stream_general_question():
+    """The general agent streams the chosen tool's answer (routed locally, no router LLM call)."""
+    _install_fake_agent(["Namaste means hello."])
+    client = TestClient(server.app)
+
+    with client.stream("POST", "/chat/stream", json={"query": "What does namaste mean?", "language": "Sanskrit"}) as response:
+        assert response.status_code == 200
+        body = "".join(response.iter_text())
+
+    assert body == "Namaste means hello."
+
+
+def test_chat_stream_lesson():
+    """Starting a lesson streams the curriculum chain's answer."""
+    _install_fake_agent(["Welcome to lesson 1."])
+    client = TestClient(server.app)
+
+    response = client.post("/chat/stream", json={"query": "start", "language": "Sanskrit", "lesson_to_teach": 1})
+
+    assert response.status_code == 200
+    assert response.text == "Welcome to lesson 1."
+
+
+def test_chat_stream_rejects_missing_lesson():
+    """Unknown lessons fail with a normal 404 before the stream starts."""
+    _install_fake_agent(["unused"])
+    client = TestClient(server.app)
+
+    response = client.post("/chat/stream", json={"query": "start", "language": "Sanskrit", "lesson_to_teach": 99})
+
+    assert response.status_code == 404
+
+
+def test_chat_stream_fails_with_500_before_the_first_chunk():
+    """A chain that fails before streaming anything gets a normal 500, not a 200 with the error in the body."""
+    def broken(_):
+        raise ConnectionError("model unavailable")
+
+    server.agent_chains.clear()
+    server.agent_chains["agent"] = RunnableLambda(broken)
+    client = TestClient(server.app)
+
+    response = client.post("/chat/stream", json={"query": "What does namaste mean?", "language": "Sanskrit"})
+
+    assert response.status_code == 500
+    assert "model unavailable" in response.json()["detail"]
+
+
+def test_lessons_etag():
+    """/lessons is served from the curriculum index with an ETag; a matching If-None-Match gets a 304."""
+    client = TestClient(server.app)
+
+    response = client.get("/lessons", params={"language": "Sanskrit"})
+    assert response.status_code == 200
+    assert response.json()["lessons"][0] == {"number": 1, "title": "Lesson 1: Introduction to Sanskrit"}
+
+    etag = response.headers["ETag"]
+    cached = client.get("/lessons", params={"language": "Sanskrit"}, headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+
+
+def test_curriculum_index_picks_up_changes(tmp_path):
+    """Edited, added and removed lesson files are noticed on the next check."""
+    language_dir = tmp_path / "sanskrit"
+    language_dir.mkdir()
+    (language_dir / "lesson_1.txt").write_text("Lesson 1: Greetings\nनमस्ते", encoding="utf-8")
+    index = CurriculumIndex(str(tmp_path), check_interval=0)
+    first_etag = index.etag("Sanskrit")
+
+    (language_dir / "lesson_1.txt").write_text("Lesson 1: Greetings and Farewells\nनमस्ते", encoding="utf-8")
+    (language_dir / "lesson_2.txt").write_text("Lesson 2: Numbers", encoding="utf-8")
+
+    assert [lesson.title for lesson in index.lessons("Sanskrit")] == ["Lesson 1: Greetings and Farewells", "Lesson 2: Numbers"]
+    assert index.etag("Sanskrit") != first_etag
+
+    (language_dir / "lesson_2.txt").unlink()
+    assert index.get_lesson("sanskrit", 2) is None
+
+
+def test_request_id_header():
+    """Every response carries a correlation ID; a client-supplied X-Request-ID is reused."""
+    client = TestClient(server.app)
+
+    assert client.get("/health", headers={"X-Request-ID": "class-7b"}).headers["X-Request-ID"] == "class-7b"
+    assert client.get("/health").headers["X-Request-ID"]
+
+
+def test_json_log_record_has_request_id_and_extras():
+    record = logging.LogRecord("tutor.server", logging.INFO, __file__, 1, "Lesson %s started", (2,), None)
+    record.language = "Sanskrit"
+    token = request_id_var.set("req-42")
+    try:
+        RequestIdFilter().filter(record)
+    finally:
+        request_id_var.reset(token)
+
+    entry = json.loads(JsonFormatter().format(record))
+
+    assert (entry["message"], entry["request_id"], entry["language"]) == ("Lesson 2 started", "req-42", "Sanskrit")
+
+
+def test_metrics_endpoint_reports_stage_latency():
+    """After a chat request, /metrics exposes per-stage latency and request timings in Prometheus format."""
+    _install_fake_agent(["Namaste means hello."])
+    client = TestClient(server.app)
+    client.post("/chat/stream", json={"query": "What does namaste mean?", "language": "Sanskrit"})
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'tutor_stage_duration_seconds_count{stage="llm"}' in response.text
+    assert 'tutor_stage_duration_seconds_count{stage="translator"}' in response.text
+    assert 'tutor_request_time_to_first_token_seconds_count{endpoint="/chat/stream"}' in response.text
+    assert 'tutor_http_request_duration_seconds_count{method="POST",path="/chat/stream",status="200"}' in response.text
+
+
+
+def test_grammar_knowledge_bases_load_per_language_with_lru(tmp_path, monkeypatch):
+    """A language's KB loads in the background on its first grammar question; the LRU one is evicted."""
+    for language in ("sanskrit", "pali"):
+        folder = tmp_path / language / "grammar_vocab"
+        folder.mkdir(parents=True)
+        (folder / "notes.txt").write_text(f"{language} grammar notes", encoding="utf-8")
+    release = threading.Event()
+    queries = []
+
+    def build(language, data_path, db_path):
+        release.wait(5)
+        return RunnableLambda(lambda query: queries.append((language, query)) or [Document(page_content=language)])
+
+    kbs = KnowledgeBaseRegistry(root=str(tmp_path), db_root=str(tmp_path / "db"), max_resident=1, build=build)
+    server.agent_chains.clear()
+    server.agent_chains.update(create_tutor_agent(
+        FakeListChatModel(responses=["grammar", "Sandhi joins sounds."]),
+        response_cache=ResponseCache(InMemoryCacheBackend(max_entries=100)),
+        lesson_cache=LessonOpeningCache(tempfile.mkdtemp()),
+        grammar_registry=kbs,
+    ))
+    client = TestClient(server.app)
+
+    # Still loading: answered with the fallback prompt, without blocking and without listing the data folder.
+    listed, listdir = [], os.listdir
+    monkeypatch.setattr(kb_registry.os, "listdir", lambda path: listed.append(path) or listdir(path))
+    for _ in range(3):
+        assert client.post("/chat", json={"query": "Explain sandhi rules", "language": "Sanskrit"}).status_code == 200
+    assert queries == [] and kbs.get_stats()["languages"]["sanskrit"]["state"] == "loading"
+    assert len(listed) == 1  # checked once, when the load started
+    monkeypatch.undo()
+
+    release.set()
+    kbs.wait("sanskrit", timeout=5)
+    client.post("/chat", json={"query": "Explain sandhi rules in verse", "language": "Sanskrit"})
+    assert queries == [("sanskrit", "Explain sandhi rules in verse")]
+
+    kbs.wait("pali", timeout=5)
+    stats = kbs.get_stats()
+    assert stats["resident"] == 1 and stats["evictions"] == 1 and list(stats["languages"]) == ["pali"]
+    assert kbs.get("Klingon") == (None, False) and kbs.get("../sanskrit") == (None, False)
+
+
+def test_identical_lesson_starts_share_one_model_call(monkeypatch):
+    """A class starting the same lesson at once makes one upstream call; every student gets the full answer."""
+    monkeypatch.setattr(admission, "ADMISSION_CLIENT_ID_SECRET", "shared-secret")
+    calls = []
+
+    async def lesson_opening(inputs):
+        async for agent_input in inputs:
+            calls.append(agent_input["language"])
+        for word in ["Namaste", " class", "!"]:
+            await asyncio.sleep(0.02)
+            yield word
+
+    server.agent_chains.clear()
+    server.agent_chains.update({"agent": RunnableLambda(lambda x: "unused"),
+                                "curriculum": RunnableGenerator(lesson_opening)})
+
+    async def start_lesson(client, endpoint, language, student):
+        response = await client.post(endpoint, json={"query": "start", "language": language, "lesson_to_teach": 1},
+                                     headers={"X-Client-ID": sign_client_id(f"student-{student}")})
+        return response.text
+
+    async def classroom():
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            streamed = await asyncio.gather(*(start_lesson(client, "/chat/stream", language, student)
+                                              for student, language in enumerate(["Sanskrit", "sanskrit"] * 10)))
+            answered = await asyncio.gather(*(start_lesson(client, "/chat", "Sanskrit", student)
+                                              for student in range(10)))
+        return streamed, answered
+
+    streamed, answered = asyncio.run(classroom())
+    assert streamed == ["Namaste class!"] * 20
+    assert [json.loads(body)["response"] for body in answered] == ["Namaste class!"] * 10
+    assert len(calls) == 2  # one stream, one invoke
+
+
+def test_admission_control_orders_queue_and_rejects_with_retry_after(monkeypatch):
+    """Queued calls are served lesson-first; a full queue and a client over its rate limit get a 429."""
+    controller = AdmissionController(max_concurrency=1, queue_size=3, queue_timeout=5,
+                                     client_rate_per_minute=1, client_burst=3)
+
+    async def queue_order():
+        order = []
+
+        async def call(name, priority):
+            async with controller.slot(priority):
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        first = asyncio.create_task(call("first", GENERAL))
+        await asyncio.sleep(0)
+        queued = [asyncio.create_task(call(name, priority)) for name, priority in
+                  [("chat", CONVERSATIONAL), ("question", GENERAL), ("lesson", LESSON)]]
+        await asyncio.sleep(0)
+        try:
+            await call("overflow", CONVERSATIONAL)
+        except AdmissionRejected as e:
+            rejected = e.reason
+        await asyncio.gather(first, *queued)
+        return order, rejected
+
+    order, rejected = asyncio.run(queue_order())
+    assert order == ["first", "lesson", "question", "chat"]
+    assert rejected == "queue_full"
+
+    monkeypatch.setattr(server, "get_admission_controller", lambda: controller)
+    _install_fake_agent(["Namaste means hello."] * 10)
+    client = TestClient(server.app)
+    ask = {"query": "What does namaste mean?", "language": "Sanskrit"}
+    monkeypatch.setattr(admission, "ADMISSION_CLIENT_ID_SECRET", "shared-secret")
+    student_a, student_b = {"X-Client-ID": sign_client_id("a")}, {"X-Client-ID": sign_client_id("b")}
+    # Requests that fail validation never reach the model, so they do not use up the client's tokens.
+    no_language = {"query": "Teach me", "lesson_to_teach": 1}
+    assert [client.post("/chat", json=no_language, headers=student_a).status_code for _ in range(5)] == [400] * 5
+    assert [client.post("/chat", json=ask, headers=student_a).status_code for _ in range(3)] == [200] * 3
+    response = client.post("/chat/stream", json=ask, headers=student_a)
+    assert response.status_code == 429
+    assert response.json()["reason"] == "client_rate_limited"
+    assert int(response.headers["Retry-After"]) >= 1
+    assert client.post("/chat", json=ask, headers=student_b).status_code == 200
+    assert controller.get_stats()["rejected_client_rate"] == 1
+
+    # Unsigned IDs and forwarded-for headers are the caller's own choice, so they all share the IP's bucket.
+    spoofed = [{"X-Client-ID": f"fresh-{i}", "X-Forwarded-For": f"10.0.0.{i}"} for i in range(4)]
+    assert [client.post("/chat", json=ask, headers=h).status_code for h in spoofed] == [200, 200, 200, 429]
+
+
+def test_client_key_trusts_only_signed_ids_and_configured_proxies():
+    """X-Client-ID needs a valid signature; X-Forwarded-For is followed only through trusted proxies."""
+    signed = sign_client_id("student-1", secret="s3cret")
+    assert admission.client_key("203.0.113.9", {"x-client-id": signed}, secret="s3cret") == "id:student-1"
+    assert admission.client_key("203.0.113.9", {"x-client-id": signed}, secret="other") == "ip:203.0.113.9"
+    assert admission.client_key("203.0.113.9", {"x-client-id": "student-1.forged"}, secret="s3cret") == "ip:203.0.113.9"
+
+    forwarded = {"x-forwarded-for": "1.2.3.4, 198.51.100.7, 10.0.0.2"}
+    assert admission.client_key("203.0.113.9", forwarded, trusted_proxies=["10.0.0.0/8"], secret="") == "ip:203.0.113.9"
+    assert admission.client_key("10.0.0.1", forwarded, trusted_proxies=["10.0.0.0/8"], secret="") == "ip:198.51.100.7"
+    assert admission.client_key("10.0.0.1", forwarded, trusted_proxies=[], secret="") == "ip:10.0.0.1"
+
+
+def test_session_history_is_kept_by_the_server_within_budget(monkeypatch):
+    """Turns sent with a session_id are remembered server-side and rendered within the token budget."""
+    store = SessionStore(InMemorySessionBackend(max_sessions=2), history_token_budget=120)
+    monkeypatch.setattr(server, "get_session_store", lambda: store)
+    inputs = []
+
+    def agent(x):
+        inputs.append(x)
+        return f"Answer {len(inputs)}: " + "sandhi joins sounds " * 40
+
+    server.agent_chains.clear()
+    server.agent_chains.update({"agent": RunnableLambda(agent), "curriculum": RunnableLambda(lambda x: "unused")})
+    client = TestClient(server.app)
+    for question in ["What is sandhi?", "Give an example", "And visarga sandhi?"]:
+        assert client.post("/chat", json={"query": question, "language": "Sanskrit",
+                                          "session_id": "s1"}).status_code == 200
+
+    assert inputs[0]["history"] == "(none)"
+    assert "Student: What is sandhi?\nTutor: Answer 1" in inputs[1]["history"]
+    assert "Student: Give an example" in inputs[2]["history"]
+    assert all(estimate_tokens(x["history"]) <= 120 for x in inputs)
+    assert len(store.history("s1")) == 3
+
+    # Older clients that send the previous turn themselves still get it into the prompt.
+    client.post("/chat", json={"query": "Hi", "language": "Sanskrit", "previous_query": "Hello",
+                               "previous_response": "Namaste!"})
+    assert inputs[-1]["history"] == "Student: Hello\nTutor: Namaste!"
+
+    # Long conversations keep the newest turns; the store holds at most max_sessions sessions.
+    turns = [{"question": f"Question {i}", "answer": "word " * 500} for i in range(30)]
+    history = render_history(turns, token_budget=200)
+    assert estimate_tokens(history) <= 200 and "Question 29" in history and "Question 0" not in history
+    store.append("s2", "q", "a")
+    store.append("s3", "q", "a")
+    assert store.history("s1") == [] and store.get_stats()["sessions"] == 2
+
+
+def test_memory_session_backend_counts_utf8_bytes():
+    """Devanagari takes 3 bytes a character, and the memory cap is in bytes."""
+    backend = InMemorySessionBackend(max_sessions=10, max_bytes=100)
+    backend.save("s1", "न" * 30, ttl_seconds=0)
+    backend.save("s2", "न" * 30, ttl_seconds=0)
+
+    assert len(backend) == 1 and backend.load("s2") == "न" * 30
+
+
+def test_concurrent_turns_of_one_session_are_all_kept(tmp_path):
+    """Appends racing on one session, in one worker or in two sharing a SQLite file, never drop a turn."""
+    path = str(tmp_path / "sessions.db")
+    for stores in ([SessionStore(InMemorySessionBackend())] * 2,
+                   [SessionStore(SQLiteSessionBackend(path)), SessionStore(SQLiteSessionBackend(path))]):
+        def ask(i):
+            stores[i % 2].append("s1", f"Question {i}", "Answer")
+
+        threads = [threading.Thread(target=ask, args=(i,)) for i in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        questions = sorted(turn["question"] for turn in stores[0].history("s1"))
+        assert questions == sorted(f"Question {i}" for i in range(16))
@@ -0,0 +1,16 @@
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about 4 characters per token); good enough for cost reporting."""
+    return (len(text) + 3) // 4 if text else 0
+
+
+def truncate_to_tokens(text: str, max_tokens: int, marker: str = " …") -> str:
+    """Cuts text to about max_tokens (at a word boundary when there is one nearby)."""
+    if not text or estimate_tokens(text) <= max_tokens:
+        return text or ""
+    if max_tokens <= 0:
+        return ""
+    cut = text[:max(0, max_tokens * 4 - len(marker))]
+    space = cut.rfind(" ")
+    if space > len(cut) * 0.8:
+        cut = cut[:space]
+    return cut.rstrip() + marker